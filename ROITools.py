@@ -37,32 +37,925 @@ TO DO: Updated 1/3/2019
 """
 
 # import statements
-import numpy as np, scipy as sp
-import matplotlib.pyplot as plt
-import skimage
-from skimage import io
-import pims
+# Only light modules are imported here, so batch workers and CLI jobs start fast. pims, scikit-image, scipy and
+# matplotlib are imported by the functions that need them (ROITools.pims etc. still work, see __getattr__)
+import os
+import re
+import time
+import logging
+import contextlib
+from collections.abc import Mapping
+import numpy as np
 #%matplotlib inline
 
+logger = logging.getLogger('ROITools') # debug output of ROITools. Use logging.basicConfig(level=logging.DEBUG) to see it
+
+_LAZY_MODULES = {'pims': 'pims', 'plt': 'matplotlib.pyplot', 'skimage': 'skimage', 'io': 'skimage.io', 'sp': 'scipy'}
+
+
+def __getattr__(name):
+    """Modules ROITools used to import at load time (ROITools.pims, .plt, ...), imported on first access"""
+    if name in _LAZY_MODULES:
+        import importlib
+        module = importlib.import_module(_LAZY_MODULES[name])
+        globals()[name] = module
+        return module
+    raise AttributeError("module 'ROITools' has no attribute '{}'".format(name))
+
+
+#%%
+#### INSTRUMENTATION
+# Per-stage timers and counters for the hot paths. Disabled by default: a disabled stage costs one attribute
+# check, so instrumentation can stay in the code. Enable it for a run with
+#     with ROITools.INSTRUMENTATION.run() as run:
+#         reader.measure_ROIs(image)
+#     print(run.report)
+
+class _Stage:
+    """Context manager timing one stage (used only when instrumentation is enabled)"""
+    __slots__ = ('instrumentation', 'name', 'info', 'start')
+    
+    def __init__(self, instrumentation, name, info):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.info = info
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.instrumentation.record(self.name, time.perf_counter() - self.start, self.info)
+        return False
+
+
+class _Run:
+    """Handle returned by Instrumentation.run(); report is filled in when the run ends"""
+    def __init__(self):
+        self.report = None
+
+
+class Instrumentation:
+    """
+    Per-stage timers and counters for ROITools.
+    Stages: 'rasterize', 'read_frame', 'mask', 'reduce', 'write', 'hash' (ResultCache keys of image content)
+    and 'pyramid' (building ImagePyramid levels). Counters: 'rois', 'frames', ...
+    Stage times are summed over calls (frames read by FrameSource workers are timed in their threads,
+    so 'read_frame' can exceed wall time when reads overlap).
+    
+    Hooks are called as hook(stage, seconds, info) after every timed stage, e.g. to feed a progress bar
+    or an external profiler. Everything is a no-op while disabled.
+    """
+    
+    STAGES = ('rasterize', 'read_frame', 'mask', 'reduce', 'write', 'hash', 'pyramid')
+    _NULL_STAGE = contextlib.nullcontext()
+    
+    def __init__(self):
+        import threading
+        
+        self.enabled = False
+        self.hooks = []
+        self._lock = threading.Lock()
+        self.reset()
+        return
+    
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+    
+    def enable(self):
+        self.enabled = True
+    
+    def disable(self):
+        self.enabled = False
+    
+    def add_hook(self, hook):
+        """Register hook(stage, seconds, info), called after each timed stage while enabled"""
+        self.hooks.append(hook)
+        return hook
+    
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+    
+    def stage(self, name, **info):
+        """Context manager timing a stage. Free (shared null context) while disabled"""
+        if not self.enabled:
+            return self._NULL_STAGE
+        return _Stage(self, name, info)
+    
+    def timed(self, name):
+        """Decorator timing every call of a function as stage name"""
+        import functools
+        
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Stage(self, name, {'function': function.__name__}):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+    
+    def count(self, name, n=1):
+        """Increase counter name by n"""
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+    
+    def record(self, name, seconds, info=None):
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+        for hook in self.hooks:
+            hook(name, seconds, info or {})
+    
+    def report(self, wall_seconds=None):
+        """
+        Breakdown of where time went: seconds, calls and share of the total timed time per stage, and counters.
+        RETURNS: dict
+        """
+        total = sum(self.seconds.values())
+        stages = {name: {'seconds': seconds, 'calls': self.calls[name],
+                         'share': seconds / total if total else 0.0}
+                  for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])}
+        return {'wall_seconds': wall_seconds, 'stages': stages, 'counters': dict(self.counters)}
+    
+    @contextlib.contextmanager
+    def run(self, profile=False, hooks=()):
+        """
+        Instrument everything inside the with block: resets timers, enables instrumentation and, at the end,
+        stores the breakdown in run.report and logs it at INFO level.
+        profile: also run cProfile and add the 25 most expensive functions to run.report['profile']
+        hooks: hooks active only for this run
+        """
+        handle = _Run()
+        self.reset()
+        added = [self.add_hook(hook) for hook in hooks]
+        profiler = None
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
+        was_enabled = self.enabled
+        self.enable()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield handle
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall = time.perf_counter() - start
+            self.enabled = was_enabled
+            for hook in added:
+                self.remove_hook(hook)
+            handle.report = self.report(wall)
+            if profiler is not None:
+                import io, pstats
+                text = io.StringIO()
+                pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(25)
+                handle.report['profile'] = text.getvalue()
+            for name, stage in handle.report['stages'].items():
+                logger.info("%-12s %9.4f s %7d calls %5.1f%%", name, stage['seconds'], stage['calls'], 100 * stage['share'])
+            logger.info("wall time %.4f s, counters %s", wall, handle.report['counters'])
+
+
+INSTRUMENTATION = Instrumentation() # module-wide instrumentation used by all ROITools hot paths
+
+#%%
+#### MEASUREMENT ENGINE
+# Statistics are computed on gathered pixel values with shape (frames, [channels,] pixels)
+# and reduce along the last (pixel) axis.
+
+_STATISTICS = {
+    'mean': lambda values: values.mean(axis=-1),
+    'std': lambda values: values.std(axis=-1),
+    'min': lambda values: values.min(axis=-1),
+    'max': lambda values: values.max(axis=-1),
+    'sum': lambda values: values.sum(axis=-1), # integrated density
+    'count': lambda values: np.full(values.shape[:-1], values.shape[-1]),
+    }
+# order statistics: 'median', '##-percentile' (e.g. '95-percentile', '2.5-percentile'),
+# 'quantiles' (quartiles) and '<n>-quantiles' (the n - 1 cut points, e.g. '10-quantiles' for deciles)
+_PERCENTILE = re.compile(r'^(\d+(?:\.\d*)?)-percentile$')
+_QUANTILES = re.compile(r'^(?:(\d+)-)?quantiles$')
+
+
+def _percentile_of(measurement):
+    """Percentile (0-100) computed by an order statistic measurement, None for other measurements"""
+    if measurement == 'median':
+        return 50.0
+    match = _PERCENTILE.match(measurement)
+    if match and float(match.group(1)) <= 100:
+        return float(match.group(1))
+    return None
+
+
+def _expand_measurements(measurements):
+    """
+    Normalize requested measurements: a single name becomes a tuple and 'quantiles'/'<n>-quantiles' are
+    replaced by their '##-percentile' cut points. Raises ValueError for unknown measurements.
+    """
+    if isinstance(measurements, str):
+        measurements = (measurements,)
+    expanded = []
+    for m in measurements:
+        match = _QUANTILES.match(m)
+        if match:
+            n = int(match.group(1) or 4)
+            expanded.extend('{:g}-percentile'.format(100 * k / n) for k in range(1, n))
+        elif m in _STATISTICS or _percentile_of(m) is not None:
+            expanded.append(m)
+        else:
+            raise ValueError("Unknown measurement '{}'. Available: {}, 'median', '##-percentile', 'quantiles', "
+                             "'<n>-quantiles'".format(m, list(_STATISTICS)))
+    return tuple(dict.fromkeys(expanded)) # drop duplicates, keep order
+
+
+def _order_statistics(values, offsets, percentiles):
+    """
+    Percentiles (0-100, linear interpolation as np.percentile) of every segment of the pixel axis.
+    INPUTS:
+        values: array of shape (frames, [channels,] pixels)
+        offsets: boundaries of the segments along the pixel axis (see _roi_index)
+        percentiles: percentiles to compute
+    RETURNS: array of shape (frames, [channels,] segments, percentiles), nan for empty segments
+    
+    Integer images up to 16 bit use a histogram: a bincount over (frame, segment, grey level) followed
+    by a cumulative sum is the cumulative histogram of every segment, and each percentile is one searchsorted
+    in it. That is exact and O(pixels + grey levels), whatever the number of percentiles. Other images (or
+    integer ranges wider than the number of pixels per segment) use one partition per segment for all percentiles.
+    Histograms are built for blocks of segments and frames, so their bins take about as much memory as the pixels.
+    """
+    q = np.asarray(percentiles, dtype=np.float64) / 100
+    counts = np.diff(offsets)
+    out = np.full(values.shape[:-1] + (len(counts), q.size), np.nan)
+    rows = values.reshape(-1, values.shape[-1])[:, offsets[0]:offsets[-1]]
+    if rows.size == 0:
+        return out
+    flat = out.reshape(rows.shape[0], len(counts), q.size)
+    
+    if values.dtype.kind in 'ui' and values.dtype.itemsize <= 2:
+        low = int(rows.min())
+        levels = int(rows.max()) - low + 1
+        n_groups = rows.shape[0] * len(counts)
+        # the histogram pays O(groups * levels) once, a partition pays O(pixels) per percentile
+        if levels <= 256 or n_groups * levels <= min(rows.size * min(q.size, 8), 1 << 25):
+            # groups are histogrammed in blocks of segments and frames, so the bins (bincount and its int64
+            # cumsum) take about as many bytes as the pixels, not n_groups * levels
+            budget = max(rows.size * rows.itemsize // 8, levels, 1 << 16)
+            segment_step = max(1, budget // levels)
+            for first in range(0, len(counts), segment_step):
+                last = min(first + segment_step, len(counts))
+                block = rows[:, offsets[first] - offsets[0]:offsets[last] - offsets[0]]
+                frame_step = max(1, budget // ((last - first) * levels))
+                for start in range(0, rows.shape[0], frame_step):
+                    flat[start:start + frame_step, first:last] = _histogram_order(
+                        block[start:start + frame_step], counts[first:last], q, low, levels)
+            return out
+    
+    for i in np.nonzero(counts)[0]: # one partition per segment for all percentiles
+        segment = rows[:, offsets[i] - offsets[0]:offsets[i + 1] - offsets[0]]
+        rank = (counts[i] - 1) * q
+        below, above = np.floor(rank).astype(np.intp), np.ceil(rank).astype(np.intp)
+        segment = np.partition(segment, np.union1d(below, above), axis=-1)
+        low, high = segment[:, below].astype(np.float64), segment[:, above].astype(np.float64)
+        flat[:, i] = low + (rank - below) * (high - low)
+    return out
+
+
+def _histogram_order(rows, counts, q, low, levels):
+    """
+    Percentiles of _order_statistics() from cumulative histograms, for integer rows (frames, pixels) with
+    grey levels in [low, low + levels). RETURNS: array (frames, segments, percentiles)
+    """
+    n_groups = rows.shape[0] * len(counts)
+    # histogram bin of every pixel: group (frame, segment) g covers bins [g * levels, (g + 1) * levels).
+    # Built in place in the smallest index type, the temporaries cost more than the bincount itself
+    key_type = np.int32 if n_groups * levels < 2 ** 31 else np.intp
+    key = rows.astype(key_type, order='C')
+    key += (np.repeat(np.arange(len(counts)), counts) * levels - low).astype(key_type)
+    key += (np.arange(rows.shape[0]) * (len(counts) * levels)).astype(key_type)[:, None]
+    # cumulative histogram of all groups in one array, the counts of group g start at the size of the groups before it
+    cdf = np.bincount(key.ravel(), minlength=n_groups * levels).cumsum()
+    del key
+    sizes = np.tile(counts, rows.shape[0])
+    before = np.cumsum(sizes) - sizes
+    rank = np.outer(np.maximum(sizes - 1, 0), q) # (groups, percentiles) fractional rank
+    below, above = np.floor(rank).astype(np.intp), np.ceil(rank).astype(np.intp)
+    base = np.arange(n_groups)[:, None] * levels
+    value_below = np.searchsorted(cdf, before[:, None] + below, side='right') - base
+    value_above = np.searchsorted(cdf, before[:, None] + above, side='right') - base
+    result = low + value_below + (rank - below) * (value_above - value_below)
+    result[sizes == 0] = np.nan
+    return result.reshape(rows.shape[0], len(counts), q.size)
+
+
+@INSTRUMENTATION.timed('reduce')
+def _summarize(values, measurements):
+    """
+    Reduce gathered pixel values along the pixel axis.
+    INPUTS:
+        values: array of shape (frames, [channels,] pixels)
+        measurements: names of the statistics to compute (see _expand_measurements)
+    RETURNS: dict of measurement name -> array of shape (frames, [channels])
+    """
+    measurements = _expand_measurements(measurements)
+    if values.shape[-1] == 0: # ROI does not overlap the image
+        return {m: np.zeros(values.shape[:-1]) if m in ('count', 'sum') else np.full(values.shape[:-1], np.nan)
+                for m in measurements}
+    order = [m for m in measurements if _percentile_of(m) is not None]
+    if order: # all percentiles from a single partition/histogram
+        percentiles = _order_statistics(values, np.array([0, values.shape[-1]]), [_percentile_of(m) for m in order])
+        order = dict(zip(order, np.moveaxis(percentiles[..., 0, :], -1, 0)))
+    return {m: order[m] if m in order else _STATISTICS[m](values) for m in measurements}
+
+
+def _open_frames(image, axis=0, bundle_axes='yx'):
+    """
+    Prepare an ndarray or PIMS object for iteration over frames.
+    For ndarrays, axis is moved to the front. Arrays with named axes (.axes, see open_memmap()) also accept
+    axis and bundle_axes by name. For PIMS objects, axis sets iter_axes if it is a string
+    (otherwise the axes already set with set_axes() are kept), bundle_axes is applied and the reader is
+    wrapped in a prefetching FrameSource. A FrameSource is used as is, with the axes it was configured with.
+    RETURNS: (stack, n_frames, plane_shape) where stack is an ndarray with frames on axis 0 or a FrameSource
+    """
+    # PIMS ND readers also define shape, so test them first
+    if hasattr(image, 'frame_shape'): # then is PIMS object
+        if not isinstance(image, FrameSource):
+            if isinstance(axis, str):
+                image.iter_axes = axis # set iteration axis
+            image.bundle_axes = bundle_axes # bundle axes. KWarg to alter this if needed
+            image = FrameSource(image)
+        return image, len(image), tuple(image.frame_shape[-2:])
+    elif hasattr(image, 'shape'): # then is an array
+        if isinstance(axis, str): # named axes (memmaps from open_memmap()), axes are picked like PIMS does
+            if getattr(image, 'axes', None) is None:
+                raise ValueError("axis '{}' given by name, but the array has no named axes".format(axis))
+            stack = _select_axes(image, axis, bundle_axes)
+            return stack, stack.shape[0], tuple(stack.shape[-2:])
+        stack = np.moveaxis(np.asanyarray(image), axis, 0) # move given axis to the front to prepare for iterations
+        return stack, stack.shape[0], tuple(stack.shape[-2:])
+    raise TypeError("Expected an ndarray or PIMS object, got {}".format(type(image)))
+
+
+def _iter_frame_chunks(stack, n_frames, chunk_size):
+    """
+    Yield (start, chunk) with chunk an ndarray of up to chunk_size consecutive frames.
+    ndarray stacks are sliced without copying, PIMS frames are read once each and stacked
+    """
+    if isinstance(stack, np.ndarray):
+        for start in range(0, n_frames, chunk_size):
+            yield start, stack[start:start + chunk_size]
+        return
+    start, chunk = 0, []
+    for frame in stack:
+        chunk.append(np.asarray(frame))
+        if len(chunk) == chunk_size:
+            yield start, np.stack(chunk)
+            start, chunk = start + len(chunk), []
+    if chunk:
+        yield start, np.stack(chunk)
+
+
+def _position_axis(image, axis, position=None):
+    """
+    Which ROI position ('z', 't' or 'c') selects the frames an ROI is measured on when iterating over axis.
+    position overrides the guess (False: no restriction). Named axes are used as is, a single PIMS iter_axes
+    too, and numbered ndarray axes and plain PIMS sequences are taken as z (ImageJ stores the stack slice of
+    plain stacks as z).
+    RETURNS: 'z', 't', 'c' or None
+    """
+    if position is not None:
+        return position or None
+    if not isinstance(axis, str):
+        iter_axes = getattr(getattr(image, 'reader', image), 'iter_axes', None)
+        if not iter_axes: # ndarray or plain PIMS sequence
+            axis = 'z'
+        elif len(iter_axes) == 1:
+            axis = iter_axes[0]
+    return axis if axis in ('z', 't', 'c') else None
+
+
+def _iter_plane_chunks(stack, frames, chunk_size):
+    """
+    Like _iter_frame_chunks() for a sorted subset of frames: planes that are not listed are never read.
+    RETURNS: generator of (frame numbers, chunk)
+    """
+    frames = np.asarray(frames, dtype=np.intp)
+    if not isinstance(stack, np.ndarray):
+        planes = stack.iter_frames(frames) # one prefetching pass over all of them
+    for start in range(0, len(frames), chunk_size):
+        selected = frames[start:start + chunk_size]
+        if not isinstance(stack, np.ndarray):
+            yield selected, np.stack([np.asarray(next(planes)) for _ in selected])
+        elif selected[-1] - selected[0] == len(selected) - 1: # consecutive, slice without copying
+            yield selected, stack[selected[0]:selected[-1] + 1]
+        else:
+            yield selected, stack[selected]
+
+
+@INSTRUMENTATION.timed('mask')
+def _roi_index(rois, plane_shape):
+    """
+    Build a sparse index of the measured pixels of several ROIs in an xy plane.
+    Every ROI gets its own contiguous segment so overlapping ROIs each keep their shared pixels.
+    RETURNS: (flat_index, offsets). Pixels of rois[i] are flat_index[offsets[i]:offsets[i + 1]]
+    """
+    segments = [np.ravel_multi_index(roi._measured_pixels(plane_shape), plane_shape) for roi in rois]
+    offsets = np.zeros(len(segments) + 1, dtype=np.intp)
+    offsets[1:] = np.cumsum([len(seg) for seg in segments])
+    flat_index = np.concatenate(segments).astype(np.intp) if segments else np.zeros(0, dtype=np.intp)
+    return flat_index, offsets
+
+
+def _plane_index(rois, position, n_frames):
+    """
+    Index ROIs by the planes they are bound to along position ('z', 't' or 'c', see ROI.planes()).
+    RETURNS: (unbound, by_plane) with the numbers of the ROIs measured on every frame, and a dict of
+        frame number -> numbers of the ROIs measured only on some planes, including that one
+    """
+    unbound, by_plane = [], {}
+    for i, roi in enumerate(rois):
+        planes = roi.planes(position, n_frames) if position else None
+        if planes is None:
+            unbound.append(i)
+            continue
+        for plane in planes.tolist():
+            by_plane.setdefault(plane, []).append(i)
+    return np.array(unbound, dtype=np.intp), {p: np.array(i, dtype=np.intp) for p, i in by_plane.items()}
+
+
+def _roi_major(stat):
+    """(frames, [channels,] rois) statistics -> (rois * frames, [channels]), rows grouped by ROI"""
+    return np.moveaxis(stat, -1, 0).reshape((-1,) + stat.shape[1:-1])
+
+
+def _pieces_table(pieces, roi_names, measurements, frame_major=False):
+    """
+    Measurement table of the rows of several (ROI numbers, frame numbers, {measurement: (rows, [channels])})
+    pieces, sorted by ROI then frame (frame then ROI if frame_major), with 'name' and 'frame' columns
+    """
+    roi_numbers = np.concatenate([piece[0] for piece in pieces])
+    frame_numbers = np.concatenate([piece[1] for piece in pieces])
+    order = np.lexsort((roi_numbers, frame_numbers) if frame_major else (frame_numbers, roi_numbers))
+    stats = {m: np.concatenate([piece[2][m] for piece in pieces])[order] for m in measurements}
+    table = _measurement_table(stats, measurements)
+    table.insert(0, 'frame', frame_numbers[order])
+    table.insert(0, 'name', roi_names[roi_numbers[order]])
+    return table
+
+
+@INSTRUMENTATION.timed('reduce')
+def _summarize_segments(values, offsets, measurements):
+    """
+    Labeled version of _summarize(). values has shape (frames, [channels,] pixels) where the pixel axis is
+    the concatenation of per-ROI segments delimited by offsets (see _roi_index).
+    RETURNS: dict of measurement name -> array of shape (frames, [channels,] rois)
+    """
+    measurements = _expand_measurements(measurements)
+    counts = np.diff(offsets)
+    filled = np.nonzero(counts)[0] # reduceat cannot express empty segments
+    starts = offsets[:-1][filled]
+    out_shape = values.shape[:-1] + (len(counts),)
+    
+    def scatter(reduced, fill=np.nan):
+        out = np.full(out_shape, fill, dtype=np.float64)
+        out[..., filled] = reduced
+        return out
+    
+    stats = {}
+    if filled.size == 0:
+        return {m: np.zeros(out_shape) if m in ('count', 'sum') else np.full(out_shape, np.nan) for m in measurements}
+    sums = np.add.reduceat(values, starts, axis=-1, dtype=np.float64)
+    means = sums / counts[filled]
+    order = [m for m in measurements if _percentile_of(m) is not None]
+    if order: # all percentiles of all ROIs in one labeled pass
+        percentiles = _order_statistics(values, offsets, [_percentile_of(m) for m in order])
+        order = dict(zip(order, np.moveaxis(percentiles, -1, 0)))
+    for m in measurements:
+        if m == 'sum':
+            stats[m] = scatter(sums, fill=0)
+        elif m == 'mean':
+            stats[m] = scatter(means)
+        elif m == 'count':
+            stats[m] = np.broadcast_to(counts, out_shape).astype(np.float64)
+        elif m == 'std': # two-pass, deviations from each ROI's own mean
+            deviations = values[..., offsets[0]:offsets[-1]] - np.repeat(means, counts[filled], axis=-1)
+            stats[m] = scatter(np.sqrt(np.add.reduceat(deviations ** 2, starts, axis=-1) / counts[filled]))
+        elif m == 'min':
+            stats[m] = scatter(np.minimum.reduceat(values, starts, axis=-1))
+        elif m == 'max':
+            stats[m] = scatter(np.maximum.reduceat(values, starts, axis=-1))
+        else:
+            stats[m] = order[m]
+    return stats
+
+
+def _clip_bbox(bbox, bbox_mask, frame_shape=None):
+    """Clip a bounding box and its local mask to a frame of shape (height, width). No-op if frame_shape is None"""
+    if frame_shape is None:
+        return bbox, bbox_mask
+    top, left, bottom, right = bbox
+    height, width = frame_shape[-2:]
+    r0, r1 = min(max(top, 0), height), min(max(bottom, 0), height)
+    c0, c1 = min(max(left, 0), width), min(max(right, 0), width)
+    if r0 >= r1 or c0 >= c1:
+        return (0, 0, 0, 0), np.zeros((0, 0), dtype=bool)
+    return (r0, c0, r1, c1), bbox_mask[r0 - top:r1 - top, c0 - left:c1 - left]
+
+
+def _masked_view(image, xyMask):
+    """
+    Mask image with a 2D mask without materializing an nD mask.
+    ndarrays/memmaps: MaskedArray over the original data with a read-only broadcast view of xyMask as mask.
+    PIMS objects: lazy pipeline returning one such MaskedArray per frame as it is read
+    """
+    import numpy.ma as ma
+    
+    def mask_frame(frame):
+        frame = np.asanyarray(frame)
+        return ma.masked_array(frame, mask=np.broadcast_to(xyMask, frame.shape), copy=False)
+    
+    if hasattr(image, 'frame_shape'):
+        import pims
+        return pims.pipeline(mask_frame)(image)
+    return mask_frame(image)
+
+
+def _measurement_table(stats, measurements):
+    """
+    Build the measurement DataFrame once from reduced statistics.
+    Rows are frames; extra (channel) dimensions become '<measurement>_c<i>' columns
+    """
+    from pandas import DataFrame
+    
+    columns = {}
+    for m in measurements:
+        stat = np.asarray(stats[m])
+        if stat.ndim <= 1:
+            columns[m] = stat
+        else:
+            stat = stat.reshape(stat.shape[0], -1)
+            for c in range(stat.shape[1]):
+                columns["{}_c{}".format(m, c)] = stat[:, c]
+    return DataFrame(columns)
+
+#%%
+#### IMAGE BACKENDS
+# Uncompressed TIFF and raw stacks are opened as read-only np.memmap views instead of being read into memory.
+# Indexing a memmap only reads the pages it touches, so measuring a small ROI reads the ROI bounding box of
+# each plane and not the whole stack. Memmaps carry their axis names in .axes (e.g. 'tzcyx'), so axes can be
+# selected by name as with PIMS readers.
+
+# tifffile axis codes -> ROITools/PIMS axis names. Generic sequences ('Q', 'I') iterate like PIMS frames ('t')
+_TIFF_AXES = {'T': 't', 'Z': 'z', 'C': 'c', 'Y': 'y', 'X': 'x', 'S': 'c', 'Q': 't', 'I': 't'}
+_RAW_AXES = {2: 'yx', 3: 'zyx', 4: 'zcyx', 5: 'tzcyx'} # default axes of raw files by number of dimensions
+
+
+def open_memmap(path, shape=None, dtype=None, offset=0, axes=None, order='C'):
+    """
+    Open an uncompressed TIFF or raw image stack as a read-only np.memmap (no pixel data is read).
+    INPUTS:
+        path: .tif/.tiff file, or a raw file (then shape and dtype are required)
+        shape, dtype, offset, order: layout of a raw file (offset = header size in bytes)
+        axes: axis names, one letter per dimension ('zyx', 'tzcyx', ...). Read from the file for TIFF
+            (ImageJ hyperstacks: 'tzcyx'). Raw files default to 'yx', 'zyx', 'zcyx' or 'tzcyx' by dimensions
+    RETURNS: np.memmap with an extra .axes attribute
+    Raises ValueError if the TIFF pixel data is compressed or not contiguous (use pims.open() for those)
+    """
+    if path.lower().endswith(('.tif', '.tiff')):
+        import tifffile
+        
+        with tifffile.TiffFile(path) as tif:
+            series = tif.series[0]
+            offset = series.dataoffset
+            if offset is None:
+                raise ValueError("'{}' is compressed or not contiguous and can not be memory-mapped".format(path))
+            shape, dtype = series.shape, np.dtype(series.dtype).newbyteorder(tif.byteorder)
+            if axes is None:
+                axes = ''.join(_TIFF_AXES.get(a, a.lower()) for a in series.axes)
+    elif shape is None or dtype is None:
+        raise ValueError("shape and dtype are required to memory-map raw file '{}'".format(path))
+    
+    stack = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=tuple(shape), order=order)
+    stack.axes = axes if axes is not None else _RAW_AXES.get(stack.ndim)
+    if stack.axes is None:
+        raise ValueError("axes are required to memory-map a {}D raw file".format(stack.ndim))
+    if len(stack.axes) != stack.ndim:
+        raise ValueError("axes '{}' do not match the {} dimensions of '{}'".format(stack.axes, stack.ndim, path))
+    return stack
+
+
+def open_image(path):
+    """
+    Open an image file: memory-mapped if it is an uncompressed TIFF (see open_memmap()), with PIMS otherwise
+    """
+    if path.lower().endswith(('.tif', '.tiff')):
+        try:
+            return open_memmap(path)
+        except ValueError: # compressed or tiled, read frame by frame instead
+            logger.debug("open_image(): '%s' can not be memory-mapped, opening with PIMS", path)
+    import pims
+    return pims.open(path)
+
+
+def _select_axes(image, axis, bundle_axes):
+    """
+    Order an ndarray with named axes (.axes) as (axis, *bundle_axes), without copying.
+    Axes that are neither iterated nor bundled are fixed at coordinate 0, like PIMS default_coords.
+    Bundle axes missing from the image are ignored.
+    """
+    axes = image.axes
+    if len(axis) != 1 or axis not in axes:
+        raise ValueError("Can not iterate over axis '{}' of an image with axes '{}'".format(axis, axes))
+    wanted = axis + ''.join(a for a in bundle_axes if a in axes and a != axis)
+    view = image[tuple(slice(None) if a in wanted else 0 for a in axes)]
+    kept = [a for a in axes if a in wanted]
+    return view.transpose([kept.index(a) for a in wanted])
+
+
+#%%
+#### RASTERIZATION ENGINE
+# Turns read_roi dicts into a bounding box (top, left, bottom, right; bottom/right exclusive) and a boolean
+# mask local to that box. Polygon-like ROIs are filled like ImageJ does: a pixel belongs to the ROI if its
+# center (c + 0.5, r + 0.5) lies inside the outline (even-odd rule), so a polygon drawn along a rectangle
+# covers the same pixels as the rectangle ROI. skimage.draw.polygon also includes pixels lying on the outline.
+# Ovals are unchanged from skimage.draw.ellipse(top + h/2, left + w/2, h/2, w/2).
+
+_EMPTY_RASTER = ((0, 0, 0, 0), np.zeros((0, 0), dtype=bool))
+
+
+def _scanline_fill(polygons):
+    """
+    Even-odd scanline fill of many polygons at once, testing pixel centers.
+    INPUTS:
+        polygons: list with one entry per ROI, each a list of closed paths given as (x, y) vertex arrays.
+            Paths of the same ROI are combined with the even-odd rule, so inner paths are holes
+    RETURNS: list of (bbox, bbox_mask), one per entry of polygons
+    
+    Every edge is expanded into its scanline crossings, all crossings of all polygons are sorted once and
+    consecutive crossings on a row become filled spans. Spans are painted into one flat buffer holding all
+    bbox masks as +1/-1 steps, so a single cumulative sum fills every mask.
+    """
+    x0, y0, x1, y1, owner = [], [], [], [], []
+    for i, paths in enumerate(polygons):
+        for x, y in paths: # shift by half a pixel so that integer rows/columns are pixel centers
+            x, y = np.asarray(x, dtype=np.float64) - 0.5, np.asarray(y, dtype=np.float64) - 0.5
+            if x.size < 3:
+                continue
+            x0.append(x)
+            y0.append(y)
+            x1.append(np.roll(x, -1))
+            y1.append(np.roll(y, -1))
+            owner.append(np.full(x.size, i))
+    results = [_EMPTY_RASTER] * len(polygons)
+    if not owner:
+        return results
+    x0, y0, x1, y1, owner = (np.concatenate(a) for a in (x0, y0, x1, y1, owner))
+    
+    # an edge crosses rows r with min(y0, y1) <= r < max(y0, y1) (half-open, so vertices are counted once)
+    first = np.ceil(np.minimum(y0, y1)).astype(np.intp)
+    counts = np.ceil(np.maximum(y0, y1)).astype(np.intp) - first
+    edge = np.repeat(np.arange(counts.size), counts)
+    rows = first[edge] + (np.arange(edge.size) - np.repeat(np.cumsum(counts) - counts, counts))
+    cross = x0[edge] + (rows - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    owner = owner[edge]
+    
+    # sort crossings by polygon, row, x. Every (polygon, row) has an even number of crossings,
+    # so pairs of consecutive crossings are the filled spans [ceil(xa), ceil(xb))
+    order = np.lexsort((cross, rows, owner))
+    cross, rows, owner = cross[order], rows[order], owner[order]
+    start = np.ceil(cross[0::2]).astype(np.intp)
+    stop = np.ceil(cross[1::2]).astype(np.intp)
+    rows, owner = rows[0::2], owner[0::2]
+    filled = stop > start
+    start, stop, rows, owner = start[filled], stop[filled], rows[filled], owner[filled]
+    if owner.size == 0:
+        return results
+    
+    # bounding box of each polygon from its spans (spans are grouped by owner)
+    ids, group_start = np.unique(owner, return_index=True)
+    top = rows[group_start]
+    bottom = np.maximum.reduceat(rows, group_start) + 1
+    left = np.minimum.reduceat(start, group_start)
+    right = np.maximum.reduceat(stop, group_start)
+    width = right - left + 1 # one spare column per row holds the -1 step of spans ending at right
+    sizes = (bottom - top) * width
+    base = np.cumsum(sizes) - sizes
+    
+    # paint +1/-1 steps. Each row sums to zero, so one cumulative sum over all masks fills every span
+    group = np.searchsorted(group_start, np.arange(owner.size), side='right') - 1
+    row_base = base[group] + (rows - top[group]) * width[group]
+    steps = np.zeros(sizes.sum(), dtype=np.int32)
+    np.add.at(steps, row_base + start - left[group], 1)
+    np.add.at(steps, row_base + stop - left[group], -1)
+    inside = np.cumsum(steps) > 0
+    
+    for g, i in enumerate(ids):
+        mask = inside[base[g]:base[g] + sizes[g]].reshape(bottom[g] - top[g], width[g])[:, :-1]
+        results[i] = ((int(top[g]), int(left[g]), int(bottom[g]), int(right[g])), mask)
+    return results
+
+
+def _raster_rectangle(roi):
+    top, left = int(roi['top']), int(roi['left'])
+    height, width = int(roi['height']), int(roi['width'])
+    if height <= 0 or width <= 0:
+        return _EMPTY_RASTER
+    return (top, left, top + height, left + width), np.ones((height, width), dtype=bool)
+
+
+def _raster_oval(roi):
+    """Same pixels as skimage.draw.ellipse for the oval's bounding box"""
+    r_radius, c_radius = roi['height'] / 2, roi['width'] / 2
+    r, c = roi['top'] + r_radius, roi['left'] + c_radius
+    if r_radius <= 0 or c_radius <= 0:
+        return _EMPTY_RASTER
+    top, left = int(np.ceil(r - r_radius)), int(np.ceil(c - c_radius))
+    bottom, right = int(np.floor(r + r_radius)) + 1, int(np.floor(c + c_radius)) + 1
+    rr, cc = np.ogrid[top:bottom, left:right]
+    mask = ((rr - r) / r_radius) ** 2 + ((cc - c) / c_radius) ** 2 < 1
+    # trim rows/columns of the box that the strict inequality left empty
+    rows, cols = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+    if rows.size == 0:
+        return _EMPTY_RASTER
+    mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    return (top + int(rows[0]), left + int(cols[0]), top + int(rows[-1]) + 1, left + int(cols[-1]) + 1), mask
+
+
+def _raster_pixels(rr, cc):
+    """bbox and mask of a set of pixel coordinates (lines, points)"""
+    rr, cc = np.asarray(rr, dtype=np.intp), np.asarray(cc, dtype=np.intp)
+    if rr.size == 0:
+        return _EMPTY_RASTER
+    top, left = rr.min(), cc.min()
+    mask = np.zeros((rr.max() - top + 1, cc.max() - left + 1), dtype=bool)
+    mask[rr - top, cc - left] = True
+    return (int(top), int(left), int(top + mask.shape[0]), int(left + mask.shape[1])), mask
+
+
+def _line_pixels(x, y):
+    """Pixels of a 1 pixel wide path through the (x, y) vertices"""
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if x.size == 1:
+        return np.round(y), np.round(x)
+    steps = np.maximum(np.ceil(np.maximum(np.abs(np.diff(x)), np.abs(np.diff(y)))), 1).astype(np.intp)
+    segment = np.repeat(np.arange(steps.size), steps)
+    t = (np.arange(segment.size) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+    xs = np.append(x[segment] + t * np.diff(x)[segment], x[-1])
+    ys = np.append(y[segment] + t * np.diff(y)[segment], y[-1])
+    return np.round(ys), np.round(xs)
+
+
+def _thick_line(roi):
+    """Polygon (x, y) of a straight line ROI with a stroke width > 1"""
+    x1, y1, x2, y2 = roi['x1'], roi['y1'], roi['x2'], roi['y2']
+    length = np.hypot(x2 - x1, y2 - y1)
+    if length == 0:
+        return None
+    nx, ny = -(y2 - y1) / length * roi['width'] / 2, (x2 - x1) / length * roi['width'] / 2
+    return np.array([x1 + nx, x2 + nx, x2 - nx, x1 - nx]), np.array([y1 + ny, y2 + ny, y2 - ny, y1 - ny])
+
+
+def _ellipse_polygon(roi):
+    """Polygon (x, y) of an ImageJ EllipseRoi (freehand subtype) from its major axis and aspect ratio"""
+    ex1, ey1, ex2, ey2 = roi['ex1'], roi['ey1'], roi['ex2'], roi['ey2']
+    major = np.hypot(ex2 - ex1, ey2 - ey1) / 2
+    minor = major * roi['aspect_ratio']
+    angle = np.arctan2(ey2 - ey1, ex2 - ex1)
+    theta = np.linspace(0, 2 * np.pi, int(np.clip(4 * major, 72, 2000)), endpoint=False)
+    x, y = major * np.cos(theta), minor * np.sin(theta)
+    cx, cy = (ex1 + ex2) / 2, (ey1 + ey2) / 2
+    return cx + x * np.cos(angle) - y * np.sin(angle), cy + x * np.sin(angle) + y * np.cos(angle)
+
+
+def _composite_paths(roi):
+    """Closed (x, y) paths of a composite (ShapeRoi). Curve segments are reduced to their end points"""
+    paths = []
+    for path in roi['paths']:
+        points = np.array([segment[-2:] for segment in path], dtype=np.float64)
+        if len(points):
+            paths.append((points[:, 0], points[:, 1]))
+    return paths
+
+
+AREA_TYPES = ('polygon', 'freehand', 'traced', 'freeroi', 'composite')
+PATH_TYPES = ('polyline', 'freeline', 'angle')
+
+
+@INSTRUMENTATION.timed('rasterize')
+def rasterize_rois(rois):
+    """
+    Rasterize many ROIs in one call.
+    Handles rectangle, oval, polygon, freehand (including ellipse ROIs), traced, composite (with holes),
+    line, polyline/freeline/angle (1 pixel wide) and point ROIs. All area ROIs are filled together in
+    one vectorized scanline pass.
+    INPUTS: rois: iterable of read_roi dicts (or 'channel' dicts carrying 'bbox' and 'mask')
+    RETURNS: list of (bbox, bbox_mask), bbox = (top, left, bottom, right) with bottom/right exclusive
+    """
+    rois = list(rois)
+    results = [None] * len(rois)
+    polygons, polygon_index = [], []
+    for i, roi in enumerate(rois):
+        kind = roi['type']
+        if kind == 'rectangle':
+            results[i] = _raster_rectangle(roi)
+        elif kind == 'oval':
+            results[i] = _raster_oval(roi)
+        elif kind == 'channel':
+            results[i] = tuple(roi['bbox']), np.asarray(roi['mask'], dtype=bool)
+        elif kind == 'composite':
+            polygons.append(_composite_paths(roi))
+            polygon_index.append(i)
+        elif kind == 'freehand' and 'ex1' in roi:
+            polygons.append([_ellipse_polygon(roi)])
+            polygon_index.append(i)
+        elif kind in AREA_TYPES:
+            polygons.append([(roi['x'], roi['y'])])
+            polygon_index.append(i)
+        elif kind == 'line' and roi.get('width', 0) > 1 and _thick_line(roi) is not None:
+            polygons.append([_thick_line(roi)])
+            polygon_index.append(i)
+        elif kind == 'line':
+            results[i] = _raster_pixels(*_line_pixels([roi['x1'], roi['x2']], [roi['y1'], roi['y2']]))
+        elif kind in PATH_TYPES:
+            results[i] = _raster_pixels(*_line_pixels(roi['x'], roi['y']))
+        elif kind == 'point':
+            results[i] = _raster_pixels(np.round(roi['y']), np.round(roi['x']))
+        else:
+            raise ValueError("Unsupported ROI type '{}' for ROI '{}'".format(kind, roi.get('name')))
+    for i, raster in zip(polygon_index, _scanline_fill(polygons)):
+        results[i] = raster
+    return results
+
+
+def rasterize(roi):
+    """Rasterize a single ROI (read_roi dict). RETURNS: (bbox, bbox_mask). See rasterize_rois()"""
+    return rasterize_rois([roi])[0]
+
+
+def scale_roi(roi, scale):
+    """
+    Copy of a read_roi dict with its geometry scaled by scale, for an image with another pixel size
+    (e.g. 0.25 for level 2 of an ImagePyramid). Coordinates are pixel corners as in ImageJ, so they are
+    simply multiplied. Rectangles are rounded to the pixels whose centers they cover, 'channel' masks are
+    resampled at the new pixel centers. Name, position and other fields are kept
+    """
+    if scale == 1:
+        return roi
+    roi = dict(roi)
+    kind = roi['type']
+    if kind == 'rectangle':
+        top, left = np.floor(roi['top'] * scale + 0.5), np.floor(roi['left'] * scale + 0.5)
+        bottom = np.floor((roi['top'] + roi['height']) * scale + 0.5)
+        right = np.floor((roi['left'] + roi['width']) * scale + 0.5)
+        roi.update(top=int(top), left=int(left), height=int(bottom - top), width=int(right - left))
+    elif kind == 'channel':
+        top, left, bottom, right = roi['bbox']
+        mask = np.asarray(roi['mask'], dtype=bool)
+        new_top, new_left = int(np.floor(top * scale)), int(np.floor(left * scale))
+        new_bottom, new_right = int(np.ceil(bottom * scale)), int(np.ceil(right * scale))
+        # source pixel under the center of every new pixel, outside the old box = not in the ROI
+        rows = np.floor((np.arange(new_top, new_bottom) + 0.5) / scale).astype(np.intp) - top
+        cols = np.floor((np.arange(new_left, new_right) + 0.5) / scale).astype(np.intp) - left
+        inside = (rows[:, None] >= 0) & (rows[:, None] < mask.shape[0]) & (cols >= 0) & (cols < mask.shape[1])
+        resampled = np.zeros(inside.shape, dtype=bool)
+        resampled[inside] = mask[np.broadcast_to(rows[:, None], inside.shape)[inside],
+                                 np.broadcast_to(cols, inside.shape)[inside]]
+        roi.update(bbox=(new_top, new_left, new_bottom, new_right), mask=resampled)
+    else:
+        # 'width' is the oval/composite width, or the stroke width of lines
+        for field in ('top', 'left', 'width', 'height', 'x1', 'y1', 'x2', 'y2', 'ex1', 'ey1', 'ex2', 'ey2'):
+            if field in roi:
+                roi[field] = roi[field] * scale
+        for field in ('x', 'y'):
+            if field in roi:
+                roi[field] = (np.asarray(roi[field], dtype=np.float64) * scale).tolist()
+        if 'paths' in roi:
+            roi['paths'] = [[tuple(v * scale if isinstance(v, (int, float)) else v for v in segment) for segment in path]
+                            for path in roi['paths']]
+    return roi
+
+
 #%%
 class ROI:
-    def __init__(self, roi, masking='outside', use_z=True, image=None):
+    def __init__(self, roi, masking='outside', use_z=True, image=None, cache=None, frame_shape=None):
         """
         Create an ROI object using an roi imported using ijroi classes
         Inputs:
         1. masking: determine whether inside or outside pixels will be masked
         2. z, t, f: use roi's stored z, t (time), or f (frame) coordinate for roi determination.
         By default, z is true and t and f are false
+        use_z: if False, the stored slice is dropped and the ROI is measured on every z plane.
+        The stored slice/frame/channel restrict measurements to those planes, see planes()
         
         image can be an image or a path to image
+        cache: RasterCache used to reuse rasterized geometry. None uses the module-wide RASTER_CACHE, False disables it
+        frame_shape: optional (height, width) of the target frame. The ROI bounding box is clipped to it
         """
-        # Import statements for this module
-        from read_roi import read_roi_file, read_roi_zip # ImageJ ROI import
-        from skimage.draw import polygon, ellipse # enable drawing of polygon and elliptical ROIs
-        import numpy as np
-        import numpy.ma as ma
-        import pims
-        
         # Initialize instance variables
         self.name = roi['name']
         #self.str = "ROI"
@@ -73,9 +966,9 @@ class ROI:
         self.masked_image = None # stores the masked image
         self.attribs = roi # bucket to hold all the variables that can be called under specialized circumstances
         # set attached image
-        if type(image) == "str":
-            print("image type str") # debug line
-            self.image = pims.open(image) # open image
+        if isinstance(image, str):
+            logger.debug("ROI '%s': opening image %s", self.name, image)
+            self.image = open_image(image) # open image (memory-mapped if possible)
         else:
             self.image = image # pin image
 
@@ -84,25 +977,38 @@ class ROI:
         self.z = None # initialize as None
         self.c = None # initialize as None
         self.t = None # initialize as None
-        if type(self.position) == 'dict':
+        # ImageJ positions are 1-based, 0 means "all". Hyperstack ROIs have a dict, stack ROIs a single slice number
+        if isinstance(self.position, dict):
             for item in self.position:
                 if item == "slice":
-                    self.z = self.position["slice"]
+                    self.z = self.position["slice"] or None
                 elif item == "frame":
-                    self.t = self.position["frame"]
+                    self.t = self.position["frame"] or None
                 elif item == "channel":
-                    self.c = self.position["channel"]
+                    self.c = self.position["channel"] or None
+        elif self.position:
+            self.z = self.position
+        if not use_z:
+            self.z = None
         
-        # Define ROI-inclusive pixels using contained methods
-        self.pixels = self.__setPixels()
+        # Define ROI-inclusive pixels using contained methods.
+        # Bounding box (top, left, bottom, right; bottom/right exclusive) and boolean mask local to it.
+        # Measurements only ever touch this region, so cost scales with ROI area rather than frame area.
+        # Rasterized geometry is memoized, so the same ROI on another image/channel is not rasterized again
+        cache = RASTER_CACHE if cache is None else cache
+        key = cache.key(roi, frame_shape) if cache else None
+        cached = cache.get(key) if cache else None
+        if cached is None:
+            self.bbox, self.bbox_mask = _clip_bbox(*rasterize(roi), frame_shape)
+            if cache:
+                cache.put(key, self.bbox, self.bbox_mask)
+        else:
+            self.bbox, self.bbox_mask = cached
+        self.crop_origin = (0, 0) # (top, left) of the attached image after crop_image()
         
         # Define masking operations (debugging)
-        if self.mask_type=='inside':
-            print('inside mask requested')
-        elif self.mask_type=='outside':
-            print("outside mask requested")
-        else:
-            print("No mask requested")
+        logger.debug("ROI '%s' (%s): %s mask requested, bbox %s", self.name, self.kind, self.mask_type, self.bbox)
+        INSTRUMENTATION.count('rois')
         
         return
     
@@ -110,30 +1016,57 @@ class ROI:
         return str("ROI object. Name: '{}'\nROI type: '{}'.\nMasking of {} pixels is requested.\
         \n\nDefined ROI-inclusive pixels as {}".format(self.name, self.kind, self.mask_type, self.pixels))
     
+    @property
+    def pixels(self):
+        """ROI-inclusive pixels (rr, cc), computed from bbox_mask when asked for rather than kept on every ROI"""
+        return self.__setPixels()
+    
     def __setPixels(self):
         """
         This "private" method is to set the properties of the ROI behind the scenes.
-        This is called during __init__ and defines the pixels inclusive of the ROI
-        """
-        # hidden method to set the binary properties of the ROI behind the scenes
-        if self.kind == 'rectangle':
-            rr, cc = self.__rectangle()
-        elif self.kind == 'oval':
-            rr, cc = self.__ellipse()
-        elif self.kind == 'freehand':
-            rr, cc = self.__freehand()
-        elif self.kind == 'polygon':
-            rr, cc = self.__polygon()
-        #elif self.kind == 'channel':
-            # set pixels from mask
-            # use self.attribs["channel"] or something similar to define pixels
-            #rr, cc = self.from_pixels() # call method to create ROI from mask
-        return rr, cc
+        Defines the pixels inclusive of the ROI (rr, cc) from the rasterized bounding box mask
+        (see rasterize_rois() for the supported ROI types). Two int64 arrays, 16 bytes per ROI pixel
+        """
+        rr, cc = np.nonzero(self.bbox_mask)
+        return rr + self.bbox[0], cc + self.bbox[1]
     
     
     def set_pos(self, pos='z', num=1):
-        # this method will set the ROI position based on arguments provided
-        pass
+        """
+        Set the planes the ROI is bound to.
+        pos: 'z' (slice), 't' (frame) or 'c' (channel)
+        num: 1-based plane number as in ImageJ, a list/range of them (e.g. range(3, 8) for slices 3-7),
+            or None/0 to measure on every plane of that axis
+        """
+        if pos not in ('z', 't', 'c'):
+            raise ValueError("pos must be 'z', 't' or 'c', got {!r}".format(pos))
+        if num is not None and not np.isscalar(num):
+            num = tuple(int(n) for n in num)
+        setattr(self, pos, num or None)
+        return
+    
+    def planes(self, pos='z', n_frames=None):
+        """
+        Return the 0-based indices of the planes along pos ('z', 't' or 'c') the ROI is measured on,
+        or None if it is not bound to any (measured on all of them). n_frames drops planes past the stack
+        """
+        num = getattr(self, pos) if pos in ('z', 't', 'c') else None
+        if not num:
+            return None
+        planes = np.unique(np.atleast_1d(np.asarray(num, dtype=np.intp))) - 1
+        planes = planes[planes >= 0]
+        if n_frames is not None:
+            planes = planes[planes < n_frames]
+        return planes
+    
+    def scaled(self, scale, frame_shape=None):
+        """
+        This ROI with its geometry scaled by scale (see scale_roi()), e.g. 0.25 to measure level 2 of an
+        ImagePyramid. Name, masking and the planes it is bound to are kept; no image is attached
+        """
+        roi = ROI(scale_roi(self.attribs, scale), masking=self.mask_type, frame_shape=frame_shape)
+        roi.z, roi.t, roi.c = self.z, self.t, self.c
+        return roi
     
     
     def attach_image(self, image, crop=False):
@@ -142,83 +1075,162 @@ class ROI:
         # This may be useful for organizational purposes but may not be good for memory management
         # The biggest limitation here would be if you need multiple ROIs on the same image
         # It may be worth doing the crop operation on the ROI by default and saving only the relevant image data
-        self.image = image
+        # A path is opened with open_image(): uncompressed TIFFs are memory-mapped, so nothing is read yet
+        self.image = open_image(image) if isinstance(image, str) else image
+        self.crop_origin = (0, 0) # new image is uncropped
         # crop image
+        if crop:
+            self.crop_image()
         return
     
     
-    def measure_stack(self, image=None, axis=0, bundle_axes='yx', measurements=('mean', 'median', 'std')):
+    def measure_stack(self, image=None, axis=0, bundle_axes='yx', measurements=('mean', 'median', 'std'), position=None,
+                      sink=None, level=0, result_cache=None):
         """
         Uses input image to measure each slice of a stack (z or t)
         Inputs: Image for ROI
         CHANGELOG 1/3/2019: Add ability for ROI to store an image. Use stored image if not included here.
         
-        NOTE: Be sure that mask is created before using measure_stack(). Currently this only accepts default measurements
+        NOTE: Pixels are masked according to mask_type. Only the ROI bounding box is read from each frame
+        (unless mask_type is 'inside', which needs the whole frame).
         
         INPUTS:
             image: image to be measured according to ROI object. If no image provided, uses the attached image.
             If no attached image, produce an error
             Axis: axis over which to iterate. For ndarray this is a number, for PIMS objects this is a character or string
-            bundle_axes: axes to combine for measurement. By default this is 'yx'
+            (if not a string, the iter_axes already set with set_axes() are used). Memmaps from open_memmap()
+            have named axes and take a character too, with bundle_axes picking the measured axes.
+            PIMS frames are prefetched on a thread pool; pass a FrameSource to configure workers and queue depth
+            bundle_axes: axes to combine for measurement. By default this is 'yx'. Include 'c' ('cyx')
+            to measure every channel of each frame.
             measurements: The measurements to return for each frame measured.
-                'mean', 'median', 'std', '##-percentile', 'quantiles' 
+                'mean', 'median', 'std', 'min', 'max', 'sum', 'count', '##-percentile' (e.g. '95-percentile'),
+                'quantiles' (quartiles as '25-percentile', '50-percentile', '75-percentile') or '<n>-quantiles'.
+                All percentiles come from one partition per frame (one histogram for 8/16 bit images),
+                so asking for ten costs about the same as asking for one
+            position: stored ROI position ('z', 't' or 'c') matched against the iterated axis. An ROI bound
+                to planes (see planes()) is measured on those only and the other frames are not read.
+                By default this is the iterated axis ('z' for numbered ndarray axes); False measures every frame
+            sink: optional ResultsWriter the rows are written to (with this ROI's name) instead of being returned
+            level: measure this level of an ImagePyramid (binned 2^level x 2^level) for a fast approximate pass.
+                image may be an ImagePyramid, otherwise one is built for the image (and reused from disk).
+                'sum' and 'count' are scaled back to full resolution pixels, see ImagePyramid
+            result_cache: optional ResultCache. If this ROI was measured on the same image content with the
+                same settings, the stored rows are returned without reading the image
         
         Function process
         1. import image (use attached image)
-        2. Get pixel values for each frame, aggregate measurements into a DataFrame using vector operations
-        3. Summarize each frame with dataframe or Series measurement, return DataFrame with values
+        2. Gather the ROI pixels of every frame into one (frames, [channels,] pixels) array.
+           ndarrays (and memmaps) are sliced to the ROI bounding box and gathered with a single indexed read,
+           PIMS frames are cropped to the bounding box and gathered into a preallocated buffer
+        3. Reduce the gathered pixels along the pixel axis for each measurement and build the DataFrame once
         
         RETURNS:
-            DataFrame with measurements for columns and each row representing a frame in the image
+            DataFrame with measurements for columns and each row representing a frame in the image,
+            indexed by frame number (only the ROI's own planes if it is bound to some).
+            If frames contain more than one channel, columns are named '<measurement>_c<channel>'.
+            None if sink is given
         
         """
         
-        # import dependencies
-        import pandas as pd
-        from pandas import Series, DataFrame
-        import numpy.ma as ma
-        
         # if no image is provided, then use the attached image
         if image is None:
             image = self.image # alias self.image
+        if image is None:
+            raise ValueError("No image provided or attached to ROI '{}'".format(self.name))
+        if result_cache is not None:
+            return result_cache.measure_stack(self, image, measurements, axis, bundle_axes, position, level, sink)
+        if level or isinstance(image, ImagePyramid): # approximate pass on a downsampled level
+            pyramid = image if isinstance(image, ImagePyramid) else _pyramid_of(image)
+            roi = self.scaled(pyramid.scale(level)) if level else self
+            table = _to_full_resolution(roi.measure_stack(pyramid[level], axis, bundle_axes, measurements, position),
+                                        pyramid.scale(level))
+            if sink is not None:
+                sink.write(table, name=self.name, axis=_position_axis(pyramid[level], axis) or 'z')
+                return None
+            return table
         
-        df_measurements = DataFrame(columns=measurements) # initialize dataframe
-        
-        ### test if array or PIMS object
-        if hasattr(image, 'shape'): # then is an array
-            imgDims = len(image.shape)
-            image = np.moveaxis(image, axis, 0) # move given axis to the front to prepare for iterations
-            #### NOT YET FUNCTIONAL WITH STANDARD NDARRAY
-            for frames in image:
-                values = ma.masked_array(frames, mask=self.mask).compressed()
-                values_measurements = Series({measurements[0]: values.mean(),
-                                                 measurements[1]: np.median(values),
-                                                 measurements[2]: values.std()})
-                df_measurements = df_measurements.append(values_measurements, ignore_index=True)
-            
-        elif hasattr(image, 'frame_shape'): # then is PIMS object
-            image.iteraxes = axis  # set iteration axis
-            image.bundle_axes = bundle_axes # bundle axes. KWarg to alter this if needed
-            # iterate through axis
-            for frames in image: # get values for each item
-                values = ma.masked_array(np.array(frames), mask=self.mask).compressed()
-                values_measurements = Series({measurements[0]: values.mean(),
-                                                 measurements[1]: np.median(values),
-                                                 measurements[2]: values.std()})
-                df_measurements = df_measurements.append(values_measurements, ignore_index=True)
-                        
-        return df_measurements # return dataframe containing measurements
-    
-    def create_mask(self, image, define_mask_only=False, scale=1.0):
+        measurements = _expand_measurements(measurements)
+        origin = self.crop_origin if image is self.image else (0, 0)
+        stack, n_frames, plane_shape = _open_frames(image, axis, bundle_axes)
+        rows, cols, keep = self._measured_region(plane_shape, origin)
+        planes = self.planes(_position_axis(image, axis, position), n_frames)
+        INSTRUMENTATION.count('frames', n_frames if planes is None else len(planes))
+        if isinstance(stack, np.ndarray):
+            with INSTRUMENTATION.stage('read_frame'):
+                values = stack[..., rows, cols] # bbox slice (a view)
+                if planes is not None: # only the bound planes are read
+                    values = values[planes]
+                values = values[..., keep] # (frames, ..., pixels) in one indexed read
+        else: # PIMS: gather ROI pixels of each frame into a single buffer
+            values = None
+            frames = stack if planes is None else stack.iter_frames(planes)
+            for i, frame in enumerate(frames):
+                frame_values = np.asarray(frame)[..., rows, cols][..., keep]
+                if values is None:
+                    values = np.empty((n_frames if planes is None else len(planes),) + frame_values.shape,
+                                      dtype=frame_values.dtype)
+                values[i] = frame_values
+            if values is None: # bound to planes past the end of the stack
+                values = np.zeros((0, int(keep.sum())))
+        
+        table = _measurement_table(_summarize(values, measurements), measurements) # dataframe containing measurements
+        if planes is not None:
+            table.index = planes
+        if sink is not None:
+            sink.write(table, name=self.name, axis=_position_axis(image, axis) or 'z')
+            return None
+        return table
+    
+    def _measured_region(self, shape, origin=(0, 0)):
+        """
+        Return the region of an xy plane of the given shape that has to be read to measure this ROI.
+        origin is the (top, left) of the plane in ROI coordinates (non-zero for cropped images).
+        RETURNS: (rows, cols, keep) where rows and cols are slices of the plane and keep is a boolean mask
+            local to that region (True = measured pixel). For 'outside' masking this is the ROI bounding box
+            clipped to the plane; for 'inside' masking it is the whole plane with the ROI removed.
+        """
+        height, width = shape
+        top, left, bottom, right = self.bbox
+        top, bottom = top - origin[0], bottom - origin[0]
+        left, right = left - origin[1], right - origin[1]
+        # clip bbox to plane
+        r0, r1 = min(max(top, 0), height), min(max(bottom, 0), height)
+        c0, c1 = min(max(left, 0), width), min(max(right, 0), width)
+        local = self.bbox_mask[r0 - top:r1 - top, c0 - left:c1 - left]
+        
+        if self.mask_type == 'inside': # ROI is masked, measure everything else
+            keep = np.ones((height, width), dtype=bool)
+            keep[r0:r1, c0:c1] &= ~local
+            return slice(0, height), slice(0, width), keep
+        return slice(r0, r1), slice(c0, c1), local
+    
+    def _measured_pixels(self, shape, origin=(0, 0)):
+        """
+        Return the (rr, cc) coordinates of the pixels that are measured in an xy plane of the given shape.
+        ROI pixels outside of the plane are dropped.
+        """
+        rows, cols, keep = self._measured_region(shape, origin)
+        rr, cc = np.nonzero(keep)
+        return rr + rows.start, cc + cols.start
+    
+    @INSTRUMENTATION.timed('mask')
+    def create_mask(self, image, define_mask_only=False, scale=1.0, crop=False, lazy=False):
         """create binary mask.
         This means that an explicit instruction must be used so that the computer 
         does not waste time making binaries for every single object if not needed
         Returns: Binary mask of the image xy shape and creates a 3D binary
         Apply ROI mask on image.
-        Scale kwarg is if pixel sizes are changed, new ROIs need not be created explicitly
+        Scale kwarg is if pixel sizes are changed, new ROIs need not be created explicitly:
+        the ROI geometry is multiplied by scale (0.5 for an image binned 2x2, see scaled())
         
         INPUT: image on which to apply mask.
         define_mask_only: If True, return only the 2D mask (not maskedArray). Assign attribute.
+        crop: If True, only the ROI bounding box is read from the image (ndarray, memmap or PIMS frames)
+            and the returned mask/masked array are local to that box. See also crop_image()
+        lazy: If True, the image is not copied and the nD mask is never materialized. ndarrays and memmaps are
+            wrapped in a MaskedArray whose mask is a read-only broadcast view of the 2D mask; PIMS objects are
+            returned as a lazy sequence that masks each frame as it is read. Peak memory stays near the image size
         PROCESSING: Create 2d (xy) and 3d masks (xyt/z) across all channels.
         Essentially, propagate the 2d mask into all other dimensions
         Send a 2D image if you only want to return a single plane/channel
@@ -232,12 +1244,28 @@ class ROI:
         import numpy as np
         import numpy.ma as ma # masked arrays
         
-        image = np.array(image) # convert to ndarray
+        roi = self if scale == 1 else self.scaled(scale) # geometry in the pixels of this image
+        is_pims = hasattr(image, 'frame_shape')
+        if crop: # read only the bbox region of each plane
+            plane_shape = image.frame_shape[-2:] if is_pims else image.shape[-2:]
+            rows, cols, keep = roi._measured_region(plane_shape)
+            if is_pims and lazy:
+                image = CroppedFrames(image, rows, cols)
+            elif is_pims:
+                image = np.stack([np.asarray(frame)[..., rows, cols] for frame in image])
+            else:
+                image = image[..., rows, cols] if lazy else np.array(image[..., rows, cols])
+        else:
+            if not (is_pims and lazy):
+                # convert to ndarray (copy unless lazy). Read-only memmaps can't be modified through the result, keep them mapped
+                image = np.asanyarray(image) if lazy or isinstance(image, np.memmap) else np.array(image)
+            plane_shape = image.frame_shape[-2:] if is_pims and lazy else image.shape[-2:]
+            rows, cols, keep = roi._measured_region(plane_shape)
         
-        print("create_mask() called")
         
-        imgDims = len(image.shape) # store dimensions of image to be masked
-        print("DEBUG in create_mask(): imgDims = {}".format(imgDims))
+        imgShape = (len(image),) + tuple(image.frame_shape) if is_pims and lazy else image.shape
+        imgDims = len(imgShape) # store dimensions of image to be masked
+        logger.debug("create_mask() for ROI '%s': imgDims = %s", self.name, imgDims)
         
 
         # get XY shape of image for mask2D
@@ -258,31 +1286,33 @@ class ROI:
         else:
             print("Incompatible dimensionality in create_mask()") # throw an error maybe?
         """
-        maskShape = image.shape[-2:] # xy mask shape
-        maskShape3D = image.shape # nDimensional mask shape
+        maskShape = imgShape[-2:] # xy mask shape
+        maskShape3D = imgShape # nDimensional mask shape
             
         # 1 = masked, 0 = unmasked.
-        # Create mask based on inside or outside shape
-        if self.mask_type == "outside":
-            xyMask = np.ones(maskShape)
-            ndMask = np.ndarray(shape=maskShape3D) # initialize empty array for speed, data will be written soon
-            xyMask[self.pixels] = 0
-        elif self.mask_type == "inside":
-            xyMask = np.zeros(maskShape)
-            ndMask = np.ndarray(shape=maskShape3D) # initialize empty array for speed, data will be written soon
-            xyMask[self.pixels] = 1
+        # Create mask based on inside or outside shape. keep already accounts for mask_type
+        # and is local to (rows, cols), so only the region has to be written
+        if crop:
+            xyMask = ~keep
+        else:
+            xyMask = np.ones(maskShape, dtype=bool)
+            xyMask[rows, cols] = ~keep
         
         # assign 2D mask to an attribute so that it can be easily retrieved if necessary
         self.mask = xyMask
+        if define_mask_only:
+            return xyMask # return 2d mask if only the 2d mask is wanted
+        elif lazy: # broadcast the 2D mask instead of copying it into every plane
+            return _masked_view(image, xyMask)
+        
+        ndMask = np.ndarray(shape=maskShape3D, dtype=bool) # initialize empty array for speed, data will be written soon
         
         ## Extend mask into 3D for application to image
         # This might become a memory hog for large images, but probably runs faster than iteration
         
         # apply mask to all dimensions of image
         # Likely that imgDims ranges from 2-5 (ztcxy)
-        if define_mask_only:
-            return xyMask # return 2d mask if only the 2d mask is wanted
-        elif (imgDims == 2):
+        if (imgDims == 2):
             # do something
             image = ma.masked_array(image, mask=xyMask) # create masked_array over image
         elif imgDims == 3:
@@ -298,7 +1328,7 @@ class ROI:
             ndMask[:,:,:] = xyMask
             image = ma.masked_array(image, mask=ndMask) # apply 3D mask
         else:
-            print("Incompatible dimensionality for create_mask(). Too many dimensions (>6)!")
+            logger.warning("Incompatible dimensionality for create_mask(). Too many dimensions (>6)!")
         
         """
         # now we apply the mask to the provided image
@@ -318,20 +1348,34 @@ class ROI:
         Return cropped image
         
         Image must be attached to ROI first. The cropped image will then override the original.
+        ndarrays (and memmaps) are cropped as views, PIMS objects are cropped lazily per frame with a pipeline.
+        Measurements of the attached image afterwards take the crop origin into account.
         """
+        if self.image is None:
+            raise ValueError("No image attached to ROI '{}'. Use attach_image() first".format(self.name))
         
-        # get dimensions of square to crop
-        x_min = min(self.pixels[0])
-        y_min = min(self.pixels[1])
-        x_max = max(self.pixels[0])
-        y_max = max(self.pixels[1])
+        plane_shape = self.image.frame_shape[-2:] if hasattr(self.image, 'frame_shape') else self.image.shape[-2:]
+        rows, cols, _ = self._measured_region(plane_shape, self.crop_origin)
+        
+        if hasattr(self.image, 'frame_shape'): # PIMS object, crop each frame as it is read
+            self.image = CroppedFrames(self.image, rows, cols)
+        else:
+            self.image = self.image[..., rows, cols] # view, no copy
         
         # crop mask
-        # print dims
-        print("crop_image() not yet functional. Below are the crop dimensions (xy):\nx_min: {}, x_max: {}, y_min: {}, y_max: {}".format(
-                x_min, x_max, y_min, y_max))
-        #self.image = self.image() # get crop image using array functions
-        return
+        if self.mask is not None and np.shape(self.mask) == tuple(plane_shape):
+            self.mask = self.mask[rows, cols]
+        self.crop_origin = (self.crop_origin[0] + rows.start, self.crop_origin[1] + cols.start)
+        return self.image
+    
+    
+    def follow(self, source, measurements=('mean', 'median', 'std'), output=None, **kwargs):
+        """
+        Measure a growing acquisition (TIFF that grows page by page, or directory of per-frame TIFFs)
+        incrementally. Only frames added since the last update are measured.
+        RETURNS: LiveMeasurement; call update() or iterate watch(). kwargs are passed to LiveMeasurement
+        """
+        return LiveMeasurement([self], source, measurements, output=output, **kwargs)
     
     
     def set_axes(self, iteraxes, bundle_axes = 'yx'):
@@ -342,111 +1386,757 @@ class ROI:
         self.image.iter_axes = iteraxes
         self.image.bundle_axes = bundle_axes
         return
-    
-    
-    def __ellipse(self):
-        """
-        Provide an imported ImageJ ROI (ellipse) and creates an ellipse using skimage
-        Returns pixel coordinates of ellipse
-
-        Ellipse ROI has the following parameters:
-        ['height', 'left', 'name', 'position', 'top', 'type', 'width']
-        skimage to draw ellipse requires: r, c (center coordinates), r_radius, c_radius
-        """
-        from skimage.draw import ellipse
-        # check that it is indeed an ellipse, abort if not
-        """if not roi["type"] == 'oval':
-        print("incorrect type. ROI.ellipse() called but type is {}".format(self.kind))
-        return"""
 
-        # get radii of ellipse
-        r_radius = self.attribs['height']/2
-        c_radius = self.attribs['width']/2
-        # get coords
-        r = self.attribs['top'] + r_radius
-        c = self.attribs['left'] + c_radius
 
-        # draw ellipse
-        rr, cc = ellipse(r, c, r_radius, c_radius)
-        
-        # debugging
-        print("ellipse() called for ROI {}".format(self.name))
-        
-        return rr, cc
+class RasterCache:
+    """
+    Memoize ROI rasterization (bounding box + bbox-local mask), keyed on ROI geometry and target frame shape.
     
-    def __polygon(self):
-        from skimage.draw import polygon
+    Entries are kept in an in-memory LRU. If store is given (a directory, by convention next to the .zip as
+    '<RoiSet>.zip.rastercache'), entries are also saved to disk and reused by later runs. The store is cleared
+    automatically when the ROI file it belongs to (source) changes. Keys only depend on geometry, so an edited
+    ROI never reuses a stale raster, and one cache can be shared between ROI sets.
     
-        r = self.attribs['y']
-        c = self.attribs['x']
-        rr, cc = polygon(r, c)
-        
-        # debugging
-        print("polygon() called for ROI '{}'".format(self.name))
-        
-        return rr, cc
+    INPUTS:
+        max_entries: number of rasters kept in memory
+        store: optional directory for the on-disk store
+        source: path to the ROI file the store belongs to, used to invalidate the store
+    """
     
-    def __freehand(self):
-        # debugging
-        print("freehand() called for ROI '{}'. This function is not yet implemented".format(self.name))
-        
-        # Figure out how to determine the boundaries of the freehand drawing
+    # geometry-defining fields of read_roi dicts. Position and name do not change the raster
+    GEOMETRY_FIELDS = ('type', 'top', 'left', 'width', 'height', 'x', 'y', 'paths', 'x1', 'y1', 'x2', 'y2',
+                       'ex1', 'ey1', 'ex2', 'ey2', 'aspect_ratio', 'arc_size')
+    VERSION = 2 # bump when rasterization changes so stored rasters are not reused
+    
+    def __init__(self, max_entries=10000, store=None, source=None):
+        from collections import OrderedDict
+        import threading
         
-        return 0, 0
+        self.max_entries = max_entries
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if store is not None:
+            self.__check_source(source)
+        return
     
-    def __rectangle(self):
-        """
-        Draws a rectangular ROI as defined by the imported ijroi
-        rectangle: Defines width and height, left and top
-        """
+    def __bool__(self): # an empty cache is still a cache
+        return True
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __check_source(self, source):
+        """Clear the on-disk store if the ROI file changed since the store was written"""
+        import json, os, shutil
         
-        # Compute boundaries of rectangle using x y coords
-        top = self.attribs['top']
-        left = self.attribs['left']
-        bottom = top + self.attribs['height']
-        right = left + self.attribs['width']
+        signature = None
+        if source is not None and os.path.exists(source):
+            stat = os.stat(source)
+            signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'version': self.VERSION}
+        stamp = os.path.join(self.store, 'source.json')
+        if os.path.exists(stamp):
+            with open(stamp) as f:
+                if json.load(f) == signature:
+                    return
+            shutil.rmtree(self.store)
+        os.makedirs(self.store, exist_ok=True)
+        with open(stamp, 'w') as f:
+            json.dump(signature, f)
+    
+    def key(self, roi, frame_shape=None):
+        """Hash the geometry of an roi dict (read_roi format) together with the target frame shape"""
+        import hashlib
         
-        # create rr (x), cc (y) lists of inclusive pixels
-        rr = []
-        cc = []
-        for i in range(top, bottom):
-            for j in range(left, right):
-                rr.append(i) 
-                cc.append(j)
+        geometry = [(field, roi[field]) for field in self.GEOMETRY_FIELDS if field in roi]
+        if 'mask' in roi: # channel ROIs carry their own raster
+            geometry.append(('mask', hashlib.blake2b(np.packbits(roi['mask']).tobytes()).hexdigest(), np.shape(roi['mask'])))
+        text = repr((self.VERSION, geometry, None if frame_shape is None else tuple(frame_shape)))
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    
+    def get(self, key):
+        """Return (bbox, bbox_mask) for key or None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        entry = self.__load(key) if self.store is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.__remember(key, entry)
+        return entry
+    
+    def put(self, key, bbox, bbox_mask):
+        entry = (tuple(int(b) for b in bbox), bbox_mask)
+        with self._lock:
+            self.__remember(key, entry)
+        if self.store is not None:
+            self.__save(key, entry)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def __remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False) # least recently used
+    
+    def __path(self, key):
+        import os
+        return os.path.join(self.store, key + '.npz')
+    
+    def __load(self, key):
+        import os
         
-        # Debug
-        print("rectangle() called, dimensions defined as\
-        \n Top:{}\n Left:{}\n Bottom:{}\n Right:{}".format(top, left, bottom, right))
+        path = self.__path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            shape = tuple(data['shape'])
+            bbox_mask = np.unpackbits(data['mask'], count=shape[0] * shape[1]).reshape(shape).astype(bool)
+            return tuple(int(b) for b in data['bbox']), bbox_mask
+    
+    def __save(self, key, entry):
+        import os
         
-        return np.array(rr), np.array(cc)
+        bbox, bbox_mask = entry
+        path = self.__path(key)
+        partial = path + '.part.npz'
+        np.savez(partial, bbox=np.asarray(bbox), shape=np.asarray(bbox_mask.shape), mask=np.packbits(bbox_mask))
+        os.replace(partial, path)
 
 
-class ROI_Reader:
-    """This class is a container to create ROI objects using a path"""
-    #from read_roi import read_roi_file, read_roi_zip
+RASTER_CACHE = RasterCache() # module-wide in-memory cache used by ROI objects by default
+
+
+class CroppedFrames:
+    """
+    Lazily crop the frames of a PIMS object to an xy region.
+    Behaves like the wrapped reader (len, iteration, indexing, iter_axes/bundle_axes, frame_shape)
+    but each frame is cut to (rows, cols) as soon as it is read, so only the region is kept in memory.
+    """
     
-    def __init__(self, path, image=None):
+    def __init__(self, reader, rows, cols):
+        self.reader = reader
+        self.rows = rows
+        self.cols = cols
+        return
+    
+    @property
+    def frame_shape(self):
+        shape = tuple(self.reader.frame_shape)
+        return shape[:-2] + (self.rows.stop - self.rows.start, self.cols.stop - self.cols.start)
+    
+    @property
+    def iter_axes(self):
+        return self.reader.iter_axes
+    
+    @iter_axes.setter
+    def iter_axes(self, value):
+        self.reader.iter_axes = value
+    
+    @property
+    def bundle_axes(self):
+        return self.reader.bundle_axes
+    
+    @bundle_axes.setter
+    def bundle_axes(self, value):
+        self.reader.bundle_axes = value
+    
+    def __len__(self):
+        return len(self.reader)
+    
+    def __getitem__(self, i):
+        return np.asarray(self.reader[i])[..., self.rows, self.cols]
+    
+    def __iter__(self):
+        for frame in self.reader:
+            yield np.asarray(frame)[..., self.rows, self.cols]
+    
+    def __getattr__(self, name): # everything else (sizes, metadata, ...) comes from the reader
+        if name == 'reader':
+            raise AttributeError(name)
+        return getattr(self.reader, name)
+
+
+class FrameSource:
+    """
+    Prefetching frame reader for PIMS objects.
+    Frames are read and decoded on a bounded thread pool while the caller works on the current frame,
+    so decoding (disk/network I/O) and measuring overlap instead of running one after the other.
+    measure_stack() and measure_ROIs() wrap PIMS objects in a FrameSource with default settings;
+    pass your own FrameSource as the image to configure it.
+    
+    INPUTS:
+        reader: PIMS object (or CroppedFrames)
+        iter_axes, bundle_axes: if given, set on the reader. Otherwise the axes already configured
+            (e.g. with ROI.set_axes()) are used
+        workers: number of decoding threads
+        depth: maximum number of frames read ahead of the consumer (bounds memory to depth frames)
+        transform: optional function applied to each frame in the worker thread (e.g. cropping)
+        thread_safe: set True only if the reader supports concurrent reads. Otherwise reads are serialized
+            with a lock (decoding still overlaps with measuring)
+    """
+    
+    def __init__(self, reader, iter_axes=None, bundle_axes=None, workers=2, depth=4, transform=None, thread_safe=False):
+        import threading
+        
+        if iter_axes is not None:
+            reader.iter_axes = iter_axes
+        if bundle_axes is not None:
+            reader.bundle_axes = bundle_axes
+        self.reader = reader
+        self.workers = max(1, int(workers))
+        self.depth = max(1, int(depth))
+        self.transform = transform
+        self._lock = None if thread_safe else threading.Lock()
+        return
+    
+    @property
+    def frame_shape(self):
+        return self.reader.frame_shape
+    
+    def __len__(self):
+        return len(self.reader)
+    
+    def _load(self, i):
+        with INSTRUMENTATION.stage('read_frame', frame=i):
+            if self._lock is None:
+                frame = self.reader[i]
+            else:
+                with self._lock:
+                    frame = self.reader[i]
+            frame = np.asarray(frame)
+        if self.transform is not None:
+            frame = self.transform(frame)
+        return frame
+    
+    def __getitem__(self, i):
+        return self._load(i)
+    
+    def __iter__(self):
+        return self.iter_frames(range(len(self.reader)))
+    
+    def iter_frames(self, frames):
+        """Iterate over the given frame numbers only (in that order), prefetching like iter()"""
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        
+        frames = iter(frames)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            try:
+                while True:
+                    # keep the queue filled up to depth frames ahead
+                    while len(pending) < self.depth:
+                        i = next(frames, None)
+                        if i is None:
+                            break
+                        pending.append(pool.submit(self._load, int(i)))
+                    if not pending:
+                        return
+                    yield pending.popleft().result()
+            finally: # consumer stopped early, drop frames that have not started
+                for future in pending:
+                    future.cancel()
+
+
+#%%
+#### ROI SET
+# Geometry of many ROIs in a few contiguous arrays instead of one ROI object (and read_roi dict) per ROI.
+# Vertices of all ROIs share one flat buffer. Each ROI owns a run of paths (path_start) and each path a run
+# of vertices (path_offsets), so composite ROIs with holes fit the same layout as polygons.
+
+def _ranges(starts, counts):
+    """Concatenation of range(start, start + count) for every (start, count), without a Python loop"""
+    counts = np.asarray(counts, dtype=np.intp)
+    ends = np.cumsum(counts)
+    return np.repeat(np.asarray(starts, dtype=np.intp) - (ends - counts), counts) + np.arange(ends[-1] if counts.size else 0)
+
+
+def _position_planes(position):
+    """(c, z, t) of a read_roi position (0 = not set). A single int position is a stack slice and goes to z"""
+    if isinstance(position, dict):
+        return position.get('channel', 0), position.get('slice', 0), position.get('frame', 0)
+    return 0, position or 0, 0
+
+
+class ROIView:
+    """
+    Lightweight view of one ROI of an ROISet: only the set and an index are stored, everything else is
+    read from the set's arrays when asked for. Use to_roi() when a full ROI object is needed.
+    """
+    __slots__ = ('roiset', 'index')
+    
+    def __init__(self, roiset, index):
+        self.roiset = roiset
+        self.index = index
+    
+    def __repr__(self):
+        return "ROIView('{}', {}, bbox {})".format(self.name, self.kind, self.bbox)
+    
+    @property
+    def name(self):
+        return str(self.roiset.names[self.index])
+    
+    @property
+    def kind(self):
+        return ROISet.TYPES[self.roiset.types[self.index]]
+    
+    @property
+    def bbox(self):
+        return tuple(int(v) for v in self.roiset.bboxes[self.index])
+    
+    @property
+    def position(self):
+        """dict of channel, slice and frame (0 = all)"""
+        return dict(zip(('channel', 'slice', 'frame'), (int(v) for v in self.roiset.positions[self.index])))
+    
+    @property
+    def paths(self):
+        """List of (k, 2) vertex arrays (x, y), views into the vertex buffer"""
+        roiset = self.roiset
+        first, last = roiset.path_start[self.index], roiset.path_start[self.index + 1]
+        return [roiset.vertices[roiset.path_offsets[p]:roiset.path_offsets[p + 1]] for p in range(first, last)]
+    
+    @property
+    def vertices(self):
+        """(k, 2) array of all vertices (x, y) of the ROI, a view into the vertex buffer"""
+        roiset = self.roiset
+        first, last = roiset.path_start[self.index], roiset.path_start[self.index + 1]
+        return roiset.vertices[roiset.path_offsets[first]:roiset.path_offsets[last]]
+    
+    def to_dict(self):
+        return self.roiset.to_dict(self.index)
+    
+    def to_roi(self, **kwargs):
+        """Full ROI object. kwargs are passed to ROI()"""
+        return ROI(self.to_dict(), **kwargs)
+
+
+class ROISet:
+    """
+    Compact, array-backed collection of ROIs for large ROI sets (e.g. segmentation exports).
+    Arrays (one row per ROI):
+        names: ROI names
+        types: type code, index into ROISet.TYPES
+        bboxes: (n, 4) int32 (top, left, bottom, right) of the pixels the ROI can cover, bottom/right exclusive
+        positions: (n, 3) int32 (channel, slice, frame), 0 = not set (all planes)
+        widths: stroke width of line ROIs (0 otherwise)
+        path_start: (n + 1) index of the first path of each ROI
+        path_offsets: (paths + 1) index of the first vertex of each path
+        vertices: (vertices, 2) float32 (x, y) buffer shared by all ROIs. Rectangles and ovals store their
+            (left, top) and (right, bottom) corners
+    'channel' ROIs (from roi_from_mask()) keep their local mask in the masks dict.
+    
+    Indexing with an int or a name returns an ROIView; indexing with a slice, index array or boolean mask
+    returns a new ROISet. select()/filter() query names, types, positions and bounding boxes vectorized.
+    
+    Example:
+        rois = ROI_Reader('RoiSet.zip').get_ROISet()
+        cells = rois.filter(name='^cell', kind=('polygon', 'freehand'), z=3)
+        roi = cells[0].to_roi(image=image)
+    """
+    
+    TYPES = ('rectangle', 'oval', 'polygon', 'freehand', 'traced', 'freeroi', 'composite', 'line', 'polyline',
+             'freeline', 'angle', 'point', 'channel')
+    
+    def __init__(self, names, types, bboxes, positions, widths, path_start, path_offsets, vertices, masks=None):
+        self.names = np.asarray(names, dtype=str)
+        self.types = np.asarray(types, dtype=np.uint8)
+        self.bboxes = np.asarray(bboxes, dtype=np.int32).reshape(-1, 4)
+        self.positions = np.asarray(positions, dtype=np.int32).reshape(-1, 3)
+        self.widths = np.asarray(widths, dtype=np.float32)
+        self.path_start = np.asarray(path_start, dtype=np.intp)
+        self.path_offsets = np.asarray(path_offsets, dtype=np.intp)
+        self.vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 2)
+        self.masks = {} if masks is None else masks
+        self._lookup = None
+        return
+    
+    @classmethod
+    def from_dicts(cls, rois):
+        """
+        Build an ROISet from read_roi dicts (a dict of name: roi as returned by read_roi_zip, or an iterable of rois).
+        The dicts are not kept.
+        """
+        if isinstance(rois, dict):
+            rois = rois.values()
+        codes = {kind: code for code, kind in enumerate(cls.TYPES)}
+        names, types, positions, widths, path_counts, lengths, xs, ys = [], [], [], [], [], [], [], []
+        masks, channel_bboxes = {}, {}
+        for i, roi in enumerate(rois):
+            kind = roi['type']
+            if kind not in codes:
+                raise ValueError("Unsupported ROI type '{}' for ROI '{}'".format(kind, roi.get('name')))
+            names.append(roi['name'])
+            types.append(codes[kind])
+            positions.append(_position_planes(roi.get('position', 0)))
+            widths.append(roi.get('width', 0) if kind == 'line' else 0)
+            if kind in ('rectangle', 'oval'):
+                paths = [((roi['left'], roi['left'] + roi['width']), (roi['top'], roi['top'] + roi['height']))]
+            elif kind == 'channel':
+                paths = []
+                channel_bboxes[i] = roi['bbox']
+                masks[i] = np.asarray(roi['mask'], dtype=bool)
+            elif kind == 'composite':
+                paths = _composite_paths(roi)
+            elif kind == 'freehand' and 'ex1' in roi:
+                paths = [_ellipse_polygon(roi)]
+            elif kind == 'line':
+                paths = [((roi['x1'], roi['x2']), (roi['y1'], roi['y2']))]
+            else:
+                paths = [(roi['x'], roi['y'])]
+            path_counts.append(len(paths))
+            for x, y in paths:
+                lengths.append(len(x))
+                xs.append(np.asarray(x, dtype=np.float32))
+                ys.append(np.asarray(y, dtype=np.float32))
+        
+        n = len(names)
+        path_start = np.concatenate(([0], np.cumsum(path_counts, dtype=np.intp)))
+        path_offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.intp)))
+        vertices = (np.column_stack((np.concatenate(xs), np.concatenate(ys))) if xs
+                    else np.zeros((0, 2), dtype=np.float32))
+        roiset = cls(names, types, np.zeros((n, 4)), positions, widths, path_start, path_offsets, vertices, masks)
+        roiset._update_bboxes(channel_bboxes)
+        return roiset
+    
+    def _update_bboxes(self, channel_bboxes=None):
+        """Bounding boxes from the vertex buffer, computed for all ROIs at once"""
+        first = self.path_offsets[self.path_start[:-1]]
+        count = self.path_offsets[self.path_start[1:]] - first
+        has = count > 0
+        if has.any():
+            starts = first[has]
+            x, y = self.vertices[:, 0].astype(np.float64), self.vertices[:, 1].astype(np.float64)
+            x_min, x_max = np.minimum.reduceat(x, starts), np.maximum.reduceat(x, starts)
+            y_min, y_max = np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)
+            pad = np.ceil(self.widths[has] / 2)
+            boxes = np.column_stack((np.floor(y_min - pad), np.floor(x_min - pad),
+                                     np.floor(y_max + pad) + 1, np.floor(x_max + pad) + 1))
+            # rectangles and ovals: corners are the box edges
+            box_types = np.isin(self.types[has], (0, 1))
+            boxes[box_types, 2:] = np.ceil(np.column_stack((y_max, x_max))[box_types])
+            self.bboxes[has] = boxes
+        for i, bbox in (channel_bboxes or {}).items():
+            self.bboxes[i] = bbox
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __str__(self):
+        kinds, counts = np.unique(self.kinds, return_counts=True)
+        return "ROISet of {} ROIs ({}), {:.1f} MB".format(
+            len(self), ', '.join('{} {}'.format(c, k) for k, c in zip(kinds, counts)), self.nbytes / 1e6)
+    
+    def __iter__(self):
+        return (ROIView(self, i) for i in range(len(self)))
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return ROIView(self, self.index(key))
+        if isinstance(key, (int, np.integer)):
+            if not -len(self) <= key < len(self):
+                raise IndexError("ROI index {} out of range for {} ROIs".format(key, len(self)))
+            return ROIView(self, int(key) % len(self))
+        return self.take(np.arange(len(self))[key])
+    
+    @property
+    def kinds(self):
+        """Type names of all ROIs"""
+        return np.asarray(self.TYPES)[self.types]
+    
+    @property
+    def nbytes(self):
+        arrays = (self.names, self.types, self.bboxes, self.positions, self.widths, self.path_start,
+                  self.path_offsets, self.vertices)
+        return sum(a.nbytes for a in arrays) + sum(m.nbytes for m in self.masks.values())
+    
+    def index(self, name):
+        """Index of the ROI called name"""
+        if self._lookup is None:
+            self._lookup = {str(n): i for i, n in enumerate(self.names)}
+        return self._lookup[name]
+    
+    def take(self, index):
+        """New ROISet with the ROIs at index (int array), in that order"""
+        index = np.asarray(index, dtype=np.intp)
+        n_paths = self.path_start[index + 1] - self.path_start[index]
+        paths = _ranges(self.path_start[index], n_paths)
+        lengths = self.path_offsets[paths + 1] - self.path_offsets[paths]
+        vertices = self.vertices[_ranges(self.path_offsets[paths], lengths)]
+        new_position = {old: new for new, old in enumerate(index.tolist())}
+        masks = {new_position[i]: mask for i, mask in self.masks.items() if i in new_position}
+        return ROISet(self.names[index], self.types[index], self.bboxes[index], self.positions[index],
+                      self.widths[index], np.concatenate(([0], np.cumsum(n_paths))),
+                      np.concatenate(([0], np.cumsum(lengths))), vertices, masks)
+    
+    def select(self, name=None, kind=None, channel=None, z=None, t=None, intersects=None):
+        """
+        Boolean mask of the ROIs matching all given criteria.
+        INPUTS:
+            name: regular expression (str) searched in the names, or a list of exact names
+            kind: ROI type or list of types ('polygon', 'oval', ...)
+            channel, z, t: plane number or list of plane numbers (1-based, as in ImageJ). ROIs without a
+                position on that axis (0) are on every plane and always match
+            intersects: (top, left, bottom, right) box; ROIs whose bounding box overlaps it match
+        """
+        import re
+        
+        keep = np.ones(len(self), dtype=bool)
+        if name is not None:
+            if isinstance(name, str):
+                pattern = re.compile(name)
+                keep &= np.fromiter((pattern.search(n) is not None for n in self.names), dtype=bool, count=len(self))
+            else:
+                keep &= np.isin(self.names, list(name))
+        if kind is not None:
+            kinds = [kind] if isinstance(kind, str) else kind
+            keep &= np.isin(self.types, [self.TYPES.index(k) for k in kinds])
+        for column, planes in enumerate((channel, z, t)):
+            if planes is not None:
+                position = self.positions[:, column]
+                keep &= (position == 0) | np.isin(position, planes)
+        if intersects is not None:
+            top, left, bottom, right = intersects
+            boxes = self.bboxes
+            keep &= (boxes[:, 0] < bottom) & (boxes[:, 2] > top) & (boxes[:, 1] < right) & (boxes[:, 3] > left)
+        return keep
+    
+    def filter(self, **criteria):
+        """New ROISet of the ROIs matching the criteria of select()"""
+        return self.take(np.nonzero(self.select(**criteria))[0])
+    
+    def to_dict(self, i):
+        """read_roi-style dict of ROI i (enough for rasterize() and ROI())"""
+        kind = self.TYPES[self.types[i]]
+        c, z, t = (int(v) for v in self.positions[i])
+        roi = {'name': str(self.names[i]), 'type': kind,
+               'position': z if c == 0 and t == 0 else {'channel': c, 'slice': z, 'frame': t}}
+        paths = ROIView(self, i).paths
+        if kind in ('rectangle', 'oval'):
+            (left, top), (right, bottom) = paths[0].tolist()
+            roi.update(left=left, top=top, width=right - left, height=bottom - top)
+        elif kind == 'channel':
+            roi.update(bbox=tuple(int(v) for v in self.bboxes[i]), mask=self.masks[i])
+        elif kind == 'composite':
+            roi['paths'] = [[tuple(vertex) for vertex in path.tolist()] for path in paths]
+        elif kind == 'line':
+            (x1, y1), (x2, y2) = paths[0].tolist()
+            roi.update(x1=x1, y1=y1, x2=x2, y2=y2, width=float(self.widths[i]))
+        else:
+            roi.update(x=paths[0][:, 0].tolist(), y=paths[0][:, 1].tolist(), n=len(paths[0]))
+        return roi
+    
+    def rasterize(self, frame_shape=None):
+        """
+        Rasterize all ROIs in one rasterize_rois() call.
+        RETURNS: list of (bbox, bbox_mask), clipped to frame_shape if given
+        """
+        return [_clip_bbox(bbox, mask, frame_shape) for bbox, mask in
+                rasterize_rois(self.to_dict(i) for i in range(len(self)))]
+    
+    def to_rois(self, **kwargs):
+        """Full ROI objects of all ROIs. kwargs are passed to ROI()"""
+        return [ROI(self.to_dict(i), **kwargs) for i in range(len(self))]
+
+
+# ImageJ ROI header fields read without decoding the ROI (big-endian, see ij.io.RoiDecoder)
+_ROI_HEADER_SIZE = 64
+_ROI_KINDS = {0: 'polygon', 1: 'rectangle', 2: 'oval', 3: 'line', 4: 'freeline', 5: 'polyline', 7: 'freehand',
+              8: 'traced', 9: 'angle', 10: 'point'}
+
+
+_worker_archive = None # ROI zip opened once per worker process of LazyROIZip.decode()
+
+
+def _open_worker_archive(path):
+    import zipfile
+    global _worker_archive
+    _worker_archive = zipfile.ZipFile(path)
+    return
+
+
+def _decode_entries(entries):
+    """Decode some entries of the worker's ROI zip into read_roi dicts"""
+    from read_roi import read_roi_file
+    return [next(iter(read_roi_file(_worker_archive.open(entry)).values())) for entry in entries]
+
+
+class LazyROIZip(Mapping):
+    """
+    Read-only dict of name: read_roi dict over an ImageJ ROI .zip, decoding ROIs only when they are used.
+    Opening reads the zip central directory only, so names (and the order of read_roi_zip) are known at
+    once. An ROI is decoded on first access and kept; decode() decodes a subset up front, in parallel
+    for large subsets. types() and bboxes() read the 64 byte header of each entry, not the coordinates.
+    
+    Example:
+        rois = LazyROIZip('RoiSet.zip')  # 100k ROIs: central directory only
+        rois.decode([n for n in rois if n.startswith('cell')])
+    """
+    
+    PARALLEL = 2000 # decode() uses worker processes from this many undecoded ROIs
+    
+    def __init__(self, path):
+        import zipfile
+        import threading
+        self.path = path
+        self._archive = zipfile.ZipFile(path)
+        self._entries = {} # name: ZipInfo. A repeated name replaces the earlier entry, as in read_roi_zip
+        for info in self._archive.infolist():
+            if not info.is_dir():
+                self._entries[os.path.splitext(os.path.basename(info.filename))[0]] = info
+        self._rois = {}
+        self._headers = {}
+        self._lock = threading.Lock() # the archive handle is shared
+        return
+    
+    def __repr__(self):
+        return "LazyROIZip('{}', {} ROIs, {} decoded)".format(self.path, len(self), len(self._rois))
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __iter__(self):
+        return iter(self._entries)
+    
+    def __contains__(self, name):
+        return name in self._entries
+    
+    def __getitem__(self, name):
+        roi = self._rois.get(name)
+        if roi is None:
+            from read_roi import read_roi_file
+            info = self._entries[name]
+            with self._lock:
+                entry = self._archive.open(info)
+                roi = next(iter(read_roi_file(entry).values()))
+            self._rois[name] = roi
+        return roi
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_archive'], state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        import zipfile
+        import threading
+        self.__dict__.update(state)
+        self._archive = zipfile.ZipFile(self.path)
+        self._lock = threading.Lock()
+        return
+    
+    def close(self):
+        self._archive.close()
+        return
+    
+    def decoded(self, name):
+        """True if the ROI was already decoded"""
+        return name in self._rois
+    
+    def decode(self, names=None, workers=None):
+        """
+        Decode a subset of the ROIs now (all if names is None). Already decoded ROIs are skipped.
+        Subsets of PARALLEL ROIs or more, and at least half the zip, are split over workers processes
+        (default: CPU count). Each worker indexes the zip once, which costs about as much as decoding
+        a fifth of it, so smaller subsets are decoded here.
+        RETURNS: self
+        """
+        names = [n for n in (self._entries if names is None else names) if n not in self._rois]
+        workers = workers or os.cpu_count() or 1
+        if workers < 2 or len(names) < max(self.PARALLEL, len(self) // 2):
+            for name in names:
+                self[name]
+            return self
+        
+        from concurrent.futures import ProcessPoolExecutor
+        size = -(-len(names) // (workers * 4)) # a few batches per worker to even out ROI sizes
+        batches = [names[i:i + size] for i in range(0, len(names), size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_archive, initargs=(self.path,)) as pool:
+            jobs = [pool.submit(_decode_entries, [self._entries[n] for n in batch]) for batch in batches]
+            for batch, job in zip(batches, jobs):
+                self._rois.update(zip(batch, job.result()))
+        return self
+    
+    def _header(self, name):
+        header = self._headers.get(name)
+        if header is None:
+            with self._lock:
+                with self._archive.open(self._entries[name]) as entry:
+                    data = entry.read(_ROI_HEADER_SIZE)
+            if len(data) < _ROI_HEADER_SIZE or data[:4] != b'Iout':
+                raise ValueError("'{}' in {} is not an ImageJ ROI".format(name, self.path))
+            header = self._headers[name] = data
+        return header
+    
+    def types(self, names=None):
+        """dict of name: ROI type (as read_roi reports it) from the entry headers"""
+        import struct
+        types = {}
+        for name in (self._entries if names is None else names):
+            if name in self._rois:
+                types[name] = self._rois[name]['type']
+                continue
+            header = self._header(name)
+            composite = struct.unpack_from('>I', header, 36)[0] > 0
+            types[name] = 'composite' if composite else _ROI_KINDS.get(header[6], 'freeroi')
+        return types
+    
+    def bboxes(self, names=None):
+        """dict of name: integer (top, left, bottom, right) of the ROI from the entry headers"""
+        import struct
+        bboxes = {}
+        for name in (self._entries if names is None else names):
+            # unsigned, except values just below 2^16 that are small negative offsets (read_roi does the same)
+            bboxes[name] = tuple(v - 65536 if v >= 65036 else v for v in struct.unpack_from('>4H', self._header(name), 8))
+        return bboxes
+
+
+class ROI_Reader:
+    """This class is a container to create ROI objects using a path"""
+    #from read_roi import read_roi_file, read_roi_zip
+    
+    def __init__(self, path, image=None, disk_cache=False, lazy=True):
         """Open ROI (.roi) or list of ROIs (.zip) using ijroi modules
         INPUT: Path to ROI file
-        image: Defines the path to an image associated with the ROIs. Optional. Can be added later"""
+        image: Defines the path to an image associated with the ROIs. Optional. Can be added later
+        disk_cache: If True, rasterized ROIs are also stored next to the ROI file ('<path>.rastercache')
+            and reused when the same ROI file is opened again. The store is cleared when the file changes
+        lazy: If True, a .zip is only indexed (LazyROIZip) and ROIs are decoded when first used.
+            If False, every ROI is decoded at once with read_roi_zip"""
         from read_roi import read_roi_file, read_roi_zip
-        import pims
+        
+        if not os.path.isfile(path): # no file extension provided
+            path = next((path + ext for ext in ('.zip', '.roi') if os.path.isfile(path + ext)), path)
+        self.path = path
         
         # Import ROI list
-        if path.split('.')[-1] == "zip":
-            self.rois = read_roi_zip(path) # imports a labeled dict
-        elif path.split('.')[-1] == "roi":
+        if path.lower().endswith('.roi'):
+            logger.debug("Opening single ROI...")
             self.rois = read_roi_file(path) # import single ROI
-        else: # no file extension provided
-            try:
-                self.rois = read_roi_zip(path + '.zip') # imports a labeled dict
-                print('importing list of rois')
-            except FileNotFoundError: # .roi file, not .zip file
-                self.rois = read_roi_file(path + '.roi') # import single ROI
-                print("Opening single ROI...")
+        elif lazy:
+            logger.debug('indexing list of rois')
+            self.rois = LazyROIZip(path) # names now, ROIs on first access
+        else:
+            logger.debug('importing list of rois')
+            self.rois = read_roi_zip(path) # imports a labeled dict
 
         self.keys = list(self.rois.keys()) # get list of ROI names for referencing in Dict
         
+        self.cache = RASTER_CACHE # rasterized ROIs, in memory
+        if disk_cache:
+            self.cache = RasterCache(store=path + '.rastercache', source=path)
+        
         self.attach_image(image) # attach image if specified
         
         return
@@ -461,39 +2151,340 @@ class ROI_Reader:
         for k in self.keys:
         roi_objs.append(i)"""
         
-        roi_objs = [ROI(self.rois[k]) for k in self.keys] # this approach is missing the original keys
+        frame_shape = None
+        if self.image is not None:
+            frame_shape = self.image.frame_shape[-2:] if hasattr(self.image, 'frame_shape') else self.image.shape[-2:]
+        roi_objs = [ROI(self.rois[k], cache=self.cache, frame_shape=frame_shape) for k in self._select()] # this approach is missing the original keys
         
         if len(roi_objs) == 1:
             roi_objs = roi_objs[0]
         
         return roi_objs
     
+    def get_ROISet(self, names=None):
+        """
+        Return the ROIs as an ROISet: geometry of all ROIs in contiguous arrays, with lightweight views
+        instead of one ROI object per ROI. Use this for large ROI sets.
+        names: optional list of ROI names to include
+        """
+        return ROISet.from_dicts(self.rois[k] for k in self._select(names))
+    
+    def types(self):
+        """dict of name: ROI type. For a lazily opened .zip this reads the entry headers only"""
+        if isinstance(self.rois, LazyROIZip):
+            return self.rois.types()
+        return {k: self.rois[k]['type'] for k in self.keys}
+    
+    def decode(self, names=None, workers=None):
+        """
+        Decode the ROIs in names (all if None) now instead of on first use. Large subsets of a lazily
+        opened .zip are decoded in parallel (LazyROIZip.decode()). Nothing to do for eagerly read ROIs
+        """
+        if isinstance(self.rois, LazyROIZip):
+            self.rois.decode(names, workers=workers)
+        return
+    
+    def _select(self, names=None):
+        """Keys of the ROIs in names (all if None), in file order and decoded"""
+        wanted = None if names is None else set(names)
+        keys = self.keys if names is None else [k for k in self.keys if k in wanted]
+        self.decode(keys)
+        return keys
+    
     def attach_image(self, image):
         """
         Attach an image to the ROI collection. If this is done at initialization, the path to the image is provided and it is opened
         If this method is used, the image is opened elsewhere and added to the item.
         """
         if type(image) == str:
-            self.image = pims.open(image) # open an image file
+            self.image = open_image(image) # open an image file (memory-mapped if it is an uncompressed TIFF)
         else:
             self.image = image # pin image variable directly to ROI_Reader object
         return
     
-    def measure_ROIs(self, axis):
+    def measure_ROIs(self, image=None, axis=0, bundle_axes='yx', measurements=('mean', 'median', 'std'), chunk_size=32, names=None,
+                     progress=None, position=None, sink=None, level=0, result_cache=None):
         """
-        This may not be feasible since the ROI object defines the ROIs
-        Create this like the measure_stack() method in ROI
-        Have this iterate like this though:
-            1. load image, pin to ROI_Reader object
-                2. measure each ROI in a frame
-                3. measure next frame
-                4. repeat (1)
+        Measure every ROI of the collection in a single pass over the image.
+        Works like ROI.measure_stack() but each frame is read once for all ROIs:
+            1. index the ROIs by plane: ROIs bound to a slice/frame (their stored position) are only measured there
+            2. build a sparse index of the pixels of the ROIs (one segment per ROI, so overlapping ROIs are handled)
+            3. read frames in chunks of chunk_size and gather all indexed pixels with one read per chunk.
+               Frames no ROI is measured on are skipped entirely
+            4. compute per-ROI statistics with labeled (reduceat) reductions
+        
+        INPUTS:
+            image: image to measure. If None, the attached image is used
+            axis, bundle_axes, measurements, position, level: as in ROI.measure_stack(). With level, image may
+                be an ImagePyramid; otherwise the one from pyramid() is used. See pyramid_accuracy()
+            chunk_size: number of frames gathered at once. Bounds memory to chunk_size * (pixels in all ROIs)
+            names: optional list of ROI names to measure. By default all ROIs are measured
+            progress: optional callable, called as progress(frames_done, frames_to_read) after every chunk.
+                An exception raised by it stops the measurement (used by the GUI to cancel jobs)
+            sink: optional ResultsWriter. The rows of every chunk are written to it as soon as they are measured
+                and nothing is kept in memory, so the number of ROI x frame rows is not limited by memory
+            result_cache: optional ResultCache. Rows of ROIs already measured on the same image content with
+                the same settings are reused and only new or edited ROIs are measured (then written to sink at once)
+        
+        RETURNS:
+            DataFrame with 'name' and 'frame' columns plus one column per measurement
+            ('<measurement>_c<channel>' if frames contain several channels), one row per ROI and measured frame.
+            None if sink is given (rows are then ordered by chunk of frames, then ROI)
         """
+        if image is None:
+            image = self.image
+        if image is None:
+            raise ValueError("No image provided or attached to ROI_Reader")
+        if result_cache is not None:
+            return result_cache.measure_ROIs(self, image, names, measurements, axis, bundle_axes, position, level, sink,
+                                             chunk_size=chunk_size, progress=progress)
+        scale = 1
+        if level or isinstance(image, ImagePyramid): # approximate pass on a downsampled level
+            pyramid = image if isinstance(image, ImagePyramid) else self.pyramid(image)
+            image, scale = pyramid[level], pyramid.scale(level)
+        
+        measurements = _expand_measurements(measurements)
+        keys = self._select(names)
+        stack, n_frames, plane_shape = _open_frames(image, axis, bundle_axes)
+        rois = [ROI(scale_roi(self.rois[k], scale), cache=self.cache, frame_shape=plane_shape) for k in keys]
+        unbound, by_plane = _plane_index(rois, _position_axis(image, axis, position), n_frames)
+        # only read the frames some ROI is measured on
+        frames = np.arange(n_frames) if len(unbound) else np.array(sorted(by_plane), dtype=np.intp)
+        flat_index, offsets = _roi_index([rois[i] for i in unbound], plane_shape)
         
-        if self.image is None: # attach image if not attached
-            self.attach_image(image)
+        roi_names = np.array([roi.name for roi in rois], dtype=object)
         
-        pass
+        pieces = [] # (ROI numbers, frame numbers, stats) of every summarized block, rows grouped by ROI
+        done = 0
+        for selected, chunk in _iter_plane_chunks(stack, frames, chunk_size):
+            with INSTRUMENTATION.stage('read_frame'):
+                chunk = np.asarray(chunk)
+                chunk = chunk.reshape(chunk.shape[:-2] + (-1,))
+            INSTRUMENTATION.count('frames', len(chunk))
+            if len(unbound): # ROIs measured on every frame: one read per chunk
+                stats = _summarize_segments(chunk[..., flat_index], offsets, measurements)
+                pieces.append((np.repeat(unbound, len(selected)), np.tile(selected, len(unbound)),
+                               {m: _roi_major(stat) for m, stat in stats.items()}))
+            for frame, plane in zip(selected.tolist(), chunk): # ROIs bound to this plane
+                if frame in by_plane:
+                    bound = by_plane[frame]
+                    plane_flat_index, plane_offsets = _roi_index([rois[i] for i in bound], plane_shape)
+                    stats = _summarize_segments(plane[None, ..., plane_flat_index], plane_offsets, measurements)
+                    pieces.append((bound, np.full(len(bound), frame), {m: _roi_major(stat) for m, stat in stats.items()}))
+            if sink is not None and pieces: # stream the chunk out
+                sink.write(_to_full_resolution(_pieces_table(pieces, roi_names, measurements), scale),
+                           axis=_position_axis(image, axis) or 'z')
+                pieces = []
+            done += len(selected)
+            if progress is not None:
+                progress(done, len(frames))
+        
+        if sink is not None:
+            return None
+        if not pieces: # every ROI is bound to planes past the end of the stack
+            from pandas import DataFrame
+            return DataFrame(columns=['name', 'frame'] + list(measurements))
+        return _to_full_resolution(_pieces_table(pieces, roi_names, measurements), scale)
+    
+    def pyramid(self, image=None, **kwargs):
+        """
+        ImagePyramid of image (the attached image by default), kept for later calls with the same image and
+        shared with ROI.measure_stack(level=k) on it. kwargs are passed to ImagePyramid (store, min_size)
+        """
+        image = self.image if image is None else image
+        cached = getattr(self, '_pyramid', None)
+        if cached is not None and cached.image is image and not kwargs:
+            return cached
+        self._pyramid = ImagePyramid(image, **kwargs) if kwargs else _pyramid_of(image)
+        return self._pyramid
+    
+    def pyramid_accuracy(self, level, image=None, measurements=('mean', 'median', 'std'), **kwargs):
+        """
+        Compare measure_ROIs() at a pyramid level with the full resolution run, to pick the coarsest level
+        that is still accurate enough for previews. kwargs are passed to both measure_ROIs() calls.
+        image: ImagePyramid, or image to use pyramid() of (the attached image by default)
+        RETURNS: DataFrame with one row per measured column:
+            median_error, p95_error, max_error: relative error |level - full| / |full| over ROIs and frames
+            r: correlation of the level and full resolution values
+            missing: values measured at full resolution but not at the level (ROIs smaller than a binned pixel)
+          .attrs holds 'level', 'seconds_full', 'seconds_level' and 'speedup' (level building is not timed)
+        """
+        from pandas import DataFrame
+        
+        pyramid = image if isinstance(image, ImagePyramid) else self.pyramid(image)
+        pyramid[level] # build the level before timing
+        start = time.perf_counter()
+        full = self.measure_ROIs(pyramid[0], measurements=measurements, **kwargs).set_index(['name', 'frame'])
+        seconds_full = time.perf_counter() - start
+        start = time.perf_counter()
+        approx = self.measure_ROIs(pyramid, measurements=measurements, level=level, **kwargs).set_index(['name', 'frame'])
+        seconds_level = time.perf_counter() - start
+        approx = approx.reindex(full.index)
+        
+        report = {}
+        for column in full.columns:
+            exact, estimate = full[column].to_numpy(np.float64), approx[column].to_numpy(np.float64)
+            valid = np.isfinite(exact) & np.isfinite(estimate)
+            error = np.abs(estimate[valid] - exact[valid]) / np.maximum(np.abs(exact[valid]), 1e-12)
+            report[column] = {
+                'median_error': np.median(error) if error.size else np.nan,
+                'p95_error': np.percentile(error, 95) if error.size else np.nan,
+                'max_error': error.max() if error.size else np.nan,
+                'r': _correlation(exact[valid], estimate[valid]),
+                'missing': int((np.isfinite(exact) & ~np.isfinite(estimate)).sum())}
+        report = DataFrame.from_dict(report, orient='index')
+        report.attrs.update(level=level, seconds_full=seconds_full, seconds_level=seconds_level,
+                            speedup=seconds_full / seconds_level if seconds_level else np.inf)
+        return report
+    
+    def spatial_index(self, cell_size=None, names=None):
+        """
+        Grid index over the ROI bounding boxes (see SpatialIndex), for region/point/overlap queries.
+        Built from get_ROISet() without rasterizing anything, and kept for later calls (all ROIs, same cell_size)
+        """
+        cached = getattr(self, '_spatial_index', None)
+        if names is None and cached is not None and cell_size in (None, cached.cell_size):
+            return cached
+        roiset = self.get_ROISet(names)
+        index = SpatialIndex(roiset.bboxes, cell_size, names=roiset.names)
+        if names is None:
+            self._spatial_index = index
+        return index
+    
+    def rois_in(self, top, left, bottom, right):
+        """Names of the ROIs whose bounding box intersects the region (top, left, bottom, right)"""
+        index = self.spatial_index()
+        return index.names[index.query(top, left, bottom, right)].tolist()
+    
+    def measure_tiled(self, image=None, tile_size=4096, axis=0, bundle_axes='yx', measurements=('mean', 'median', 'std'),
+                      names=None, position=None, sink=None, progress=None, index_bytes=2 ** 26):
+        """
+        Measure ROIs on planes too large to hold in memory (stitched/tiled images), one tile at a time.
+        Each plane is cut into tile_size x tile_size tiles. A spatial index over the ROIs gives the ROIs of
+        every tile; tiles without ROIs are never read, the others are read once per frame and only their ROIs
+        are measured. ROIs spanning several tiles are stitched: count, sum, min, max and the squared deviations
+        (for std) of their parts are merged as soon as a tile is done, and so are the histograms of their pixels
+        (for percentiles of integer images). Masks are only built tile by tile, also for 'inside' masking.
+        Peak memory is one tile, the per-ROI statistics and index_bytes of kept tile indexes. Only percentiles of
+        tile-spanning ROIs on float images keep the ROI's pixels until the frame is done.
+        
+        INPUTS:
+            image: ndarray, memmap (open_image()/open_memmap()), other lazily sliced array (zarr, dask) or
+                PIMS object. Arrays are read tile by tile; PIMS frames are decoded whole and cut into tiles.
+                A 2D array is a single plane. If None, the attached image is used
+            tile_size: tile side in pixels
+            axis, bundle_axes, measurements, names, position, sink: as in measure_ROIs()
+            progress: optional callable, called as progress(frames_done, frames_to_read) after every frame
+            index_bytes: pixel indexes of tiles are kept for the next frames of a stack up to this size; the
+                others are rebuilt for every frame
+        RETURNS: DataFrame like measure_ROIs() (None if sink is given). Results match measure_ROIs()
+        """
+        if image is None:
+            image = self.image
+        if image is None:
+            raise ValueError("No image provided or attached to ROI_Reader")
+        
+        measurements = _expand_measurements(measurements)
+        order = tuple(m for m in measurements if _percentile_of(m) is not None)
+        keys = self._select(names)
+        read, n_frames, plane_shape = _tile_reader(image, axis, bundle_axes)
+        rois = [ROI(self.rois[k], cache=self.cache, frame_shape=plane_shape) for k in keys]
+        roi_names = np.array([roi.name for roi in rois], dtype=object)
+        index = SpatialIndex([_tile_bounds(roi, plane_shape) for roi in rois])
+        tiles = _tiles(plane_shape, tile_size)
+        tile_rois = [index.query(*tile) for tile in tiles]
+        n_tiles = np.zeros(len(rois), dtype=np.intp) # tiles each ROI may span
+        for ids in tile_rois:
+            n_tiles[ids] += 1
+        unbound, by_plane = _plane_index(rois, _position_axis(image, axis, position), n_frames)
+        frames = np.arange(n_frames) if len(unbound) else np.array(sorted(by_plane), dtype=np.intp)
+        
+        if tile_size * tile_size >= 2 ** 31:
+            raise ValueError("tile_size must be below 46341 pixels")
+        # tile -> (ids, flat_index, offsets), kept for the next frames of stacks while they fit in index_bytes
+        segments, kept_bytes = {}, 0
+        pieces = []
+        for done, frame in enumerate(frames.tolist(), 1):
+            active = np.zeros(len(rois), dtype=bool)
+            active[unbound] = True
+            active[by_plane.get(frame, [])] = True
+            total, pending = None, {} # running statistics of all ROIs, histograms/pixels of tile-spanning ROIs
+            for t, tile in enumerate(tiles):
+                if not active[tile_rois[t]].any():
+                    continue
+                if t in segments:
+                    ids, flat_index, offsets = segments[t]
+                else:
+                    ids, flat_index, offsets = _tile_segments(rois, tile_rois[t], tile)
+                    if len(frames) > 1 and kept_bytes + flat_index.nbytes <= index_bytes:
+                        segments[t] = ids, flat_index, offsets
+                        kept_bytes += flat_index.nbytes
+                if not active[ids].any():
+                    continue
+                top, left, bottom, right = tile
+                with INSTRUMENTATION.stage('read_frame', tile=t):
+                    data = read(frame, slice(top, bottom), slice(left, right))
+                    values = data.reshape((1,) + data.shape[:-2] + (-1,))[..., flat_index]
+                del data
+                stats = {m: stat[0] for m, stat in _summarize_segments(values, offsets, _MOMENTS + order).items()}
+                if total is None: # channels are known once the first tile is read
+                    shape = stats['count'].shape[:-1] + (len(rois),)
+                    total = {m: np.zeros(shape) for m in ('count', 'sum', 'm2')}
+                    total.update((m, np.full(shape, np.nan)) for m in ('min', 'max') + order)
+                    histograms = values.dtype.kind in 'ui' and values.dtype.itemsize <= 2
+                _merge_moments(total, stats, ids)
+                if order:
+                    single = n_tiles[ids] == 1
+                    for m in order:
+                        total[m][..., ids[single]] = stats[m][..., single]
+                    for j in np.nonzero(~single)[0].tolist(): # merged now, the tile's pixels are not kept
+                        part = values[0][..., offsets[j]:offsets[j + 1]]
+                        if histograms:
+                            pending[ids[j]] = _histogram_part(part, pending.get(ids[j]))
+                        else:
+                            pending.setdefault(ids[j], []).append(part.copy())
+                del values, stats
+            INSTRUMENTATION.count('frames')
+            
+            if total is not None:
+                percentiles = [_percentile_of(m) for m in order]
+                for i, parts in pending.items(): # stitched ROIs
+                    if histograms:
+                        stitched = np.moveaxis(_histogram_percentiles(parts, total['count'].shape[:-1], percentiles), -1, 0)
+                    else:
+                        stitched = _summarize(np.concatenate(parts, axis=-1), order)
+                        stitched = [stitched[m] for m in order]
+                    for m, value in zip(order, stitched):
+                        total[m][..., i] = value
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    total['mean'] = total['sum'] / total['count']
+                    total['std'] = np.sqrt(total['m2'] / total['count'])
+                ids = np.nonzero(active)[0]
+                piece = (ids, np.full(len(ids), frame), {m: np.moveaxis(total[m][..., ids], -1, 0) for m in measurements})
+                if sink is not None:
+                    sink.write(_pieces_table([piece], roi_names, measurements), axis=_position_axis(image, axis) or 'z')
+                else:
+                    pieces.append(piece)
+            if progress is not None:
+                progress(done, len(frames))
+        
+        if sink is not None:
+            return None
+        if not pieces:
+            from pandas import DataFrame
+            return DataFrame(columns=['name', 'frame'] + list(measurements))
+        return _pieces_table(pieces, roi_names, measurements)
+    
+    def follow(self, source, measurements=('mean', 'median', 'std'), output=None, names=None, **kwargs):
+        """
+        Measure all ROIs (or names) on a growing acquisition incrementally, see LiveMeasurement.
+        source: TIFF that grows page by page, or a directory receiving one TIFF per frame
+        output: optional .csv the new rows are appended to after every update
+        RETURNS: LiveMeasurement; call update() or iterate watch()
+        """
+        keys = self._select(names)
+        return LiveMeasurement([self.rois[k] for k in keys], source, measurements, output=output,
+                               cache=self.cache, **kwargs)
     
 #%%
         
@@ -501,37 +2492,1404 @@ class ROI_Reader:
 
 def roi_from_mask(mask_channel, image=None, mask_type="outside", name="channel_roi", **kwargs):
     """
-    This module function will create a new ROI object using a channel for masking rather than relying on an import
-    Questions: Include smoothing and thresholding functions inside this or leave it to the user to program? I think leave to user
-    
-    Put kwargs into a dict, the dict will be the "roi" object that is passed to the ROI() constructor.
-    Constructor roi should include: 'name', 'kind', 'position'
+    This module function will create new ROI objects using a channel for masking rather than relying on an import.
+    Smoothing and thresholding are left to the user; this function labels the connected components of the
+    masked channel and makes one ROI (kind "channel") per component.
     
+    INPUTS:
+        mask_channel: 2D (yx) or 3D (zyx) masked channel. Either a masked_array (masked pixels are background,
+            following the ROITools convention 1 = masked), a boolean array (True = foreground) or a numeric
+            array thresholded with the 'threshold' kwarg
+        image: attach image to the ROI objects. If given, the mean intensity of each component is measured as well
+        mask_type: masking of the ROI objects ('outside' measures the component)
+        name: prefix of the ROI names ('<name>-00001', ...)
     kw args:
-        - image: attach image to ROI object
-        - name: name for ROI
+        - threshold: foreground is mask_channel > threshold for numeric arrays (default 0)
+        - connectivity: 1 for face-connected components (4/6-connectivity), mask_channel.ndim for
+          fully connected components (8/26-connectivity, default)
+        - min_area: smallest component (pixels/voxels) that becomes an ROI (default 1)
+        - return_labels: if True, also return the label image
+    
+    Components are labeled with scipy.ndimage and all statistics are computed per label in one pass
+    (bincount/labeled reductions); each ROI only stores its bounding box and a mask local to it.
+    3D components span several z planes: the ROI mask is their xy footprint, measured on the planes the
+    component touches only. attribs['z_range'] holds the (first, last + 1) planes (0-based).
+    
     ROI object attributes:
         - kind = "channel"
-        - position = ?? 
-        - mask_type = mask_type
-    
-    Included kw args include smoothing, labeling
-    **kwargs add flexibility. How to use?
+        - position: {'slice': z + 1} for components in a single plane of a 3D channel, 0 otherwise
+        - z: 1-based planes of 3D components (set_pos('z', ...)), so planes('z') and measurements skip the others
+        - attribs: 'bbox', 'mask', 'area' (pixels/voxels), 'centroid' ((z,) y, x), 'label' and 'mean_intensity'
     
-    mask_channel should be a masked_array type.
+    RETURNS: list of ROI objects (and the label image if return_labels)
     """
-    # 1. create mask in image from given 
+    import numpy.ma as ma
+    from scipy import ndimage
     
-    # function to create an ROI object by using a masking operation
-    # Input: mask (this can be created using other methods)
-    # Return: ROI object
-    pass
+    # 1. foreground from the masked channel
+    if isinstance(mask_channel, ma.MaskedArray):
+        foreground = ~ma.getmaskarray(mask_channel)
+    else:
+        mask_channel = np.asarray(mask_channel)
+        foreground = mask_channel if mask_channel.dtype == bool else mask_channel > kwargs.get('threshold', 0)
+    if foreground.ndim not in (2, 3):
+        raise ValueError("roi_from_mask() expects a 2D (yx) or 3D (zyx) channel, got {} dimensions".format(foreground.ndim))
+    
+    # 2. label connected components and measure all of them at once
+    structure = ndimage.generate_binary_structure(foreground.ndim, kwargs.get('connectivity', foreground.ndim))
+    labels, n_labels = ndimage.label(foreground, structure=structure)
+    index = np.arange(1, n_labels + 1)
+    area = np.bincount(labels.ravel(), minlength=n_labels + 1)[1:]
+    centroids = np.array(ndimage.center_of_mass(foreground, labels, index)).reshape(n_labels, foreground.ndim)
+    intensity = None
+    if image is not None and np.shape(image) == foreground.shape:
+        intensity = np.asarray(ndimage.mean(np.asarray(image), labels, index))
+    
+    # 3. one ROI per component, carrying a bbox-local mask
+    min_area = kwargs.get('min_area', 1)
+    rois = []
+    for i, slices in enumerate(ndimage.find_objects(labels)):
+        if slices is None or area[i] < min_area:
+            continue
+        local = labels[slices] == i + 1
+        roi = {'name': "{}-{:05d}".format(name, i + 1), 'type': 'channel', 'position': 0, 'label': i + 1,
+               'area': int(area[i]), 'centroid': tuple(float(c) for c in centroids[i])}
+        if foreground.ndim == 3:
+            roi['z_range'] = (slices[0].start, slices[0].stop)
+            if slices[0].stop - slices[0].start == 1:
+                roi['position'] = {'slice': slices[0].start + 1}
+            local = local.any(axis=0) # xy footprint
+            slices = slices[1:]
+        roi['bbox'] = (slices[0].start, slices[1].start, slices[0].stop, slices[1].stop)
+        roi['mask'] = local
+        if intensity is not None:
+            roi['mean_intensity'] = float(intensity[i])
+        roi_object = ROI(roi, masking=mask_type, image=image, cache=False)
+        if 'z_range' in roi and roi['z_range'][1] - roi['z_range'][0] > 1:
+            roi_object.set_pos('z', range(roi['z_range'][0] + 1, roi['z_range'][1] + 1))
+        rois.append(roi_object)
+    
+    if kwargs.get('return_labels', False):
+        return rois, labels
+    return rois
 
-def mask_and_flatten():
+def mask_and_flatten(image, mask_channel=0, threshold=0, projections=('max', 'mean', 'sum', 'std'), axis=0,
+                     bundle_axes='cyx', chunk_size=16, workers=1, out=None, dtype=np.float32):
     """
     This function should be useful for neurons. 
     It uses a designated masking channel to mask all other channels and decompose image into masked 2D.
     This could be good for batch operations
+    
+    Planes (z or t) are streamed in chunks of chunk_size from an ndarray, memmap or PIMS object. In every plane,
+    pixels where the masking channel is <= threshold are masked in all channels, and the max/mean/sum/std
+    projections of the unmasked values are accumulated incrementally (per chunk, then merged), so only
+    chunk_size planes per worker are ever in memory.
+    
+    INPUTS:
+        image: ndarray, memmap or PIMS object. After moving axis to the front, each plane must be (c, y, x)
+        mask_channel: index of the masking channel
+        threshold: pixels of the masking channel above threshold are kept
+        projections: any of 'max', 'mean', 'sum', 'std', 'count' (number of planes in which the pixel is unmasked)
+        axis, bundle_axes: axis to collapse and PIMS axes of each plane, as in ROI.measure_stack()
+        chunk_size: planes per chunk
+        workers: number of threads reducing chunks in parallel
+        out: None (new ndarray), path of a .npy file (written as an on-disk memmap) or a preallocated array
+        dtype: dtype of the output
+    
+    RETURNS: array of shape (len(projections), c, y, x) in the order of projections. Pixels that are masked in
+        every plane are nan (0 for 'sum' and 'count')
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+    
+    unknown = [p for p in projections if p not in ('max', 'mean', 'sum', 'std', 'count')]
+    if unknown:
+        raise ValueError("Unknown projection(s) {}".format(unknown))
+    stack, n_frames, plane_shape = _open_frames(image, axis, bundle_axes)
+    
+    @INSTRUMENTATION.timed('reduce')
+    def reduce_chunk(chunk):
+        """Partial (count, mean, M2, max, sum) of one chunk of planes (planes, c, y, x)"""
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.ndim != 4:
+            raise ValueError("mask_and_flatten() needs (c, y, x) planes, got planes of shape {}".format(chunk.shape[1:]))
+        keep = chunk[:, mask_channel] > threshold # (planes, y, x)
+        count = keep.sum(axis=0)
+        values = np.where(keep[:, None], chunk, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            total = np.nansum(values, axis=0)
+            mean = total / count
+            m2 = np.nansum((values - mean) ** 2, axis=0)
+        maximum = np.max(np.where(keep[:, None], chunk, -np.inf), axis=0)
+        return count, mean, m2, maximum, total
+    
+    # running accumulators, merged chunk by chunk (Chan et al. parallel variance)
+    count = mean = m2 = maximum = total = None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = deque()
+        chunks = _iter_frame_chunks(stack, n_frames, chunk_size)
+        while True:
+            for start, chunk in chunks: # keep at most 2 chunks per worker in flight
+                pending.append(pool.submit(reduce_chunk, chunk))
+                if len(pending) >= 2 * max(1, workers):
+                    break
+            if not pending:
+                break
+            c_count, c_mean, c_m2, c_max, c_total = pending.popleft().result()
+            if count is None:
+                count, mean, m2, maximum, total = c_count, np.nan_to_num(c_mean), c_m2, c_max, c_total
+                continue
+            merged = count + c_count
+            with np.errstate(invalid='ignore', divide='ignore'):
+                weight = np.where(merged > 0, c_count / merged, 0)
+            delta = np.nan_to_num(c_mean) - mean
+            mean = mean + delta * weight
+            m2 = m2 + c_m2 + delta ** 2 * count * weight
+            count = merged
+            maximum = np.maximum(maximum, c_max)
+            total = total + c_total
+    if count is None:
+        raise ValueError("Image has no planes to flatten")
+    
+    # collect the projections
+    n_channels = mean.shape[0]
+    shape = (len(projections), n_channels) + tuple(plane_shape)
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif isinstance(out, str):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape)
+    never = count == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        results = {'max': maximum, 'sum': total, 'mean': mean, 'std': np.sqrt(m2 / count),
+                   'count': np.broadcast_to(count, mean.shape)}
+    for i, projection in enumerate(projections):
+        result = np.array(results[projection], dtype=np.float64)
+        if projection in ('max', 'mean', 'std'):
+            result[:, never] = np.nan
+        out[i] = result
+    if isinstance(out, np.memmap):
+        with INSTRUMENTATION.stage('write'):
+            out.flush()
+    return out
+
+#%%
+#### RESULTS
+# Measurement rows can be streamed into a ResultsWriter instead of being kept in one DataFrame.
+# Rows are buffered up to buffer_rows and written as one row group (Parquet), one appended chunk of an HDF5 table
+# or appended to a .csv, so memory stays bounded however many ROI x frame rows a run produces.
+# Every backend gets the same long-format schema:
+#     image (str), name (str), c, z, t (int, -1 = not applicable), then one float column per statistic
+# '<measurement>_c<channel>' columns of multi-channel measurements become one row per channel.
+
+RESULT_COLUMNS = ('image', 'name', 'c', 'z', 't')
+_RESULT_FORMATS = {'.parquet': 'parquet', '.h5': 'hdf5', '.hdf5': 'hdf5', '.hdf': 'hdf5', '.csv': 'csv'}
+
+
+def _results_rows(table, image, name=None, axis='z'):
+    """
+    Convert a measurement table (from measure_stack() or measure_ROIs()) to the ResultsWriter schema.
+    The frame number ('frame' column, or the index of measure_stack() tables) goes into the column of axis
+    """
+    from pandas import DataFrame, concat
+    
+    frames = table['frame'].to_numpy() if 'frame' in table.columns else table.index.to_numpy()
+    names = table['name'].to_numpy() if 'name' in table.columns else np.full(len(table), name, dtype=object)
+    by_channel = {} # channel -> {statistic: column}
+    for column in table.columns:
+        if column in ('name', 'frame'):
+            continue
+        match = re.fullmatch(r'(.+)_c(\d+)', column)
+        channel, statistic = (int(match.group(2)), match.group(1)) if match else (-1, column)
+        by_channel.setdefault(channel, {})[statistic] = column
+    
+    blocks = []
+    for channel, columns in sorted(by_channel.items()):
+        block = {'image': np.full(len(table), image, dtype=object), 'name': names.astype(object),
+                 'c': np.full(len(table), channel, dtype=np.int64),
+                 'z': np.full(len(table), -1, dtype=np.int64), 't': np.full(len(table), -1, dtype=np.int64)}
+        if axis in ('z', 't', 'c'):
+            block[axis] = frames.astype(np.int64)
+        block.update((statistic, table[column].to_numpy(dtype=np.float64)) for statistic, column in columns.items())
+        blocks.append(DataFrame(block))
+    return concat(blocks, ignore_index=True) if len(blocks) > 1 else blocks[0]
+
+
+class ResultsWriter:
     """
-    pass
+    Streaming sink for measurement results, for runs too large to keep as one DataFrame.
+    Pass it as sink= to ROI.measure_stack() or ROI_Reader.measure_ROIs() (or call write() with their tables).
+    
+    INPUTS:
+        path: output location, the format follows the extension
+            '.parquet': directory holding a Parquet dataset. Every writer adds its own part file (one row group
+                per flush), so runs append to the dataset and several processes can write to it at once.
+                Needs pyarrow. Read with pandas.read_parquet(path) or lazily with pyarrow.dataset
+            '.h5'/'.hdf5': HDF5 table (PyTables format, key), appended chunk by chunk. Needs PyTables.
+                Read lazily with pandas.read_hdf(path, key, where="name == 'cell1'") or chunksize=
+            '.csv': rows appended to a .csv
+        image: image id written in every row (e.g. the image file name). write() can override it
+        buffer_rows: rows kept in memory before they are written
+        append: keep results already at path. False replaces them
+        key: table key in HDF5 files
+        part: name of this writer's part file in a Parquet dataset (default: time stamp, process id and a random
+            suffix, so writers opened one after the other never share a part)
+    
+    The statistic columns are fixed by the first write; later tables must have the same measurements.
+    
+    Example:
+        with ResultsWriter('results.parquet', image='cell01.tif') as sink:
+            reader.measure_ROIs(measurements=('mean', 'median'), sink=sink)
+    """
+    
+    def __init__(self, path, image='', buffer_rows=100000, append=True, key='measurements', part=None):
+        self.path = path
+        self.format = _RESULT_FORMATS.get(os.path.splitext(path)[1].lower())
+        if self.format is None:
+            raise ValueError("Unknown results format '{}', use one of {}".format(path, sorted(_RESULT_FORMATS)))
+        self.image = image
+        self.buffer_rows = int(buffer_rows)
+        self.key = key
+        if part is None:
+            import uuid
+            part = "part-{}-{}-{}".format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), uuid.uuid4().hex)
+        self.part = part
+        self.statistics = None # statistic columns, set by the first write
+        self.rows_written = 0
+        self._buffer = []
+        self._buffered = 0
+        self._writer = None # open Parquet file
+        if not append:
+            self._remove()
+        return
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def __len__(self):
+        return self.rows_written + self._buffered
+    
+    def write(self, table, image=None, name=None, axis='z'):
+        """
+        Add the rows of a measurement table, written once more than buffer_rows rows are buffered.
+        name: ROI name for tables without a 'name' column (measure_stack())
+        axis: 'z', 't' or 'c', column that receives the frame numbers
+        """
+        rows = _results_rows(table, self.image if image is None else image, name, axis)
+        statistics = [column for column in rows.columns if column not in RESULT_COLUMNS]
+        if self.statistics is None:
+            self.statistics = statistics
+        elif set(statistics) != set(self.statistics):
+            raise ValueError("Results have columns {}, the writer was started with {}".format(statistics, self.statistics))
+        self._buffer.append(rows[list(RESULT_COLUMNS) + self.statistics])
+        self._buffered += len(rows)
+        if self._buffered >= self.buffer_rows:
+            self.flush()
+        return
+    
+    def flush(self):
+        """Write the buffered rows"""
+        from pandas import concat
+        
+        if not self._buffer:
+            return
+        rows = concat(self._buffer, ignore_index=True) if len(self._buffer) > 1 else self._buffer[0]
+        self._buffer, self._buffered = [], 0
+        with INSTRUMENTATION.stage('write', rows=len(rows)):
+            if self.format == 'parquet':
+                self._write_parquet(rows)
+            elif self.format == 'hdf5':
+                rows.to_hdf(self.path, key=self.key, mode='a', format='table', append=True,
+                            data_columns=list(RESULT_COLUMNS), min_itemsize={'image': 256, 'name': 128})
+            else:
+                header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                rows.to_csv(self.path, mode='a', header=header, index=False)
+        self.rows_written += len(rows)
+    
+    def close(self):
+        """Write what is left and finish the file. Parquet part files only appear in the dataset once closed"""
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            os.replace(self._temporary_path, self._part_path)
+            self._writer = None
+    
+    @property
+    def _part_path(self):
+        return os.path.join(self.path, self.part + '.parquet')
+    
+    @property
+    def _temporary_path(self): # Parquet readers skip files starting with '_'
+        return os.path.join(self.path, '_' + self.part + '.parquet.tmp')
+    
+    def _write_parquet(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        if self._writer is None:
+            os.makedirs(self.path, exist_ok=True)
+            schema = pa.schema([('image', pa.string()), ('name', pa.string())] +
+                               [(axis, pa.int64()) for axis in ('c', 'z', 't')] +
+                               [(statistic, pa.float64()) for statistic in self.statistics])
+            # written under a temporary name so readers of the dataset never see a file without footer
+            self._writer = pq.ParquetWriter(self._temporary_path, schema)
+        self._writer.write_table(pa.Table.from_pandas(rows, schema=self._writer.schema, preserve_index=False))
+    
+    def _remove(self):
+        """Drop earlier results (append=False)"""
+        import shutil
+        
+        if self.format == 'parquet' and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        elif self.format == 'hdf5' and os.path.exists(self.path):
+            from pandas import HDFStore
+            with HDFStore(self.path, mode='a') as store:
+                if self.key in store:
+                    store.remove(self.key)
+        elif self.format == 'csv' and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _file_digest(path, block=1 << 22):
+    """blake2b of the content of a file"""
+    import hashlib
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of measurement results, so a re-run only measures what changed.
+    
+    Rows are stored per (image, settings) group and, inside a group, per ROI:
+        image: content hash of the image file (or of its planes for in-memory arrays), see image_key()
+        settings: measurement list, axis, bundle_axes, position and pyramid level
+        ROI: geometry, the c/z/t planes it is bound to and its masking, see roi_key(). Not the name,
+            so renamed ROIs are reused and edited ROIs are measured again
+    measure_ROIs()/measure_stack() return the stored rows of unchanged (image, ROI, settings) combinations
+    and only measure the others. ROI_Reader.measure_ROIs(result_cache=...) and
+    ROI.measure_stack(result_cache=...) go through it.
+    
+    Groups are kept in an in-memory LRU and, if store is given, as .npz files in that directory, where the
+    least recently used groups are evicted once the store is larger than max_bytes. Files are written under
+    a temporary name and renamed, so several processes can share a store (ROI_Batch.run_batch(cache_dir=...)).
+    
+    INPUTS:
+        store: optional directory for the on-disk store
+        max_bytes: size limit of the on-disk store
+        max_groups: number of groups kept in memory
+    """
+    
+    VERSION = 1 # bump when measurements change so stored results are not reused
+    
+    def __init__(self, store=None, max_bytes=2 * 1024 ** 3, max_groups=32):
+        from collections import OrderedDict
+        import threading
+        
+        self.store = store
+        self.max_bytes = max_bytes
+        self.max_groups = max_groups
+        self._groups = OrderedDict() # group key -> (table, index)
+        self._digests = {} # (path, size, mtime_ns) -> content hash
+        self._lock = threading.Lock()
+        self.hits = 0 # ROIs served from the cache
+        self.misses = 0 # ROIs measured
+        if store is not None:
+            os.makedirs(os.path.join(store, 'files'), exist_ok=True)
+        return
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_groups'] = type(self._groups)()
+        del state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        import threading
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        return
+    
+    #### keys
+    def image_key(self, image):
+        """
+        Content hash of an image (path, ndarray, memmap, PIMS object or ImagePyramid).
+        Files are hashed in full once per version: the hash is remembered by (path, size, mtime), also in
+        the store, so unchanged files are only stat()ed. Memmaps add which part of the file they view,
+        ndarrays are hashed plane by plane and PIMS objects without a file frame by frame
+        """
+        import hashlib
+        
+        if isinstance(image, ImagePyramid):
+            image = image.image
+        path = image if isinstance(image, str) else getattr(image, 'filename', None)
+        if isinstance(image, np.memmap) and image._mmap is None: # not backed by the file any more
+            path = None
+        if isinstance(path, str) and os.path.isfile(path):
+            view = None
+            if isinstance(image, np.memmap): # views of one memmap share filename and offset
+                start = np.frombuffer(image._mmap, dtype=np.uint8).__array_interface__['data'][0]
+                view = (image.offset, image.__array_interface__['data'][0] - start, image.shape, image.strides,
+                        image.dtype.str, getattr(image, 'axes', None))
+            elif not isinstance(image, str): # PIMS reader
+                view = (type(image).__name__, len(image), tuple(image.frame_shape))
+            return hashlib.blake2b(repr((self.__file_digest(path), view)).encode(), digest_size=16).hexdigest()
+        
+        digest = hashlib.blake2b(digest_size=16)
+        if hasattr(image, 'frame_shape'): # PIMS without a file
+            digest.update(repr((len(image), tuple(image.frame_shape))).encode())
+            planes = (np.asarray(frame) for frame in image)
+        else:
+            image = np.asanyarray(image)
+            digest.update(repr((image.shape, image.dtype.str, getattr(image, 'axes', None))).encode())
+            planes = (image[index] for index in np.ndindex(image.shape[:-2]))
+        for plane in planes:
+            digest.update(np.ascontiguousarray(plane).data)
+        return digest.hexdigest()
+    
+    def __file_digest(self, path):
+        import hashlib
+        
+        stat = os.stat(path)
+        version = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if version in self._digests:
+            return self._digests[version]
+        memo = None
+        if self.store is not None:
+            memo = os.path.join(self.store, 'files', hashlib.blake2b(repr(version).encode(), digest_size=16).hexdigest())
+            if os.path.exists(memo):
+                with open(memo) as f:
+                    self._digests[version] = f.read()
+                return self._digests[version]
+        with INSTRUMENTATION.stage('hash'):
+            digest = _file_digest(path)
+        self._digests[version] = digest
+        if memo is not None:
+            with open(memo + '.part', 'w') as f:
+                f.write(digest)
+            os.replace(memo + '.part', memo)
+        return digest
+    
+    def roi_key(self, roi, planes=None, masking='outside', origin=(0, 0)):
+        """
+        Hash of an ROI for result lookups: geometry (see RasterCache.key()), the (c, z, t) planes it is bound
+        to (1-based, None = all; taken from the read_roi position by default), masking and crop origin.
+        roi: read_roi dict or ROI object (then planes, masking and origin are read from it)
+        """
+        import hashlib
+        
+        if isinstance(roi, ROI):
+            planes, masking, origin = (roi.c, roi.z, roi.t), roi.mask_type, roi.crop_origin
+            roi = roi.attribs
+        elif planes is None:
+            planes = tuple(p or None for p in _position_planes(roi.get('position', 0)))
+        planes = tuple(p if p is None or np.isscalar(p) else tuple(p) for p in planes)
+        text = repr((RASTER_CACHE.key(roi), planes, masking, tuple(origin)))
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    
+    def settings_key(self, kind, image_key, measurements, axis=0, bundle_axes='yx', position=None, level=0):
+        """Key of a group: image content and everything else that changes the rows of an ROI"""
+        import hashlib
+        
+        text = repr((self.VERSION, kind, image_key, tuple(_expand_measurements(measurements)), axis,
+                     ''.join(bundle_axes), position, level))
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    
+    #### measuring
+    def measure_ROIs(self, reader, image=None, names=None, measurements=('mean', 'median', 'std'), axis=0,
+                     bundle_axes='yx', position=None, level=0, sink=None, **kwargs):
+        """
+        ROI_Reader.measure_ROIs() with stored rows for unchanged ROIs: only ROIs without rows for this image
+        and these settings are measured (in one measure_ROIs() call), then stored.
+        kwargs (chunk_size, progress) go to that call. RETURNS: the same table as measure_ROIs(); None with sink
+        """
+        image = reader.image if image is None else image
+        if image is None:
+            raise ValueError("No image provided or attached to ROI_Reader")
+        keys = reader._select(names)
+        roi_keys = [self.roi_key(reader.rois[k]) for k in keys]
+        group_key = self.settings_key('rois', self.image_key(image), measurements, axis, bundle_axes, position, level)
+        table, index = self._group(group_key)
+        
+        missing = {}
+        for name, roi_key in zip(keys, roi_keys):
+            if roi_key not in index:
+                missing.setdefault(roi_key, name) # ROIs with the same geometry are measured once
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            measured = reader.measure_ROIs(image, axis=axis, bundle_axes=bundle_axes, measurements=measurements,
+                                           names=list(missing.values()), position=position, level=level, **kwargs)
+            by_name = {name: roi_key for roi_key, name in missing.items()}
+            table, index = self._add(group_key, measured.drop(columns='name'), measured['name'].map(by_name).to_numpy(),
+                                     list(missing))
+        
+        result = self._rows(table, index, roi_keys)
+        result.insert(0, 'name', np.repeat(np.array(keys, dtype=object), [index[k][1] for k in roi_keys]))
+        if sink is not None:
+            sink.write(result, axis=_position_axis(image.image if isinstance(image, ImagePyramid) else image, axis) or 'z')
+            return None
+        return result
+    
+    def measure_stack(self, roi, image=None, measurements=('mean', 'median', 'std'), axis=0, bundle_axes='yx',
+                      position=None, level=0, sink=None):
+        """ROI.measure_stack() returning the stored rows if this ROI was measured on this image with these settings"""
+        own_image = image is None or image is roi.image
+        image = roi.image if image is None else image
+        if image is None:
+            raise ValueError("No image provided or attached to ROI '{}'".format(roi.name))
+        roi_key = self.roi_key(roi) if own_image else self.roi_key(roi.attribs, (roi.c, roi.z, roi.t), roi.mask_type)
+        group_key = self.settings_key('stack', self.image_key(image), measurements, axis, bundle_axes, position, level)
+        table, index = self._group(group_key)
+        if roi_key in index:
+            self.hits += 1
+        else:
+            self.misses += 1
+            measured = roi.measure_stack(image, axis, bundle_axes, measurements, position, level=level)
+            measured.insert(0, 'frame', measured.index.to_numpy())
+            table, index = self._add(group_key, measured.reset_index(drop=True), np.full(len(measured), roi_key),
+                                     [roi_key])
+        
+        result = self._rows(table, index, [roi_key])
+        frames = result.pop('frame').to_numpy()
+        if not np.array_equal(frames, np.arange(len(frames))): # ROI bound to some planes
+            result.index = frames
+        if sink is not None:
+            sink.write(result, name=roi.name, axis=_position_axis(image, axis) or 'z')
+            return None
+        return result
+    
+    #### groups
+    def _rows(self, table, index, roi_keys):
+        """Rows of the given ROIs (with repeats), in that order"""
+        from pandas import DataFrame
+        if table is None:
+            return DataFrame(columns=['frame'])
+        starts, counts = zip(*(index[k] for k in roi_keys)) if roi_keys else ((), ())
+        return table.iloc[_ranges(starts, counts)].reset_index(drop=True)
+    
+    def _group(self, key):
+        """(table, index) of a group. index maps ROI keys to (first row, number of rows) in table"""
+        with self._lock:
+            if key in self._groups:
+                self._groups.move_to_end(key)
+                return self._groups[key]
+        group = self.__load(key) if self.store is not None else None
+        if group is None:
+            group = (None, {})
+        with self._lock:
+            self.__remember(key, group)
+        return group
+    
+    def _add(self, key, rows, row_keys, roi_keys):
+        """Append the rows of newly measured ROIs (grouped by ROI) to a group and save it"""
+        from pandas import concat
+        
+        table, index = self._group(key)
+        index = dict(index)
+        start = 0 if table is None else len(table)
+        for roi_key in roi_keys:
+            index[roi_key] = (start, 0)
+        keys, first, counts = np.unique(row_keys, return_index=True, return_counts=True)
+        for roi_key, offset, count in zip(keys.tolist(), first.tolist(), counts.tolist()):
+            index[roi_key] = (start + offset, count)
+        table = rows.reset_index(drop=True) if table is None else concat([table, rows], ignore_index=True)
+        group = (table, index)
+        with self._lock:
+            self.__remember(key, group)
+        if self.store is not None:
+            self.__save(key, group)
+        return group
+    
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+    
+    def __remember(self, key, group):
+        self._groups[key] = group
+        self._groups.move_to_end(key)
+        while len(self._groups) > self.max_groups:
+            self._groups.popitem(last=False) # least recently used
+    
+    def __path(self, key):
+        return os.path.join(self.store, key + '.npz')
+    
+    def __load(self, key):
+        from pandas import DataFrame
+        
+        path = self.__path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path) # recently used, see __evict()
+        with np.load(path) as data:
+            columns = data['columns'].tolist()
+            table = DataFrame({column: data['column{}'.format(i)] for i, column in enumerate(columns)})
+            index = dict(zip(data['keys'].tolist(), zip(data['starts'].tolist(), data['counts'].tolist())))
+        return table, index
+    
+    def __save(self, key, group):
+        table, index = group
+        path = self.__path(key)
+        partial = path + '.part.npz'
+        arrays = {'column{}'.format(i): table[column].to_numpy() for i, column in enumerate(table.columns)}
+        np.savez(partial, columns=np.array(table.columns, dtype=str), keys=np.array(list(index), dtype=str),
+                 starts=np.array([v[0] for v in index.values()], dtype=np.int64),
+                 counts=np.array([v[1] for v in index.values()], dtype=np.int64), **arrays)
+        os.replace(partial, path)
+        self.__evict()
+    
+    def __evict(self):
+        """Remove the least recently used groups from the store until it fits in max_bytes"""
+        entries = [entry for entry in os.scandir(self.store) if entry.name.endswith('.npz') and '.part' not in entry.name]
+        stats = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries]
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError): # another process evicted it first
+                os.remove(path)
+            total -= size
+            logger.debug("ResultCache: evicted %s", path)
+
+
+#%%
+#### SPATIAL INDEX AND TILES
+# Planes of stitched/tiled images (e.g. 20k x 20k) do not fit in memory, and most ROIs only touch a small part.
+# SpatialIndex buckets ROI bounding boxes into a uniform grid of cells (CSR layout: cell -> ROI numbers), so
+# region, point and overlap queries only look at the ROIs of the cells they touch.
+# ROI_Reader.measure_tiled() uses it to read each tile of a plane once and measure the ROIs intersecting it.
+# ROIs spanning several tiles are stitched by merging their per-tile count, sum, squared deviations, min and
+# max as soon as a tile is done; for percentiles their per-tile histograms (integer images) are merged.
+
+_MOMENTS = ('count', 'sum', 'std', 'min', 'max') # per-tile statistics merged across tiles
+
+
+class SpatialIndex:
+    """
+    Uniform grid index over ROI bounding boxes.
+    INPUTS:
+        bboxes: (n, 4) (top, left, bottom, right), bottom/right exclusive (e.g. ROISet.bboxes)
+        cell_size: side of the grid cells in pixels. Default: twice the median ROI size, at least 32
+        names: optional ROI names, to translate query results (index.names[hits])
+    Queries return the sorted numbers (rows of bboxes) of the ROIs whose bounding box intersects the query.
+    
+    Example:
+        index = ROI_Reader('RoiSet.zip').spatial_index()
+        hits = index.query(0, 0, 4096, 4096)
+        print(index.names[hits])
+    """
+    
+    def __init__(self, bboxes, cell_size=None, names=None):
+        self.bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+        self.names = None if names is None else np.asarray(names)
+        boxes = self.bboxes
+        valid = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1]) # empty boxes are never returned
+        if cell_size is None:
+            sizes = np.maximum(boxes[valid, 2] - boxes[valid, 0], boxes[valid, 3] - boxes[valid, 1])
+            cell_size = max(32, 2 * int(np.median(sizes))) if sizes.size else 256
+        self.cell_size = int(cell_size)
+        self.origin = boxes[valid, :2].min(axis=0) if valid.any() else np.zeros(2, dtype=np.int64)
+        first = (boxes[:, :2] - self.origin) // self.cell_size # first and last cell (row, col) of every ROI
+        last = (boxes[:, 2:] - 1 - self.origin) // self.cell_size
+        self.grid_shape = tuple(int(v) + 1 for v in last[valid].max(axis=0)) if valid.any() else (0, 0)
+        
+        # one entry per (ROI, cell) pair, sorted by cell
+        cols = np.where(valid, last[:, 1] - first[:, 1] + 1, 0)
+        counts = np.where(valid, last[:, 0] - first[:, 0] + 1, 0) * cols
+        members = np.repeat(np.arange(len(boxes)), counts)
+        local = _ranges(np.zeros(len(boxes), dtype=np.intp), counts) # cell number within each ROI's block
+        member_cols = cols[members]
+        cells = ((first[members, 0] + local // member_cols) * self.grid_shape[1]
+                 + first[members, 1] + local % member_cols)
+        order = np.argsort(cells, kind='stable')
+        self._members = members[order]
+        self._cell_start = np.zeros(self.grid_shape[0] * self.grid_shape[1] + 1, dtype=np.intp)
+        np.cumsum(np.bincount(cells, minlength=len(self._cell_start) - 1), out=self._cell_start[1:])
+        return
+    
+    def __len__(self):
+        return len(self.bboxes)
+    
+    def __str__(self):
+        return "SpatialIndex of {} ROIs, {} x {} cells of {} px".format(len(self), *self.grid_shape, self.cell_size)
+    
+    def query(self, top, left, bottom, right):
+        """ROIs whose bounding box intersects the region (top, left, bottom, right), bottom/right exclusive"""
+        empty = np.zeros(0, dtype=np.intp)
+        if bottom <= top or right <= left or len(self._members) == 0:
+            return empty
+        (r0, c0), (r1, c1) = (np.array([[top, left], [bottom - 1, right - 1]]) - self.origin) // self.cell_size
+        r0, c0 = max(r0, 0), max(c0, 0)
+        r1, c1 = min(r1, self.grid_shape[0] - 1), min(c1, self.grid_shape[1] - 1)
+        if r0 > r1 or c0 > c1:
+            return empty
+        # the cells of one grid row are contiguous in the CSR arrays
+        row_cells = np.arange(r0, r1 + 1) * self.grid_shape[1]
+        starts, stops = self._cell_start[row_cells + c0], self._cell_start[row_cells + c1 + 1]
+        candidates = np.unique(self._members[_ranges(starts, stops - starts)])
+        boxes = self.bboxes[candidates]
+        hit = (boxes[:, 0] < bottom) & (boxes[:, 2] > top) & (boxes[:, 1] < right) & (boxes[:, 3] > left)
+        return candidates[hit]
+    
+    def point(self, row, col):
+        """ROIs whose bounding box contains the pixel (row, col)"""
+        return self.query(row, col, row + 1, col + 1)
+    
+    def overlaps(self, i):
+        """ROIs (other than i) whose bounding box overlaps the bounding box of ROI i"""
+        hits = self.query(*self.bboxes[i])
+        return hits[hits != i]
+    
+    def overlapping_pairs(self):
+        """(pairs, 2) array of all (i, j), i < j, with overlapping bounding boxes"""
+        pairs = [(i, j) for i in range(len(self)) for j in self.overlaps(i).tolist() if j > i]
+        return np.array(pairs, dtype=np.intp).reshape(-1, 2)
+
+
+def _tiles(plane_shape, tile_size):
+    """(top, left, bottom, right) of the tiles covering a plane, row by row"""
+    height, width = plane_shape
+    return [(top, left, min(top + tile_size, height), min(left + tile_size, width))
+            for top in range(0, height, tile_size) for left in range(0, width, tile_size)]
+
+
+def _tile_reader(image, axis=0, bundle_axes='yx'):
+    """
+    Region reads on an image without loading whole planes.
+    ndarrays, memmaps and other lazily sliced arrays (zarr, dask) are indexed per tile, so only the tile is read.
+    A 2D array is a single plane. PIMS frames can only be decoded whole: tiles are cut from the current frame
+    RETURNS: (read, n_frames, plane_shape) with read(frame, rows, cols) -> ndarray ([channels,] tile rows, tile cols)
+    """
+    if hasattr(image, 'frame_shape'):
+        stack, n_frames, plane_shape = _open_frames(image, axis, bundle_axes)
+        current = {}
+        
+        def read(frame, rows, cols):
+            if current.get('frame') != frame:
+                current.clear() # drop the previous frame before decoding the next one
+                current.update(frame=frame, data=np.asarray(stack[frame]))
+            return current['data'][..., rows, cols]
+        return read, n_frames, plane_shape
+    
+    if isinstance(axis, str):
+        if getattr(image, 'axes', None) is None:
+            raise ValueError("axis '{}' given by name, but the array has no named axes".format(axis))
+        image, axis = _select_axes(image, axis, bundle_axes), 0
+    ndim = len(image.shape)
+    axis = None if ndim == 2 else axis % ndim
+    
+    def read(frame, rows, cols):
+        key = [slice(None)] * ndim
+        if axis is not None:
+            key[axis] = frame
+        key[-2], key[-1] = rows, cols
+        return np.asarray(image[tuple(key)])
+    return read, 1 if axis is None else image.shape[axis], tuple(image.shape[-2:])
+
+
+def _tile_bounds(roi, plane_shape):
+    """(top, left, bottom, right) of the plane region holding the measured pixels of roi, without building a mask"""
+    height, width = plane_shape
+    if roi.mask_type == 'inside': # everything but the ROI
+        return 0, 0, height, width
+    top, left, bottom, right = roi.bbox
+    return min(max(top, 0), height), min(max(left, 0), width), min(max(bottom, 0), height), min(max(right, 0), width)
+
+
+def _tile_keep(roi, tile):
+    """
+    Measured pixels of roi inside a tile, computed for the tile only (also for 'inside' masking).
+    RETURNS: (top, left, keep) with keep a boolean mask whose corner is (top, left) in plane coordinates, or None
+    """
+    top, left, bottom, right = tile
+    b_top, b_left, b_bottom, b_right = roi.bbox
+    r0, r1 = max(b_top, top), min(b_bottom, bottom) # bbox part inside the tile
+    c0, c1 = max(b_left, left), min(b_right, right)
+    inside = roi.bbox_mask[r0 - b_top:r1 - b_top, c0 - b_left:c1 - b_left] if r0 < r1 and c0 < c1 else None
+    if roi.mask_type == 'inside': # ROI is masked, measure the rest of the tile
+        keep = np.ones((bottom - top, right - left), dtype=bool)
+        if inside is not None:
+            keep[r0 - top:r1 - top, c0 - left:c1 - left] &= ~inside
+        return top, left, keep
+    return None if inside is None else (r0, c0, inside)
+
+
+def _tile_segments(rois, ids, tile):
+    """
+    Sparse index of the measured pixels of rois[ids] inside a tile, like _roi_index() for the whole plane.
+    RETURNS: (ids, flat_index, offsets) of the ROIs with pixels in the tile (int32 flat indices within the tile)
+    """
+    top, left, bottom, right = tile
+    kept, segments = [], []
+    for i in ids.tolist():
+        region = _tile_keep(rois[i], tile)
+        if region is None:
+            continue
+        r0, c0, keep = region
+        rr, cc = np.nonzero(keep)
+        if rr.size:
+            kept.append(i)
+            segments.append(((rr + r0 - top) * (right - left) + cc + c0 - left).astype(np.int32))
+    offsets = np.zeros(len(segments) + 1, dtype=np.intp)
+    offsets[1:] = np.cumsum([len(segment) for segment in segments])
+    flat_index = np.concatenate(segments) if segments else np.zeros(0, dtype=np.int32)
+    return np.array(kept, dtype=np.intp), flat_index, offsets
+
+
+def _histogram_part(part, merged=None):
+    """
+    Sparse histograms (distinct values, counts), one per channel, of the integer pixels of one ROI part of
+    shape ([channels,] pixels), merged with the histograms of the parts before it. Their size is bounded by
+    the distinct grey levels of the ROI, whatever its number of pixels
+    """
+    histograms = []
+    for c, row in enumerate(part.reshape(-1, part.shape[-1])):
+        if not row.size:
+            histograms.append(merged[c] if merged is not None else (np.zeros(0, np.int32), np.zeros(0, np.int64)))
+            continue
+        low, high = int(row.min()), int(row.max())
+        if merged is not None and merged[c][0].size:
+            low, high = min(low, int(merged[c][0][0])), max(high, int(merged[c][0][-1]))
+        dense = np.bincount(row.astype(np.int32) - low, minlength=high - low + 1) # 8/16 bit: at most 65536 bins
+        if merged is not None:
+            dense[merged[c][0] - low] += merged[c][1]
+        values = np.flatnonzero(dense)
+        histograms.append(((values + low).astype(np.int32), dense[values]))
+    return histograms
+
+
+def _histogram_percentiles(histograms, channel_shape, percentiles):
+    """Percentiles (linear interpolation as np.percentile) from _histogram_part() histograms. RETURNS: ([channels,] percentiles)"""
+    q = np.asarray(percentiles, dtype=np.float64) / 100
+    out = np.full((len(histograms), q.size), np.nan)
+    for c, (values, counts) in enumerate(histograms):
+        cdf = np.cumsum(counts)
+        if not cdf.size:
+            continue
+        rank = (cdf[-1] - 1) * q
+        below, above = np.floor(rank).astype(np.int64), np.ceil(rank).astype(np.int64)
+        low = values[np.searchsorted(cdf, below, side='right')].astype(np.float64)
+        high = values[np.searchsorted(cdf, above, side='right')].astype(np.float64)
+        out[c] = low + (rank - below) * (high - low)
+    return out.reshape(tuple(channel_shape) + (q.size,))
+
+
+def _merge_moments(total, part, ids):
+    """
+    Merge per-tile statistics of ROI parts into the running totals of those ROIs, in place.
+    total: dict of ([channels,] rois) arrays 'count', 'sum', 'm2' (sum of squared deviations), 'min', 'max'
+    part: _summarize_segments() result of the ROIs ids (count, sum, std, min, max)
+    Squared deviations are merged with the parallel variance formula (Chan et al.), not from sums of squares
+    """
+    n_a, n_b = total['count'][..., ids], part['count']
+    s_a, s_b = total['sum'][..., ids], part['sum']
+    n = n_a + n_b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = s_b / n_b - s_a / n_a
+        correction = np.where((n_a > 0) & (n_b > 0), delta * delta * n_a * n_b / n, 0)
+    total['m2'][..., ids] += np.nan_to_num(part['std'] ** 2 * n_b) + correction
+    total['count'][..., ids] = n
+    total['sum'][..., ids] = s_a + s_b
+    total['min'][..., ids] = np.fmin(total['min'][..., ids], part['min'])
+    total['max'][..., ids] = np.fmax(total['max'][..., ids], part['max'])
+
+
+#%%
+#### IMAGE PYRAMID
+# Downsampled copies of an image for fast, approximate passes (QC, tuning parameters in the GUI) before a full
+# resolution run. Level k bins 2^k x 2^k pixels of every yx plane (block mean); the other axes are kept, so
+# frames and ROI positions are the same at every level. ROI geometry is scaled to a level with scale_roi().
+
+def _bin_plane(plane, out, rows=1024):
+    """2 x 2 block mean of a yx plane into out (float32), rows at a time. Odd sizes repeat the last row/column"""
+    height, width = plane.shape
+    for start in range(0, height, rows): # rows is even, so strips start on block boundaries
+        strip = np.asarray(plane[start:start + rows], dtype=np.float32)
+        if strip.shape[0] % 2 or width % 2:
+            strip = np.pad(strip, ((0, strip.shape[0] % 2), (0, width % 2)), mode='edge')
+        out[start // 2:(start + strip.shape[0]) // 2] = strip.reshape(strip.shape[0] // 2, 2, -1, 2).mean(axis=(1, 3))
+    return out
+
+
+def _to_full_resolution(table, scale):
+    """Scale the area statistics ('sum', 'count') of a table measured at a pyramid level back to full resolution"""
+    if scale != 1:
+        for column in table.columns:
+            if re.fullmatch(r'(sum|count)(_c\d+)?', str(column)):
+                table[column] = table[column] / scale ** 2
+    return table
+
+
+_PYRAMIDS = [] # (image, ImagePyramid) of the last images measured at a level, see _pyramid_of()
+
+
+def _pyramid_of(image, keep=2):
+    """
+    ImagePyramid of image (ndarray, PIMS object or path), shared by all measurements of the same image so
+    that measuring ROIs one by one (ROI.measure_stack(level=k)) builds each level once. The pyramids of the
+    last keep images are kept, and with them their images
+    """
+    for i, (known, pyramid) in enumerate(_PYRAMIDS):
+        if known is image or (isinstance(image, str) and isinstance(known, str) and known == image):
+            _PYRAMIDS.append(_PYRAMIDS.pop(i))
+            return pyramid
+    pyramid = ImagePyramid(image)
+    _PYRAMIDS.append((image, pyramid))
+    del _PYRAMIDS[:-keep]
+    return pyramid
+
+
+def _correlation(a, b):
+    """Pearson correlation, nan if there are fewer than two values or one of them is constant"""
+    if a.size < 2 or a.std() == 0 or b.std() == 0:
+        return np.nan
+    return float(np.corrcoef(a, b)[0, 1])
+
+
+class ImagePyramid:
+    """
+    Multiscale copies of an image for fast approximate measurements.
+    Level 0 is the image itself, level k has every yx plane binned 2^k x 2^k (block mean, float32) and the
+    other axes unchanged (memmap axis names are kept, so axes can still be picked by name). Levels are built
+    on first use from the level below, one plane at a time, and kept as .npy memmaps in store: by default a
+    temporary directory (removed with the pyramid), so nothing is written next to the data. Give a directory,
+    or store=True for '<image file>.pyramid', to keep the levels for later runs; the stored levels are
+    rebuilt when the image file or shape changes.
+    
+    Level k reads 4^k times fewer pixels. Means are close to the full resolution ones, median, std, min and
+    max of binned pixels are smoothed, and 'sum'/'count' are scaled back by the measuring functions.
+    ROI_Reader.pyramid_accuracy() reports the error of a level.
+    
+    INPUTS:
+        image: ndarray, memmap, PIMS object (frames in its current iteration order) or path
+        store: directory for the levels. None: temporary. True: '<image file>.pyramid' next to the image file
+            (opt-in, needs a writable data directory)
+        min_size: levels stop before the shorter side of a plane gets below min_size
+    
+    Example:
+        pyramid = ImagePyramid('stitched.tif')
+        preview = reader.measure_ROIs(pyramid, level=3)
+    """
+    
+    VERSION = 1 # bump when binning changes so stored levels are not reused
+    
+    def __init__(self, image, store=None, min_size=64):
+        import json
         
+        source = image if isinstance(image, str) else getattr(image, 'filename', None)
+        self.image = open_image(image) if isinstance(image, str) else image
+        if hasattr(self.image, 'frame_shape'): # PIMS: one plane stack per frame, in iteration order
+            self.shape = (len(self.image),) + tuple(self.image.frame_shape)
+            axes = ''.join(getattr(self.image, 'iter_axes', None) or '') + ''.join(getattr(self.image, 'bundle_axes', None) or '')
+            self.axes = axes if len(axes) == len(self.shape) else None
+        else:
+            self.shape = tuple(self.image.shape)
+            self.axes = getattr(self.image, 'axes', None)
+        self.n_levels = 1 + max(int(np.log2(min(self.shape[-2:]) / min_size)), 0) if min(self.shape[-2:]) >= min_size else 1
+        self._levels = {}
+        
+        self._tmp = None
+        if store is True:
+            if source is None or not os.path.isfile(source):
+                raise ValueError("store=True needs an image file to store the pyramid next to")
+            store = source + '.pyramid'
+        if store is None:
+            import tempfile
+            self._tmp = tempfile.TemporaryDirectory(prefix='roitools-pyramid-')
+            store = self._tmp.name
+        self.store = store
+        os.makedirs(store, exist_ok=True)
+        
+        # drop stored levels of another version of the image
+        stat = os.stat(source) if source is not None and os.path.isfile(source) else None
+        meta = {'version': self.VERSION, 'shape': list(self.shape), 'axes': self.axes,
+                'size': stat.st_size if stat else None, 'mtime': stat.st_mtime if stat else None}
+        meta_path = os.path.join(store, 'pyramid.json')
+        try:
+            with open(meta_path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = None
+        if stored != meta:
+            for name in os.listdir(store):
+                if name.startswith('level') and name.endswith('.npy'):
+                    os.remove(os.path.join(store, name))
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        return
+    
+    def __repr__(self):
+        return "ImagePyramid({} levels of {}, store '{}')".format(self.n_levels, self.shape, self.store)
+    
+    def __len__(self):
+        return self.n_levels
+    
+    def scale(self, level):
+        """Factor from full resolution to level coordinates (0.5 ** level)"""
+        return 0.5 ** level
+    
+    def plane_shape(self, level):
+        """(height, width) of the planes of a level"""
+        height, width = self.shape[-2:]
+        return -(-height // 2 ** level), -(-width // 2 ** level)
+    
+    def __getitem__(self, level):
+        """The image at level (level 0 is the image itself), built or loaded on first use"""
+        if level == 0:
+            return self.image
+        if not 0 < level < self.n_levels:
+            raise IndexError("level {} out of range, the pyramid has {} levels".format(level, self.n_levels))
+        if level not in self._levels:
+            path = os.path.join(self.store, 'level{}.npy'.format(level))
+            if not os.path.isfile(path):
+                self._build(level, path)
+            stack = np.load(path, mmap_mode='r')
+            stack.axes = self.axes
+            self._levels[level] = stack
+        return self._levels[level]
+    
+    def _build(self, level, path):
+        below = self[level - 1]
+        part = path[:-len('.npy')] + '.part.npy' # renamed once complete, so a killed build is not reused
+        out = np.lib.format.open_memmap(part, mode='w+', dtype=np.float32, shape=self.shape[:-2] + self.plane_shape(level))
+        with INSTRUMENTATION.stage('pyramid', level=level):
+            if hasattr(below, 'frame_shape'): # PIMS: read each frame once
+                for i, frame in enumerate(below):
+                    frame = np.asarray(frame)
+                    for index in np.ndindex(frame.shape[:-2]):
+                        _bin_plane(frame[index], out[i][index])
+            else:
+                for index in np.ndindex(below.shape[:-2]):
+                    _bin_plane(below[index], out[index])
+        out.flush()
+        del out
+        os.replace(part, path)
+        logger.debug("ImagePyramid: built level %d (%s) in %s", level, self.plane_shape(level), self.store)
+        return
+
+
+#%%
+#### LIVE ACQUISITION
+# Measure a time-lapse while it is being acquired. GrowingStack keeps track of the frames that are complete
+# on disk (pages of a growing TIFF or per-frame TIFFs in a directory) and LiveMeasurement measures only the
+# frames that appeared since its last update, so an update costs the same at frame 10 and at frame 10000.
+
+# TIFF tags needed to locate the pixel data of a page
+_TIFF_TAGS = {256: 'width', 257: 'length', 258: 'bits', 259: 'compression', 273: 'offsets', 277: 'samples',
+              279: 'counts', 284: 'planar', 322: 'tile_width', 339: 'sample_format'}
+_TIFF_TYPES = {1: 'B', 3: 'H', 4: 'I', 16: 'Q'} # BYTE, SHORT, LONG, LONG8
+
+
+class GrowingStack:
+    """
+    Frames of an acquisition that is still being written, read as they become complete.
+    INPUTS:
+        path: a TIFF file that grows by appending pages, or a directory that receives one TIFF per frame.
+            It does not have to exist yet (watching can start before the acquisition)
+        pattern: file name pattern of the frames in a directory (sorted by name = acquisition order)
+        directory: True for a frame directory, False for a growing TIFF. None (default): whatever path
+            turns out to be once it exists
+    
+    refresh() looks for new frames and returns the number of complete frames. For a TIFF it continues the
+    page (IFD) chain from the last page it knows, so only the new pages are parsed. A page counts once its
+    pixel data is entirely on disk. A file in a directory counts once its size did not change between two
+    refreshes. stack[i] returns frame i as an ndarray.
+    """
+    
+    def __init__(self, path, pattern='*.tif*', directory=None):
+        self.path = path
+        self.pattern = pattern
+        self.is_directory = directory # None: decided by the first refresh() that finds path on disk
+        self.frames = [] # per frame: file name (directory) or page layout (TIFF)
+        self._pending = {} # directory: size of files not yet complete
+        self._known = set()
+        self._next_pointer = None # TIFF: file offset of the next-IFD pointer of the last known page
+        return
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def refresh(self):
+        """Find frames completed since the last refresh. RETURNS: number of complete frames"""
+        if not os.path.exists(self.path): # acquisition not started yet
+            return len(self.frames)
+        if self.is_directory is None:
+            self.is_directory = os.path.isdir(self.path)
+        if self.is_directory:
+            self._refresh_directory()
+        else:
+            self._refresh_tiff()
+        return len(self.frames)
+    
+    def _refresh_directory(self):
+        import fnmatch
+        
+        new = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                name = entry.name
+                if name in self._known or name.startswith('.') or not fnmatch.fnmatch(name, self.pattern):
+                    continue
+                size = entry.stat().st_size
+                # unchanged since the last refresh, and the first page is entirely on disk
+                if size > 0 and self._pending.get(name) == size and self._first_page_complete(entry.path, size):
+                    new.append(name)
+                else:
+                    self._pending[name] = size
+        for name in sorted(new):
+            del self._pending[name]
+            self._known.add(name)
+            self.frames.append(os.path.join(self.path, name))
+    
+    def _first_page_complete(self, path, size):
+        """True if the first page (IFD and pixel data) of the TIFF at path is written (directory frames)"""
+        import struct
+        
+        with open(path, 'rb') as fh:
+            header = fh.read(16)
+            if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+                return False
+            order = '<' if header[:2] == b'II' else '>'
+            big = struct.unpack(order + 'H', header[2:4])[0] == 43
+            offset = struct.unpack(order + ('Q' if big else 'I'), header[8:16] if big else header[4:8])[0]
+            try:
+                return offset > 0 and self._read_ifd(fh, offset, size, order, big) is not None
+            except ValueError: # tiled page, tifffile reads it: rely on the stable size
+                return True
+    
+    def _refresh_tiff(self):
+        import struct
+        
+        size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as fh:
+            if self._next_pointer is None: # header
+                header = fh.read(16)
+                if len(header) < 8:
+                    return
+                self._order = '<' if header[:2] == b'II' else '>'
+                self._big = struct.unpack(self._order + 'H', header[2:4])[0] == 43
+                self._next_pointer = 8 if self._big else 4
+            offset_format = self._order + ('Q' if self._big else 'I')
+            offset_size = struct.calcsize(offset_format)
+            while True:
+                fh.seek(self._next_pointer)
+                pointer = fh.read(offset_size)
+                if len(pointer) < offset_size:
+                    return
+                offset = struct.unpack(offset_format, pointer)[0]
+                if offset == 0: # end of the chain so far
+                    return
+                page = self._read_ifd(fh, offset, size)
+                if page is None: # IFD or pixel data not written yet
+                    return
+                self.frames.append(page)
+                self._next_pointer = page.pop('next_pointer')
+    
+    def _read_ifd(self, fh, offset, file_size, order=None, big=None):
+        """Layout of the page whose IFD starts at offset, None if it is not complete on disk yet"""
+        import struct
+        
+        order = self._order if order is None else order
+        big = self._big if big is None else big
+        count_format, entry_size = ('Q', 20) if big else ('H', 12)
+        fh.seek(offset)
+        raw = fh.read(struct.calcsize(count_format))
+        if len(raw) < struct.calcsize(count_format):
+            return None
+        n_entries = struct.unpack(order + count_format, raw)[0]
+        entries = fh.read(n_entries * entry_size)
+        next_pointer = offset + len(raw) + n_entries * entry_size
+        if len(entries) < n_entries * entry_size or next_pointer + (8 if big else 4) > file_size:
+            return None
+        
+        page = {'bits': 8, 'compression': 1, 'samples': 1, 'planar': 1, 'sample_format': 1, 'next_pointer': next_pointer}
+        for i in range(n_entries):
+            entry = entries[i * entry_size:(i + 1) * entry_size]
+            if big:
+                tag, kind, count = struct.unpack(order + 'HHQ', entry[:12])
+                value = entry[12:]
+            else:
+                tag, kind, count = struct.unpack(order + 'HHI', entry[:8])
+                value = entry[8:]
+            if tag not in _TIFF_TAGS or kind not in _TIFF_TYPES:
+                continue
+            item = order + str(count) + _TIFF_TYPES[kind]
+            if struct.calcsize(item) > len(value): # values stored elsewhere in the file
+                where = struct.unpack(order + ('Q' if big else 'I'), value)[0]
+                fh.seek(where)
+                value = fh.read(struct.calcsize(item))
+                if len(value) < struct.calcsize(item):
+                    return None
+            values = struct.unpack(item, value[:struct.calcsize(item)])
+            page[_TIFF_TAGS[tag]] = values if tag in (258, 273, 279) else values[0]
+        
+        page['bits'] = page['bits'][0] if isinstance(page['bits'], tuple) else page['bits']
+        if 'tile_width' in page:
+            raise ValueError("'{}': only striped TIFF pages can be followed".format(self.path))
+        # writers may extend the file before the entries (or the strip offsets) are filled in
+        if 'offsets' not in page or 'counts' not in page or 0 in page['offsets']:
+            return None
+        if max(o + c for o, c in zip(page['offsets'], page['counts'])) > file_size:
+            return None
+        return page
+    
+    def __getitem__(self, i):
+        frame = self.frames[i]
+        if self.is_directory:
+            import tifffile
+            return tifffile.imread(frame)
+        return self._read_page(i, frame)
+    
+    def _read_page(self, i, page):
+        kind = {1: 'u', 2: 'i', 3: 'f'}[page['sample_format']]
+        dtype = np.dtype('{}{}{}'.format(self._order, kind, page['bits'] // 8))
+        offsets, counts = page['offsets'], page['counts']
+        contiguous = all(offsets[i] + counts[i] == offsets[i + 1] for i in range(len(offsets) - 1))
+        if page['compression'] == 1 and contiguous:
+            n_pixels = page['length'] * page['width'] * page['samples']
+            frame = np.fromfile(self.path, dtype=dtype, count=n_pixels, offset=offsets[0])
+        else: # compressed or scattered strips: let tifffile decode the page
+            import tifffile
+            with tifffile.TiffFile(self.path) as tif:
+                return tif.pages[i].asarray()
+        if page['samples'] == 1:
+            return frame.reshape(page['length'], page['width'])
+        if page['planar'] == 2:
+            return frame.reshape(page['samples'], page['length'], page['width'])
+        return np.moveaxis(frame.reshape(page['length'], page['width'], page['samples']), -1, 0) # channels first
+
+
+class LiveMeasurement:
+    """
+    Incremental measurement of a growing acquisition, created by ROI.follow() or ROI_Reader.follow().
+    update() measures the frames that appeared since the previous update and appends their rows to
+    results (and to the output .csv, if given), so the cost of an update depends on the number of new
+    frames only. watch() polls until the acquisition stops growing.
+    
+    Rows are in acquisition order: one row per frame and ROI, with 'name', 'frame' and the measurements
+    as in ROI_Reader.measure_ROIs(). ROIs bound to time points (position, see ROI.planes()) only get rows
+    for those. Frames with several channels (multi-channel TIFF pages) give
+    '<measurement>_c<channel>' columns.
+    
+    Example:
+        live = ROI_Reader('RoiSet.zip').follow('acquisition/', output='live.csv')
+        for rows in live.watch(poll=1.0, idle=60):
+            print(rows.groupby('name')['mean'].last())
+    """
+    
+    def __init__(self, rois, source, measurements=('mean', 'median', 'std'), output=None, resume=True,
+                 pattern='*.tif*', chunk_size=32, cache=None, position='t'):
+        """
+        rois: ROI objects and/or read_roi dicts (dicts are rasterized once the frame size is known)
+        source: path of the growing TIFF or frame directory, or a GrowingStack
+        output: optional .csv; new rows are appended to it after every update. A ResultsWriter is written
+            to (and flushed) after every update instead
+        resume: if output already holds results, continue after its last measured frame
+        chunk_size: number of new frames gathered at once when catching up
+        cache: RasterCache for ROIs given as dicts (None = RASTER_CACHE)
+        position: stored ROI position matched against the acquired frames ('t' for time-lapses, 'z' for
+            z-stacks written plane by plane). False measures every ROI on every frame
+        """
+        self.rois = list(rois)
+        self.source = source if isinstance(source, GrowingStack) else GrowingStack(source, pattern)
+        self.measurements = _expand_measurements(measurements)
+        self.output = output
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.position = position
+        self.n_measured = 0 # frames measured so far
+        self._tables = []
+        self._index = None
+        if isinstance(output, str) and resume and os.path.exists(output) and os.path.getsize(output) > 0:
+            from pandas import read_csv
+            frames = read_csv(output, usecols=['frame'])['frame']
+            self.n_measured = int(frames.max()) + 1 if len(frames) else 0
+        return
+    
+    @property
+    def results(self):
+        """DataFrame of all rows measured by this object"""
+        from pandas import DataFrame, concat
+        
+        if not self._tables:
+            return DataFrame()
+        if len(self._tables) > 1:
+            self._tables = [concat(self._tables, ignore_index=True)]
+        return self._tables[0]
+    
+    def _prepare(self, plane_shape):
+        """Rasterize ROIs given as dicts and index the measured pixels of all ROIs, once"""
+        self.rois = [roi if isinstance(roi, ROI) else ROI(roi, cache=self.cache, frame_shape=plane_shape)
+                     for roi in self.rois]
+        self._names = np.array([roi.name for roi in self.rois], dtype=object)
+        self._plane_shape = plane_shape
+        # ROIs bound to some frames are only measured on those (by_plane), the others on every frame
+        self._unbound, self._by_plane = _plane_index(self.rois, self.position, None)
+        self._index = _roi_index([self.rois[i] for i in self._unbound], plane_shape)
+    
+    def update(self):
+        """Measure frames that are new since the last update. RETURNS: DataFrame of the new rows (None if no new frames)"""
+        n_frames = self.source.refresh()
+        if n_frames <= self.n_measured:
+            return None
+        pieces = [] # as in ROI_Reader.measure_ROIs()
+        for start in range(self.n_measured, n_frames, self.chunk_size):
+            stop = min(start + self.chunk_size, n_frames)
+            with INSTRUMENTATION.stage('read_frame'):
+                chunk = np.stack([np.asarray(self.source[i]) for i in range(start, stop)])
+            INSTRUMENTATION.count('frames', stop - start)
+            if self._index is None:
+                self._prepare(chunk.shape[-2:])
+            chunk = chunk.reshape(chunk.shape[:-2] + (-1,))
+            selected = np.arange(start, stop)
+            if len(self._unbound): # ROIs measured on every frame
+                flat_index, offsets = self._index
+                stats = _summarize_segments(chunk[..., flat_index], offsets, self.measurements)
+                pieces.append((np.repeat(self._unbound, len(selected)), np.tile(selected, len(self._unbound)),
+                               {m: _roi_major(stat) for m, stat in stats.items()}))
+            for frame, plane in zip(selected.tolist(), chunk): # ROIs bound to this frame, the others are skipped
+                if frame in self._by_plane:
+                    bound = self._by_plane[frame]
+                    flat_index, offsets = _roi_index([self.rois[i] for i in bound], self._plane_shape)
+                    stats = _summarize_segments(plane[None, ..., flat_index], offsets, self.measurements)
+                    pieces.append((bound, np.full(len(bound), frame), {m: _roi_major(stat) for m, stat in stats.items()}))
+        if pieces:
+            table = _pieces_table(pieces, self._names, self.measurements, frame_major=True)
+        else: # every ROI is bound to other frames
+            from pandas import DataFrame
+            table = DataFrame(columns=['name', 'frame'] + list(self.measurements))
+        self.n_measured = n_frames
+        self._tables.append(table)
+        if not len(table):
+            return table
+        if isinstance(self.output, ResultsWriter):
+            self.output.write(table, axis=self.position or 't')
+            self.output.flush()
+        elif self.output is not None:
+            with INSTRUMENTATION.stage('write'):
+                write_header = not os.path.exists(self.output) or os.path.getsize(self.output) == 0
+                table.to_csv(self.output, mode='a', header=write_header, index=False)
+        return table
+    
+    def watch(self, poll=1.0, timeout=None, idle=None):
+        """
+        Poll the acquisition every poll seconds and yield the rows of every update.
+        Stops after timeout seconds in total, or after idle seconds without new frames (None = never)
+        """
+        start = last_frame = time.monotonic()
+        while True:
+            table = self.update()
+            now = time.monotonic()
+            if table is not None:
+                last_frame = now
+                yield table
+            elif idle is not None and now - last_frame >= idle:
+                return
+            if timeout is not None and now - start >= timeout:
+                return
+            time.sleep(poll)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Batch operations for ROITools
+
+Features:
+1. Filename matching
+    - Pair every image with its ImageJ ROI set (.zip or .roi) using naming rules
+    - Select ROIs within each set by name (regular expression)
+
+2. Batch measurement
+    - Measure each image/ROI pair with ROI_Reader.measure_ROIs() in a process pool (one pair per process)
+    - Results of each pair are written to their own .csv as soon as the pair finishes, or streamed into a
+      Parquet dataset (one part file per pair) or one HDF5 file per pair with ROITools.ResultsWriter
+    - Completed pairs are recorded in a manifest, so an interrupted run resumes without recomputing them
+    - With cache_dir, results are also kept in a ROITools.ResultCache, so a full re-run only measures new
+      images and edited ROIs
+
+Example:
+    pairs = match_pairs('images/', 'rois/')
+    summary = run_batch(pairs, 'results/', measurements=('mean', 'median', 'std'), workers=8)
+"""
+
+import os
+import re
+import json
+import logging
+
+logger = logging.getLogger('ROITools.batch')
+
+IMAGE_EXTENSIONS = ('.tif', '.tiff', '.nd2', '.czi', '.lif', '.png')
+ROI_EXTENSIONS = ('.zip', '.roi')
+# suffixes commonly added by ImageJ's ROI manager or by hand, removed to match the image name
+ROI_SUFFIXES = r'([ _-]?(roiset|rois?))$'
+MANIFEST = 'completed.jsonl'
+OUTPUT_FORMATS = ('csv', 'parquet', 'hdf5')
+PARQUET_DATASET = 'results.parquet' # dataset directory in output_dir for output_format='parquet'
+
+
+def pair_key(path, pattern=None):
+    """
+    Return the key used to match an image with an ROI set.
+    INPUTS:
+        path: path to the image or ROI file
+        pattern: optional regular expression. If it contains a group named 'key' that group is the key,
+            otherwise the whole match is. Files that do not match return None.
+            By default the key is the file name without extension and without ROI set suffixes ('_RoiSet', '_rois')
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if pattern is None:
+        return re.sub(ROI_SUFFIXES, '', stem, flags=re.IGNORECASE)
+
+    match = re.search(pattern, stem)
+    if match is None:
+        return None
+    return match.group('key') if 'key' in match.re.groupindex else match.group(0)
+
+
+def _list_files(directory, extensions, recursive=False):
+    if recursive:
+        found = [os.path.join(root, f) for root, _, files in os.walk(directory) for f in files]
+    else:
+        found = [os.path.join(directory, f) for f in os.listdir(directory)]
+    return sorted(f for f in found if os.path.isfile(f) and f.lower().endswith(extensions))
+
+
+def match_pairs(image_dir, roi_dir=None, image_pattern=None, roi_pattern=None, recursive=False):
+    """
+    Discover image <-> ROI set pairs by naming rules.
+    INPUTS:
+        image_dir: directory containing images
+        roi_dir: directory containing .zip/.roi files. Defaults to image_dir
+        image_pattern, roi_pattern: regular expressions used by pair_key() to extract the matching key
+        recursive: search sub-directories
+    RETURNS: list of (key, image_path, roi_path) sorted by key. Unmatched files are reported and skipped.
+    """
+    roi_dir = image_dir if roi_dir is None else roi_dir
+
+    images = {}
+    for path in _list_files(image_dir, IMAGE_EXTENSIONS, recursive):
+        key = pair_key(path, image_pattern)
+        if key is not None:
+            images.setdefault(key, path)
+    rois = {}
+    for path in _list_files(roi_dir, ROI_EXTENSIONS, recursive):
+        key = pair_key(path, roi_pattern)
+        if key is not None:
+            rois.setdefault(key, path)
+
+    pairs = [(key, images[key], rois[key]) for key in sorted(set(images) & set(rois))]
+    unmatched = sorted(set(images) ^ set(rois))
+    if unmatched:
+        logger.warning("match_pairs(): %d file(s) without a partner: %s", len(unmatched), unmatched)
+    return pairs
+
+
+def completed_pairs(output_dir):
+    """Return the records of the pairs already measured in output_dir (from the manifest), keyed by pair key"""
+    manifest = os.path.join(output_dir, MANIFEST)
+    done = {}
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError: # partially written line from an interrupted run
+                    continue
+                if os.path.exists(record['output']):
+                    done[record['key']] = record
+    return done
+
+
+def _output_path(output_dir, key, output_format='csv'):
+    """Where the results of a pair go: <key>.csv, <key>.h5 or a part file of the Parquet dataset"""
+    if output_format == 'parquet':
+        return os.path.join(output_dir, PARQUET_DATASET, key + '.parquet')
+    return os.path.join(output_dir, key + ('.h5' if output_format == 'hdf5' else '.csv'))
+
+
+def _measure_pair(key, image_path, roi_path, output_path, roi_names=None, output_format='csv', cache_dir=None,
+                  **measure_kwargs):
+    """
+    Worker: measure one image/ROI pair and write the results to output_path.
+    Runs in a separate process, so everything is imported here.
+    """
+    import ROITools
+
+    if cache_dir is not None: # workers share the on-disk store
+        measure_kwargs['result_cache'] = ROITools.ResultCache(cache_dir)
+    reader = ROITools.ROI_Reader(roi_path, image=image_path)
+    names = None
+    if roi_names is not None:
+        names = [k for k in reader.keys if re.search(roi_names, k)]
+
+    if output_format == 'parquet': # part file named after the pair, only renamed into place once complete
+        with ROITools.ResultsWriter(os.path.dirname(output_path), image=key, part=key) as sink:
+            reader.measure_ROIs(names=names, sink=sink, **measure_kwargs)
+        return len(sink)
+    if output_format == 'hdf5':
+        partial = output_path[:-len('.h5')] + '.part.h5'
+        with ROITools.ResultsWriter(partial, image=key, append=False) as sink:
+            reader.measure_ROIs(names=names, sink=sink, **measure_kwargs)
+        os.replace(partial, output_path)
+        return len(sink)
+
+    table = reader.measure_ROIs(names=names, **measure_kwargs)
+    table.insert(0, 'image', key)
+
+    # write to a temporary file first so that a killed worker never leaves a truncated result
+    partial = output_path + '.part'
+    with ROITools.INSTRUMENTATION.stage('write'):
+        table.to_csv(partial, index=False)
+        os.replace(partial, output_path)
+    return len(table)
+
+
+def run_batch(pairs, output_dir, roi_names=None, workers=None, resume=True, output_format='csv', cache_dir=None,
+              **measure_kwargs):
+    """
+    Measure image/ROI pairs in parallel, one pair per process.
+    INPUTS:
+        pairs: list of (key, image_path, roi_path), e.g. from match_pairs()
+        output_dir: directory for the per-pair .csv results and the manifest of completed pairs
+        roi_names: optional regular expression; only ROIs with matching names are measured
+        workers: number of processes. Defaults to the number of CPUs
+        resume: skip pairs recorded as completed in output_dir
+        output_format: 'csv' (one .csv per pair), 'parquet' (one part file per pair in output_dir/results.parquet,
+            read the whole run with pandas.read_parquet()) or 'hdf5' (one .h5 per pair). Parquet and HDF5 results
+            are streamed chunk by chunk and use the ResultsWriter schema (image, name, c, z, t, statistics)
+        cache_dir: optional directory of a ROITools.ResultCache shared by the workers. Rows of unchanged
+            (image, ROI, settings) combinations are reused, so re-running with resume=False after adding
+            images or editing ROIs only measures what changed
+        measure_kwargs: passed to ROI_Reader.measure_ROIs() (axis, bundle_axes, measurements, chunk_size)
+    RETURNS: dict with lists of 'completed', 'skipped' and 'failed' keys
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("output_format must be one of {}, got '{}'".format(OUTPUT_FORMATS, output_format))
+    os.makedirs(output_dir, exist_ok=True)
+    done = completed_pairs(output_dir) if resume else {}
+    todo = [pair for pair in pairs if pair[0] not in done]
+    summary = {'completed': [], 'skipped': [key for key, _, _ in pairs if key in done], 'failed': []}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(os.path.join(output_dir, MANIFEST), 'a') as manifest:
+        futures = {}
+        for key, image_path, roi_path in todo:
+            output_path = _output_path(output_dir, key, output_format)
+            future = pool.submit(_measure_pair, key, image_path, roi_path, output_path, roi_names, output_format,
+                                 cache_dir, **measure_kwargs)
+            futures[future] = (key, image_path, roi_path, output_path)
+
+        for future in as_completed(futures):
+            key, image_path, roi_path, output_path = futures[future]
+            try:
+                rows = future.result()
+            except Exception as error: # keep going, failed pairs are retried on the next run
+                logger.error("run_batch(): pair '%s' failed: %r", key, error)
+                summary['failed'].append(key)
+                continue
+            # record completion only after the result file is in place
+            record = dict(key=key, image=image_path, rois=roi_path, output=output_path, rows=rows)
+            manifest.write(json.dumps(record) + '\n')
+            manifest.flush()
+            summary['completed'].append(key)
+
+    return summary
@@ -0,0 +1,642 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for ROITools hot paths
+
+Features:
+1. Synthetic data
+    - synthetic_stack(): 2D-5D stacks (uint8/uint16/float32, small or camera-sized frames), optionally saved as .tif
+    - synthetic_rois() / write_roi_zip(): rectangle/oval/polygon ROIs, written as ImageJ .roi files in a .zip
+    - simulate_acquisition(): write a time-lapse frame by frame (growing .tif or directory of frames)
+
+2. Benchmark suite
+    - Cold start of a fresh process (import ROITools, ROI_CLI measure), ROI construction, mask creation, single-ROI measurement (measure_stack), multi-ROI measurement
+      (measure_ROIs), measurement at image pyramid levels, re-runs through a ResultCache, opening ROI zips
+      (lazy vs eager), reader throughput (PIMS + FrameSource) and live measurement updates
+    - Every benchmark reports seconds, frames/s (or ROIs/s) and peak memory (tracemalloc) as one JSON record,
+      tagged with the git commit, so result files can be compared across commits with compare()
+
+3. Rasterization
+    - compare_rasterizers(): correctness and speed of ROITools.rasterize_rois() against skimage.draw
+      on synthetic rectangle, oval and large polygon (freehand neuron-like) ROIs
+
+Command line:
+    python ROI_Benchmark.py run [--suite quick|full] [-o results.json]
+    python ROI_Benchmark.py compare old.json new.json
+    python ROI_Benchmark.py raster
+    python ROI_Benchmark.py acquire live.tif [--frames 100] [--interval 0.1]
+"""
+
+import contextlib
+import io
+import json
+import os
+import struct
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+import numpy as np
+
+# frame sizes used by the suites
+SMALL_FRAME = (256, 256)
+CAMERA_FRAME = (2048, 2048)
+
+
+def random_polygon(n_vertices, center, radius, rng):
+    """
+    Irregular star-shaped outline (like a freehand neuron trace) with n_vertices integer vertices.
+    RETURNS: (x, y) lists of vertex coordinates
+    """
+    theta = np.sort(rng.uniform(0, 2 * np.pi, n_vertices))
+    # smooth radial noise so the outline wiggles like a hand-drawn trace
+    noise = np.convolve(rng.normal(0, 1, n_vertices), np.ones(9) / 9, mode='same')
+    r = radius * (1 + 0.3 * noise / max(np.abs(noise).max(), 1e-9))
+    x = np.round(center[1] + r * np.cos(theta)).astype(int)
+    y = np.round(center[0] + r * np.sin(theta)).astype(int)
+    return x.tolist(), y.tolist()
+
+
+def synthetic_rois(n_rois, shape=(2048, 2048), kinds=('rectangle', 'oval', 'polygon'), n_vertices=200, seed=0):
+    """
+    Synthetic ROIs in read_roi format, cycling through kinds, placed inside a frame of the given shape.
+    RETURNS: list of roi dicts
+    """
+    rng = np.random.default_rng(seed)
+    rois = []
+    for i in range(n_rois):
+        kind = kinds[i % len(kinds)]
+        size = int(rng.integers(8, max(9, min(shape) // 8)))
+        top = int(rng.integers(0, shape[0] - size))
+        left = int(rng.integers(0, shape[1] - size))
+        roi = {'name': '{}-{:05d}'.format(kind, i), 'type': kind, 'position': 0}
+        if kind in ('rectangle', 'oval'):
+            roi.update(top=top, left=left, width=size, height=int(rng.integers(4, size + 1)))
+        else:
+            x, y = random_polygon(n_vertices, (top + size / 2, left + size / 2), size / 2.5, rng)
+            roi.update(x=x, y=y, n=len(x))
+        rois.append(roi)
+    return rois
+
+
+def synthetic_stack(shape, dtype=np.uint16, seed=0, path=None):
+    """
+    Synthetic image with the given shape (2D to 5D, yx last): smooth background plus noise, scaled to dtype.
+    If path is given the stack is also saved as an (uncompressed) .tif
+    RETURNS: ndarray
+    """
+    rng = np.random.default_rng(seed)
+    dtype = np.dtype(dtype)
+    y, x = np.ogrid[0:shape[-2], 0:shape[-1]]
+    background = (np.sin(y / 37.0) + np.cos(x / 53.0) + 2) / 4 # 0..1
+    image = background * 0.5 + rng.random(shape, dtype=np.float32) * 0.5
+    if dtype.kind in 'ui':
+        image = (image * np.iinfo(dtype).max).astype(dtype)
+    else:
+        image = image.astype(dtype)
+    if path is not None:
+        import tifffile
+        tifffile.imwrite(path, image)
+    return image
+
+
+def simulate_acquisition(path, n_frames=100, frame_shape=SMALL_FRAME, dtype=np.uint16, interval=0.1, seed=0):
+    """
+    Write a time-lapse frame by frame, like a microscope does during an acquisition, to test live measurement
+    (ROITools.LiveMeasurement). Run it in another process, e.g.
+        python ROI_Benchmark.py acquire live.tif --frames 500 --interval 0.05
+    INPUTS:
+        path: .tif file that grows by one page per frame, or a directory that receives frame_00000.tif, ...
+        n_frames, frame_shape, dtype: frames to write (synthetic_stack() frames)
+        interval: seconds between frames
+    """
+    import tifffile
+    
+    stack = synthetic_stack((n_frames,) + tuple(frame_shape), dtype, seed)
+    growing_file = path.lower().endswith(('.tif', '.tiff'))
+    if not growing_file:
+        os.makedirs(path, exist_ok=True)
+    for i, frame in enumerate(stack):
+        if growing_file:
+            tifffile.imwrite(path, frame, append=True)
+        else: # written in place (not renamed), the reader has to wait until the file is complete
+            tifffile.imwrite(os.path.join(path, 'frame_{:05d}.tif'.format(i)), frame)
+        time.sleep(interval)
+    return path
+
+
+def _roi_bytes(roi):
+    """Encode a rectangle/oval/polygon roi dict in the ImageJ .roi format (as read by read_roi)"""
+    types = {'polygon': 0, 'rectangle': 1, 'oval': 2, 'freehand': 7, 'traced': 8}
+    if roi['type'] in ('rectangle', 'oval'):
+        top, left = roi['top'], roi['left']
+        bottom, right = top + roi['height'], left + roi['width']
+        xs = ys = []
+    else:
+        xs, ys = list(roi['x']), list(roi['y'])
+        top, left, bottom, right = min(ys), min(xs), max(ys), max(xs)
+    header = bytearray(64)
+    header[0:4] = b'Iout'
+    struct.pack_into('>hBx', header, 4, 228, types[roi['type']])
+    struct.pack_into('>hhhhH', header, 8, top, left, bottom, right, len(xs))
+    coordinates = struct.pack('>{}h'.format(2 * len(xs)), *([x - left for x in xs] + [y - top for y in ys]))
+    # header 2: c/z/t position and name
+    position = roi.get('position', 0)
+    position = position if isinstance(position, dict) else {}
+    name = roi['name'].encode('utf-16-be')
+    header2_offset = 64 + len(coordinates)
+    struct.pack_into('>i', header, 60, header2_offset)
+    header2 = bytearray(64)
+    struct.pack_into('>iiiii', header2, 4, position.get('channel', 0), position.get('slice', 0),
+                     position.get('frame', 0), header2_offset + 64, len(name) // 2)
+    return bytes(header) + coordinates + bytes(header2) + name
+
+
+def write_roi_zip(path, rois):
+    """Write roi dicts (e.g. from synthetic_rois()) as an ImageJ ROI set (.zip)"""
+    with zipfile.ZipFile(path, 'w') as archive:
+        for roi in rois:
+            archive.writestr(roi['name'] + '.roi', _roi_bytes(roi))
+    return path
+
+
+#%%
+#### BENCHMARK SUITE
+
+def _git_commit():
+    import subprocess
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(function, repeat=3):
+    """
+    Time function (best of repeat runs) and then measure its peak traced memory in one extra run.
+    Debug output printed by the function is discarded.
+    RETURNS: (seconds, peak_mb)
+    """
+    best = np.inf
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak / 2 ** 20
+
+
+def _record(benchmark, params, seconds, peak_mb, frames=None, rois=None):
+    record = {'benchmark': benchmark, 'params': params, 'seconds': seconds, 'peak_mb': peak_mb}
+    if frames is not None:
+        record['frames_per_s'] = frames / seconds if seconds else None
+    if rois is not None:
+        record['rois_per_s'] = rois / seconds if seconds else None
+    return record
+
+
+def bench_roi_construction(n_rois, kinds=('rectangle', 'oval', 'polygon'), repeat=3):
+    """Build ROI objects from roi dicts (rasterization included, raster cache disabled)"""
+    import ROITools
+    rois = synthetic_rois(n_rois, CAMERA_FRAME, kinds)
+    seconds, peak = _measure(lambda: [ROITools.ROI(roi, cache=False) for roi in rois], repeat)
+    return _record('roi_construction', {'n_rois': n_rois, 'kinds': list(kinds)}, seconds, peak, rois=n_rois)
+
+
+def bench_create_mask(shape, dtype=np.uint16, lazy=False, repeat=3):
+    """ROI.create_mask() of one oval ROI on an nD image"""
+    import ROITools
+    image = synthetic_stack(shape, dtype)
+    with contextlib.redirect_stdout(io.StringIO()):
+        roi = ROITools.ROI(synthetic_rois(2, shape[-2:], ('oval',))[0], cache=False)
+    seconds, peak = _measure(lambda: roi.create_mask(image, lazy=lazy), repeat)
+    frames = int(np.prod(shape[:-2]))
+    return _record('create_mask', {'shape': list(shape), 'dtype': np.dtype(dtype).name, 'lazy': lazy},
+                   seconds, peak, frames=frames)
+
+
+def bench_measure_stack(shape, dtype=np.uint16, kind='polygon', measurements=('mean', 'median', 'std'), repeat=3):
+    """ROI.measure_stack() of one ROI over every frame of a 3D stack"""
+    import ROITools
+    image = synthetic_stack(shape, dtype)
+    with contextlib.redirect_stdout(io.StringIO()):
+        roi = ROITools.ROI(synthetic_rois(3, shape[-2:], (kind,))[0], cache=False)
+    seconds, peak = _measure(lambda: roi.measure_stack(image, measurements=measurements), repeat)
+    return _record('measure_stack', {'shape': list(shape), 'dtype': np.dtype(dtype).name, 'kind': kind,
+                                     'measurements': list(measurements)}, seconds, peak, frames=shape[0])
+
+
+def bench_measure_rois(shape, n_rois, dtype=np.uint16, repeat=3):
+    """ROI_Reader.measure_ROIs() of n_rois ROIs (read from a synthetic .zip) over every frame of a 3D stack"""
+    import ROITools
+    image = synthetic_stack(shape, dtype)
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_roi_zip(os.path.join(directory, 'RoiSet.zip'), synthetic_rois(n_rois, shape[-2:]))
+        reader = ROITools.ROI_Reader(path)
+        seconds, peak = _measure(lambda: reader.measure_ROIs(image), repeat)
+    return _record('measure_rois', {'shape': list(shape), 'dtype': np.dtype(dtype).name, 'n_rois': n_rois},
+                   seconds, peak, frames=shape[0], rois=n_rois)
+
+
+def bench_measure_tiled(plane_shape, n_rois, tile_size=2048, dtype=np.uint16, repeat=3):
+    """
+    ROI_Reader.measure_tiled() of n_rois ROIs on one large plane memory-mapped from an uncompressed .tif.
+    The peak memory should follow tile_size, not the plane size
+    """
+    import ROITools
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'plane.tif')
+        synthetic_stack(plane_shape, dtype, path=path)
+        reader = ROITools.ROI_Reader(write_roi_zip(os.path.join(directory, 'RoiSet.zip'), synthetic_rois(n_rois, plane_shape)),
+                                     image=path)
+        seconds, peak = _measure(lambda: reader.measure_tiled(tile_size=tile_size), repeat)
+        del reader # release the memmap before the directory is removed
+    return _record('measure_tiled', {'plane_shape': list(plane_shape), 'n_rois': n_rois, 'tile_size': tile_size,
+                                     'dtype': np.dtype(dtype).name}, seconds, peak, frames=1, rois=n_rois)
+
+
+def bench_open_roi_zip(n_rois, subset=100, lazy=True, repeat=3):
+    """
+    Open an ROI zip of n_rois ROIs and build the ROISet of subset of them (e.g. a filtered selection).
+    Lazily opened zips only decode the subset, so the time should follow subset rather than n_rois
+    """
+    import ROITools
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_roi_zip(os.path.join(directory, 'RoiSet.zip'), synthetic_rois(n_rois, n_vertices=50))
+        
+        def open_subset():
+            reader = ROITools.ROI_Reader(path, lazy=lazy)
+            reader.get_ROISet(reader.keys[::max(n_rois // subset, 1)])
+            if lazy:
+                reader.rois.close()
+        seconds, peak = _measure(open_subset, repeat)
+    return _record('open_roi_zip', {'n_rois': n_rois, 'subset': subset, 'lazy': lazy}, seconds, peak, rois=subset)
+
+
+def bench_pyramid_level(shape, n_rois, level=2, dtype=np.uint16, repeat=3):
+    """
+    ROI_Reader.measure_ROIs() at one ImagePyramid level of a memory-mapped .tif stack, for comparison with
+    bench_measure_rois()/level 0. The level is built (in the
+    pyramid's temporary store, the default) before timing, so only reading it and measuring are timed
+    """
+    import ROITools
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'stack.tif')
+        synthetic_stack(shape, dtype, path=path)
+        reader = ROITools.ROI_Reader(write_roi_zip(os.path.join(directory, 'RoiSet.zip'), synthetic_rois(n_rois, shape[-2:])),
+                                     image=path)
+        pyramid = reader.pyramid()
+        pyramid[level]
+        seconds, peak = _measure(lambda: reader.measure_ROIs(pyramid, level=level), repeat)
+        del reader, pyramid # release the memmaps before the directory is removed
+    return _record('pyramid_level', {'shape': list(shape), 'n_rois': n_rois, 'level': level,
+                                     'dtype': np.dtype(dtype).name}, seconds, peak, frames=shape[0], rois=n_rois)
+
+
+def bench_result_cache(shape, n_rois, edited=10, dtype=np.uint16, repeat=3):
+    """
+    Re-run of ROI_Reader.measure_ROIs() through a ResultCache after editing `edited` of n_rois ROIs
+    (each run moves them again). Only the edited ROIs are measured; compare with bench_measure_rois()
+    """
+    import itertools
+    import ROITools
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'stack.tif')
+        synthetic_stack(shape, dtype, path=path)
+        rois = synthetic_rois(n_rois, shape[-2:], kinds=('rectangle',))
+        reader = ROITools.ROI_Reader(write_roi_zip(os.path.join(directory, 'RoiSet.zip'), rois), image=path)
+        cache = ROITools.ResultCache(os.path.join(directory, 'cache'))
+        reader.measure_ROIs(result_cache=cache)
+        runs = itertools.count(1)
+        
+        def rerun():
+            shift = next(runs)
+            for name in reader.keys[:edited]:
+                reader.rois[name]['top'] = rois[0]['top'] + shift % 7 # decoded dicts are kept, so edits stick
+            reader.measure_ROIs(result_cache=cache)
+        seconds, peak = _measure(rerun, repeat)
+        del reader # release the memmap before the directory is removed
+    return _record('result_cache', {'shape': list(shape), 'n_rois': n_rois, 'edited': edited,
+                                    'dtype': np.dtype(dtype).name}, seconds, peak, frames=shape[0], rois=n_rois)
+
+
+def bench_reader_throughput(shape, dtype=np.uint16, workers=2, depth=4, repeat=3):
+    """Read every frame of a .tif stack through PIMS wrapped in a prefetching FrameSource"""
+    import pims
+    import ROITools
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'stack.tif')
+        synthetic_stack(shape, dtype, path=path)
+
+        def read():
+            reader = pims.open(path)
+            for frame in ROITools.FrameSource(reader, workers=workers, depth=depth):
+                pass
+            reader.close()
+        seconds, peak = _measure(read, repeat)
+    return _record('reader_throughput', {'shape': list(shape), 'dtype': np.dtype(dtype).name,
+                                         'workers': workers, 'depth': depth}, seconds, peak, frames=shape[0])
+
+
+def bench_live_update(n_frames, n_rois=100, frame_shape=SMALL_FRAME, repeat=3):
+    """
+    LiveMeasurement.update() for one new frame after n_frames frames were already measured.
+    The time should not depend on n_frames
+    """
+    import tifffile
+    import ROITools
+    
+    stack = synthetic_stack((n_frames + repeat + 1,) + tuple(frame_shape))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'live.tif')
+        with tifffile.TiffWriter(path) as writer:
+            for frame in stack[:n_frames]:
+                writer.write(frame, contiguous=False)
+        live = ROITools.LiveMeasurement(synthetic_rois(n_rois, frame_shape), path)
+        live.update() # catch up with the frames already written
+        best = np.inf
+        for frame in stack[n_frames:n_frames + repeat]:
+            tifffile.imwrite(path, frame, append=True)
+            start = time.perf_counter()
+            live.update()
+            best = min(best, time.perf_counter() - start)
+        tifffile.imwrite(path, stack[-1], append=True)
+        tracemalloc.start()
+        try:
+            live.update()
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return _record('live_update', {'n_frames': n_frames, 'n_rois': n_rois, 'frame_shape': list(frame_shape)},
+                   best, peak, frames=1)
+
+
+_COLD_START = """
+import sys, time
+start = time.perf_counter()
+{}
+seconds = time.perf_counter() - start
+try:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10 # kB on Linux
+except ImportError:
+    peak = float('nan')
+heavy = [name for name in ('pims', 'matplotlib', 'skimage', 'scipy', 'pandas', 'tkinter') if name in sys.modules]
+print({{'seconds': seconds, 'peak_mb': peak, 'heavy': heavy}}, file=sys.stderr)
+"""
+
+
+def bench_cold_start(command='import', n_rois=100, shape=(10,) + SMALL_FRAME, repeat=3):
+    """
+    Start-up cost of a fresh interpreter, as paid by every batch worker and CLI job.
+        'import': import ROITools
+        'measure': ROI_CLI measure of n_rois ROIs on a small .tif, csv to a file (import + open + measure + write)
+    seconds is the wall time of the whole process (best of repeat), peak_mb its maximum resident memory.
+    The record also lists the heavy modules (pims, matplotlib, ...) that ended up imported
+    """
+    import ast
+    import subprocess
+    import sys
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (here, os.environ.get('PYTHONPATH')))))
+    with tempfile.TemporaryDirectory() as directory:
+        if command == 'import':
+            code = 'import ROITools'
+        else:
+            path = os.path.join(directory, 'stack.tif')
+            synthetic_stack(shape, path=path)
+            zip_path = write_roi_zip(os.path.join(directory, 'RoiSet.zip'), synthetic_rois(n_rois, shape[-2:]))
+            code = 'import ROI_CLI; ROI_CLI.main({!r})'.format(['measure', path, zip_path, '--position', 'none',
+                                                              '-o', os.path.join(directory, 'out.csv'), '--overwrite'])
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            child = subprocess.run([sys.executable, '-c', _COLD_START.format(code)], capture_output=True, text=True,
+                                   env=env, check=True)
+            best = min(best, time.perf_counter() - start)
+    child = ast.literal_eval(child.stderr.strip().splitlines()[-1])
+    record = _record('cold_start', {'command': command, 'n_rois': n_rois if command != 'import' else 0}, best,
+                     child['peak_mb'], rois=n_rois if command != 'import' else None)
+    record['heavy_modules'] = child['heavy']
+    return record
+
+
+SUITES = {
+    'quick': [
+        (bench_cold_start, dict(command='import')),
+        (bench_cold_start, dict(command='measure')),
+        (bench_roi_construction, dict(n_rois=1)),
+        (bench_roi_construction, dict(n_rois=1000)),
+        (bench_create_mask, dict(shape=(4, 2) + SMALL_FRAME)),
+        (bench_create_mask, dict(shape=(4, 2) + SMALL_FRAME, lazy=True)),
+        (bench_measure_stack, dict(shape=(200,) + SMALL_FRAME, dtype=np.uint8)),
+        (bench_measure_stack, dict(shape=(200,) + SMALL_FRAME, dtype=np.float32)),
+        (bench_measure_stack, dict(shape=(200,) + SMALL_FRAME, dtype=np.uint8, measurements=('10-quantiles',))),
+        (bench_measure_rois, dict(shape=(50,) + SMALL_FRAME, n_rois=100)),
+        (bench_measure_tiled, dict(plane_shape=(4096, 4096), n_rois=200, tile_size=1024)),
+        (bench_pyramid_level, dict(shape=(8, 2048, 2048), n_rois=200, level=0)),
+        (bench_pyramid_level, dict(shape=(8, 2048, 2048), n_rois=200, level=2)),
+        (bench_result_cache, dict(shape=(50,) + SMALL_FRAME, n_rois=100)),
+        (bench_open_roi_zip, dict(n_rois=10000)),
+        (bench_open_roi_zip, dict(n_rois=10000, lazy=False)),
+        (bench_reader_throughput, dict(shape=(100,) + SMALL_FRAME)),
+        (bench_live_update, dict(n_frames=10)),
+    ],
+    'full': [
+        (bench_cold_start, dict(command='import')),
+        (bench_cold_start, dict(command='measure')),
+        (bench_cold_start, dict(command='measure', n_rois=10000, shape=(10, 2048, 2048))),
+        (bench_roi_construction, dict(n_rois=1)),
+        (bench_roi_construction, dict(n_rois=100)),
+        (bench_roi_construction, dict(n_rois=10000)),
+        (bench_create_mask, dict(shape=SMALL_FRAME)),
+        (bench_create_mask, dict(shape=(10,) + CAMERA_FRAME)),
+        (bench_create_mask, dict(shape=(3, 10) + SMALL_FRAME, dtype=np.uint8)),
+        (bench_create_mask, dict(shape=(2, 3, 5) + SMALL_FRAME, dtype=np.float32)),
+        (bench_create_mask, dict(shape=(2, 3, 5) + SMALL_FRAME, dtype=np.float32, lazy=True)),
+        (bench_measure_stack, dict(shape=(2000,) + SMALL_FRAME)),
+        (bench_measure_stack, dict(shape=(20,) + CAMERA_FRAME, kind='rectangle')),
+        (bench_measure_stack, dict(shape=(20,) + CAMERA_FRAME, dtype=np.float32, kind='oval')),
+        (bench_measure_stack, dict(shape=(2000,) + SMALL_FRAME, measurements=('median',))),
+        (bench_measure_stack, dict(shape=(2000,) + SMALL_FRAME, measurements=('10-quantiles',))),
+        (bench_measure_rois, dict(shape=(100,) + SMALL_FRAME, n_rois=1)),
+        (bench_measure_rois, dict(shape=(100,) + SMALL_FRAME, n_rois=1000)),
+        (bench_measure_rois, dict(shape=(20,) + CAMERA_FRAME, n_rois=10000)),
+        (bench_measure_tiled, dict(plane_shape=(8192, 8192), n_rois=5000, tile_size=4096)),
+        (bench_measure_tiled, dict(plane_shape=(8192, 8192), n_rois=5000, tile_size=1024)),
+        (bench_pyramid_level, dict(shape=(16, 4096, 4096), n_rois=500, level=0)),
+        (bench_pyramid_level, dict(shape=(16, 4096, 4096), n_rois=500, level=2)),
+        (bench_pyramid_level, dict(shape=(16, 4096, 4096), n_rois=500, level=3)),
+        (bench_result_cache, dict(shape=(100,) + SMALL_FRAME, n_rois=1000)),
+        (bench_result_cache, dict(shape=(20,) + CAMERA_FRAME, n_rois=10000, edited=100)),
+        (bench_open_roi_zip, dict(n_rois=100000)),
+        (bench_open_roi_zip, dict(n_rois=100000, lazy=False)),
+        (bench_open_roi_zip, dict(n_rois=100000, subset=100000)),
+        (bench_reader_throughput, dict(shape=(500,) + SMALL_FRAME, dtype=np.uint8)),
+        (bench_reader_throughput, dict(shape=(20,) + CAMERA_FRAME, workers=1, depth=1)),
+        (bench_reader_throughput, dict(shape=(20,) + CAMERA_FRAME, workers=4, depth=8)),
+        (bench_live_update, dict(n_frames=10)),
+        (bench_live_update, dict(n_frames=5000)),
+    ],
+}
+
+
+def run(suite='quick', out=None, repeat=3):
+    """
+    Run a benchmark suite ('quick' or 'full').
+    RETURNS: dict with 'commit', 'python', 'numpy', 'timestamp' and the list of 'results'. Written as JSON to out if given
+    """
+    import platform
+
+    results = []
+    for function, params in SUITES[suite]:
+        record = function(repeat=repeat, **params)
+        results.append(record)
+        print("{:<20} {:<60} {:>9.4f} s {:>9.1f} MB".format(record['benchmark'], json.dumps(record['params']),
+                                                           record['seconds'], record['peak_mb']))
+    report = {'suite': suite, 'commit': _git_commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def compare(old, new):
+    """
+    Compare two benchmark result files (or dicts from run()) benchmark by benchmark.
+    RETURNS: list of dicts with the time and peak memory ratio new/old (< 1 is faster/smaller)
+    """
+    reports = []
+    for report in (old, new):
+        if isinstance(report, str):
+            with open(report) as f:
+                report = json.load(f)
+        reports.append({(r['benchmark'], json.dumps(r['params'], sort_keys=True)): r for r in report['results']})
+    rows = []
+    for key in reports[1]:
+        if key in reports[0]:
+            before, after = reports[0][key], reports[1][key]
+            rows.append({'benchmark': key[0], 'params': json.loads(key[1]),
+                         'time_ratio': after['seconds'] / before['seconds'] if before['seconds'] else None,
+                         'memory_ratio': after['peak_mb'] / before['peak_mb'] if before['peak_mb'] else None})
+    return rows
+
+
+def format_comparison(row):
+    """One line of compare() output. Ratios are None when the old run took no measurable time/memory: 'n/a'"""
+    ratios = ['n/a' if row[k] is None else 'x{:.2f}'.format(row[k]) for k in ('time_ratio', 'memory_ratio')]
+    return "{:<20} {:<60} time {} memory {}".format(row['benchmark'], json.dumps(row['params']), *ratios)
+
+
+#%%
+#### RASTERIZATION
+
+def _skimage_pixels(roi):
+    """
+    Reference rasterization with skimage.draw. skimage tests integer points, ROITools tests pixel centers
+    like ImageJ, so polygons are shifted by half a pixel to compare the same points
+    """
+    from skimage.draw import polygon, ellipse
+
+    if roi['type'] == 'rectangle':
+        rr, cc = np.mgrid[roi['top']:roi['top'] + roi['height'], roi['left']:roi['left'] + roi['width']]
+        return rr.ravel(), cc.ravel()
+    if roi['type'] == 'oval':
+        r_radius, c_radius = roi['height'] / 2, roi['width'] / 2
+        return ellipse(roi['top'] + r_radius, roi['left'] + c_radius, r_radius, c_radius)
+    return polygon(np.asarray(roi['y']) - 0.5, np.asarray(roi['x']) - 0.5)
+
+
+def compare_rasterizers(n_rois=1000, n_vertices=2000, shape=(2048, 2048), seed=0):
+    """
+    Rasterize the same synthetic ROIs with ROITools.rasterize_rois() (one batch call) and with skimage.draw
+    (one call per ROI) and compare pixel sets and timings.
+    RETURNS: dict with timings (s), speedup and, per ROI kind, the number of ROIs whose pixel sets differ.
+        'missing_pixels' and 'extra_pixels' count disagreeing pixels away from the outline (should be 0);
+        'outline_pixels' are pixels whose center lies exactly on the outline, which skimage.draw.polygon
+        includes and the even-odd rule may not
+    """
+    import ROITools
+
+    rois = synthetic_rois(n_rois, shape, n_vertices=n_vertices, seed=seed)
+
+    start = time.perf_counter()
+    rasters = ROITools.rasterize_rois(rois)
+    t_engine = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = [_skimage_pixels(roi) for roi in rois]
+    t_skimage = time.perf_counter() - start
+
+    report = {'n_rois': n_rois, 'n_vertices': n_vertices, 'rasterize_rois_s': t_engine, 'skimage_s': t_skimage,
+              'speedup': t_skimage / t_engine if t_engine else None, 'kinds': {}}
+    for roi, (bbox, mask), (rr, cc) in zip(rois, rasters, reference):
+        rows, cols = np.nonzero(mask)
+        mine = set(zip((rows + bbox[0]).tolist(), (cols + bbox[1]).tolist()))
+        theirs = set(zip(np.asarray(rr).tolist(), np.asarray(cc).tolist()))
+        difference = mine ^ theirs
+        outline = _on_outline(roi, difference) if roi['type'] == 'polygon' else set()
+        kind = report['kinds'].setdefault(roi['type'], {'rois': 0, 'pixels': 0, 'mismatched_rois': 0,
+                                                        'missing_pixels': 0, 'extra_pixels': 0, 'outline_pixels': 0})
+        kind['rois'] += 1
+        kind['pixels'] += len(theirs)
+        kind['mismatched_rois'] += bool(difference - outline)
+        kind['missing_pixels'] += len(theirs - mine - outline)
+        kind['extra_pixels'] += len(mine - theirs - outline)
+        kind['outline_pixels'] += len(outline)
+    report['mismatched_rois'] = sum(k['mismatched_rois'] for k in report['kinds'].values())
+    return report
+
+
+def _on_outline(roi, pixels, tolerance=1e-9):
+    """Subset of pixels (set of (r, c)) whose centers lie on the polygon outline"""
+    if not pixels:
+        return set()
+    points = np.array(sorted(pixels), dtype=np.float64) + 0.5 # pixel centers (r, c)
+    x0, y0 = np.asarray(roi['x'], dtype=np.float64), np.asarray(roi['y'], dtype=np.float64)
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    # distance of every point to every edge
+    dx, dy = (x1 - x0)[None, :], (y1 - y0)[None, :]
+    px, py = points[:, 1:2] - x0[None, :], points[:, 0:1] - y0[None, :]
+    t = np.clip((px * dx + py * dy) / np.maximum(dx ** 2 + dy ** 2, tolerance), 0, 1)
+    distance = np.hypot(px - t * dx, py - t * dy).min(axis=1)
+    return {pixel for pixel, d in zip(sorted(pixels), distance) if d < tolerance}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ROITools benchmarks")
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help="run a benchmark suite")
+    run_parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('-o', '--out', help="write results as JSON")
+    compare_parser = commands.add_parser('compare', help="compare two result files")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    commands.add_parser('raster', help="compare rasterize_rois() with skimage.draw")
+    acquire_parser = commands.add_parser('acquire', help="simulate an acquisition (growing .tif or frame directory)")
+    acquire_parser.add_argument('path')
+    acquire_parser.add_argument('--frames', type=int, default=100)
+    acquire_parser.add_argument('--interval', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        for row in compare(args.old, args.new):
+            print(format_comparison(row))
+    elif args.command == 'raster':
+        print(json.dumps(compare_rasterizers(), indent=2))
+    elif args.command == 'acquire':
+        simulate_acquisition(args.path, args.frames, interval=args.interval)
+    else:
+        run(getattr(args, 'suite', 'quick'), getattr(args, 'out', None), getattr(args, 'repeat', 3))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface for ROITools measurements
+
+Headless and quick to start: only ROITools (numpy) is imported up front, pandas, tifffile and pims are
+imported by the code paths that use them, so thousands of short cluster/batch jobs do not pay for plotting
+or GUI modules. There is no package metadata in this repository; install it as a `roitools` console
+script pointing at ROI_CLI:main, or run the file directly.
+
+Commands:
+    measure: measure the ROIs of an ImageJ ROI set (.zip/.roi) on an image
+        - all ROIs in one pass (ROI_Reader.measure_ROIs), default
+        - --per-roi: one ROI at a time (ROI.measure_stack), reads only each ROI's bounding box
+        - --tile-size: tile by tile for planes too large for memory (ROI_Reader.measure_tiled)
+        - --level: quick approximate pass on an ImagePyramid level, --cache: reuse a ResultCache
+        Rows are streamed to .parquet/.h5/.csv with ROITools.ResultsWriter, or printed as .csv
+    info: names and types of the ROIs (read from the zip headers only) and the image layout
+
+Examples:
+    python ROI_CLI.py measure cell.nd2 RoiSet.zip -o results.parquet --axis t -m mean,median,95-percentile
+    python ROI_CLI.py measure stack.tif RoiSet.zip --names '^cell' --level 2 > preview.csv
+    python ROI_CLI.py info RoiSet.zip stack.tif
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+from contextlib import nullcontext
+
+import ROITools
+
+logger = logging.getLogger('ROITools.cli')
+
+
+def parse_axis(text):
+    """'0' -> 0 (ndarray axis number), 't' -> 't' (named axis)"""
+    text = text.strip()
+    return int(text) if text.lstrip('-').isdigit() else text
+
+
+def parse_position(text):
+    """'z'/'t'/'c' -> that position, 'none' -> False (measure every ROI on every frame), 'auto' -> None"""
+    text = text.lower()
+    if text == 'auto':
+        return None
+    if text == 'none':
+        return False
+    if text not in ('z', 't', 'c'):
+        raise ValueError("position must be z, t, c, none or auto, got '{}'".format(text))
+    return text
+
+
+def select_names(reader, patterns=None, names=None):
+    """ROI names matching any of the regular expressions in patterns or listed in names (all if neither is given)"""
+    if not patterns and not names:
+        return None
+    wanted = set(names or ())
+    return [k for k in reader.keys if k in wanted or any(re.search(p, k) for p in patterns or ())]
+
+
+def measure(image_path, roi_path, output=None, measurements=('mean', 'median', 'std'), axis=0, bundle_axes='yx',
+            patterns=None, names=None, position=None, chunk_size=32, level=0, tile_size=None, per_roi=False,
+            cache_dir=None, overwrite=False, label=None):
+    """
+    Measure the ROIs of roi_path on image_path and write the rows to output (.parquet, .h5, .csv) or stdout.
+    Rows have the ResultsWriter columns: image, name, c, z, t and one column per statistic.
+    RETURNS: number of rows written
+    """
+    label = label or os.path.splitext(os.path.basename(image_path))[0]
+    reader = ROITools.ROI_Reader(roi_path, image=image_path)
+    selected = select_names(reader, patterns, names)
+    if selected is not None and not selected:
+        raise ValueError("no ROI of '{}' matches the given names".format(roi_path))
+    kwargs = dict(measurements=measurements, axis=axis, bundle_axes=bundle_axes, position=position)
+
+    def run(sink):
+        if tile_size:
+            reader.measure_tiled(tile_size=tile_size, names=selected, sink=sink, **kwargs)
+        elif per_roi:
+            cache = ROITools.ResultCache(cache_dir) if cache_dir else None
+            for name in (reader.keys if selected is None else selected):
+                roi = ROITools.ROI(reader.rois[name], cache=reader.cache)
+                roi.measure_stack(reader.image, sink=sink, level=level, result_cache=cache, **kwargs)
+        else:
+            cache = ROITools.ResultCache(cache_dir) if cache_dir else None
+            reader.measure_ROIs(chunk_size=chunk_size, names=selected, sink=sink, level=level, result_cache=cache,
+                                **kwargs)
+
+    if output in (None, '-'):
+        sink = _StdoutSink(label)
+        run(sink)
+        return sink.rows
+    with ROITools.ResultsWriter(output, image=label, append=not overwrite) as sink:
+        run(sink)
+    return len(sink)
+
+
+class _StdoutSink:
+    """Minimal ResultsWriter stand-in printing rows as .csv (header once)"""
+
+    def __init__(self, image):
+        self.image = image
+        self.rows = 0
+
+    def write(self, table, image=None, name=None, axis='z'):
+        rows = ROITools._results_rows(table, self.image if image is None else image, name, axis)
+        rows.to_csv(sys.stdout, index=False, header=self.rows == 0)
+        self.rows += len(rows)
+        return
+
+
+def info(roi_path, image_path=None):
+    """Print the ROIs of roi_path (name and type, without decoding the coordinates) and the image layout"""
+    reader = ROITools.ROI_Reader(roi_path)
+    types = reader.types()
+    counts = {}
+    for kind in types.values():
+        counts[kind] = counts.get(kind, 0) + 1
+    print("{}: {} ROIs ({})".format(reader.path, len(reader.keys),
+                                    ', '.join('{} {}'.format(n, kind) for kind, n in sorted(counts.items()))))
+    for name, kind in types.items():
+        print("  {:<40} {}".format(name, kind))
+    if image_path is not None:
+        image = ROITools.open_image(image_path)
+        if hasattr(image, 'frame_shape'):
+            print("{}: {} frames of {} ({}), axes {}".format(image_path, len(image), tuple(image.frame_shape),
+                                                              type(image).__name__, getattr(image, 'sizes', '')))
+        else:
+            print("{}: {} {}, axes '{}' (memory-mapped)".format(image_path, image.shape, image.dtype, image.axes))
+    return
+
+
+def main(argv=None):
+    """Entry point. RETURNS: exit status"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='roitools', description="Headless ROITools measurements")
+    parser.add_argument('-v', '--verbose', action='store_true', help="debug output")
+    commands = parser.add_subparsers(dest='command')
+    measure_parser = commands.add_parser('measure', help="measure ROIs on an image")
+    measure_parser.add_argument('image')
+    measure_parser.add_argument('rois', help="ImageJ ROI set (.zip) or single ROI (.roi)")
+    measure_parser.add_argument('-o', '--output', help=".parquet (dataset directory), .h5 or .csv. Default: .csv on stdout")
+    measure_parser.add_argument('-m', '--measurements', default='mean,median,std',
+                                help="comma separated, e.g. mean,sum,95-percentile,10-quantiles")
+    measure_parser.add_argument('--axis', default='0', help="axis to iterate over: number, or z/t/c for named axes")
+    measure_parser.add_argument('--bundle-axes', default='yx', help="axes of each measured plane, e.g. cyx")
+    measure_parser.add_argument('--names', action='append', help="regular expression of ROI names (repeatable)")
+    measure_parser.add_argument('--roi', action='append', help="exact ROI name (repeatable)")
+    measure_parser.add_argument('--position', default='auto', help="ROI position used to pick planes: z, t, c, none")
+    measure_parser.add_argument('--chunk-size', type=int, default=32)
+    measure_parser.add_argument('--level', type=int, default=0, help="image pyramid level for a quick approximate pass")
+    measure_parser.add_argument('--tile-size', type=int, help="measure tile by tile (very large planes)")
+    measure_parser.add_argument('--per-roi', action='store_true', help="measure one ROI at a time")
+    measure_parser.add_argument('--cache', help="ResultCache directory, reused by later runs")
+    measure_parser.add_argument('--overwrite', action='store_true', help="replace the output instead of appending")
+    measure_parser.add_argument('--label', help="value of the image column (default: image file name)")
+    measure_parser.add_argument('--timing', action='store_true', help="print the time spent per stage")
+    info_parser = commands.add_parser('info', help="list the ROIs of a set and the image layout")
+    info_parser.add_argument('rois')
+    info_parser.add_argument('image', nargs='?')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format='%(name)s: %(message)s')
+    if args.command is None:
+        parser.print_help()
+        return 2
+    if args.command == 'measure' and args.tile_size and (args.level or args.cache or args.per_roi):
+        parser.error("--tile-size can not be combined with --level, --cache or --per-roi")
+
+    try:
+        if args.command == 'info':
+            info(args.rois, args.image)
+            return 0
+        start = time.perf_counter()
+        with ROITools.INSTRUMENTATION.run() if args.timing else nullcontext() as run:
+            rows = measure(args.image, args.rois, args.output, tuple(m.strip() for m in args.measurements.split(',')),
+                           parse_axis(args.axis), args.bundle_axes, args.names, args.roi, parse_position(args.position),
+                           args.chunk_size, args.level, args.tile_size, args.per_roi, args.cache, args.overwrite,
+                           args.label)
+        print("{} rows written to {} in {:.2f} s".format(rows, args.output or 'stdout', time.perf_counter() - start),
+              file=sys.stderr)
+        if args.timing:
+            for name, stage in run.report['stages'].items():
+                print("  {:<12} {:9.4f} s {:7d} calls".format(name, stage['seconds'], stage['calls']), file=sys.stderr)
+    except (OSError, ValueError, KeyError, ImportError) as error:
+        print("roitools: error: {}".format(error), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Colocalization for ROITools
+
+Per ROI, per frame colocalization of a channel pair:
+    - Pearson and Spearman correlation
+    - Manders M1/M2 (with fixed thresholds, and with the Costes thresholds)
+    - Costes automatic threshold
+
+The image is streamed one frame at a time (ndarray, memmap or PIMS object), so z/t stacks are never loaded
+as a whole. The Costes threshold search uses a joint histogram of the two channels: moments of every
+histogram cell are accumulated once, 2D prefix sums give the moments of "below both thresholds" for every
+candidate threshold, and Pearson is evaluated for all candidates at once instead of being recomputed
+from the pixels at each step.
+
+Example:
+    reader = ROITools.ROI_Reader('RoiSet.zip', image='cell.nd2')
+    results = colocalize(reader, channels=(0, 1), axis='z', bundle_axes='cyx')
+"""
+
+import numpy as np
+
+import ROITools
+
+METRICS = ('pearson', 'spearman', 'm1', 'm2', 'costes')
+
+
+def pearson(a, b):
+    """Pearson correlation of two 1D arrays. nan if either is constant or empty"""
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    if a.size < 2:
+        return np.nan
+    da, db = a - a.mean(), b - b.mean()
+    denominator = np.sqrt((da * da).sum() * (db * db).sum())
+    return (da * db).sum() / denominator if denominator > 0 else np.nan
+
+
+def spearman(a, b):
+    """Spearman rank correlation (Pearson of average ranks)"""
+    from scipy.stats import rankdata
+    return pearson(rankdata(a), rankdata(b))
+
+
+def manders(a, b, threshold_a=0, threshold_b=0):
+    """
+    Manders coefficients.
+    M1: fraction of channel a intensity (above threshold_a) in pixels where b is above threshold_b
+    M2: fraction of channel b intensity (above threshold_b) in pixels where a is above threshold_a
+    RETURNS: (M1, M2)
+    """
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    above_a, above_b = a > threshold_a, b > threshold_b
+    total_a, total_b = a[above_a].sum(), b[above_b].sum()
+    m1 = a[above_a & above_b].sum() / total_a if total_a > 0 else np.nan
+    m2 = b[above_a & above_b].sum() / total_b if total_b > 0 else np.nan
+    return m1, m2
+
+
+def _bin(values, bins):
+    """
+    Bin values for the joint histogram. Integer data whose range fits in bins is binned exactly (one bin
+    per grey level), everything else is split into bins equal-width bins.
+    RETURNS: (bin index per value, lower edge of each bin, number of bins)
+    """
+    low, high = values.min(), values.max()
+    if values.dtype.kind in 'iu' and high - low < bins:
+        n_bins = int(high - low) + 1
+        return (values - low).astype(np.intp), low + np.arange(n_bins, dtype=np.float64), n_bins
+    width = (float(high) - float(low)) / bins or 1.0
+    index = np.minimum(((values - low) / width).astype(np.intp), bins - 1)
+    return index, low + width * np.arange(bins), bins
+
+
+def costes_threshold(a, b, bins=256):
+    """
+    Costes automatic threshold.
+    Fits b = slope * a + intercept by orthogonal regression, then finds the highest threshold T on a
+    (with T_b = slope * T + intercept on b) for which the Pearson correlation of the pixels below both
+    thresholds is <= 0.
+
+    All candidate thresholds are evaluated together from a joint histogram: the count and the sums of a, b,
+    a^2, b^2 and ab of every (a-bin, b-bin) cell are accumulated once with bincount, and 2D prefix sums
+    give those moments for "a below bin i and b below bin j" in O(1) per candidate.
+    Candidates T are the lower edges of the a bins (every grey level for integer images with fewer than bins
+    levels). The b bins are cut at the candidate T_b, so for every candidate the pixels below both thresholds
+    are exactly those a brute-force search would select.
+
+    INPUTS: a, b: pixel values of the two channels; bins: maximum number of histogram bins per channel
+    RETURNS: (threshold_a, threshold_b, slope, intercept). Thresholds are nan if the regression is undefined
+    """
+    a = np.asarray(a).ravel()
+    b = np.asarray(b).ravel()
+    af, bf = a.astype(np.float64), b.astype(np.float64)
+    n = af.size
+    if n < 3:
+        return np.nan, np.nan, np.nan, np.nan
+
+    # orthogonal regression from the moments
+    mean_a, mean_b = af.mean(), bf.mean()
+    var_a, var_b = af.var(), bf.var()
+    cov = ((af - mean_a) * (bf - mean_b)).mean()
+    if cov == 0:
+        return np.nan, np.nan, np.nan, np.nan
+    slope = (var_b - var_a + np.sqrt((var_b - var_a) ** 2 + 4 * cov ** 2)) / (2 * cov)
+    intercept = mean_b - slope * mean_a
+
+    # candidate thresholds: lower edges of the a bins. "below T" = bins strictly below the candidate bin
+    index_a, edges_a, bins_a = _bin(a, bins)
+    candidates = np.arange(1, bins_a)
+    thresholds_a = edges_a[candidates]
+    thresholds_b = slope * thresholds_a + intercept
+    # b is binned on the candidate T_b themselves: b < T_b exactly when its bin is <= the number of
+    # candidate T_b below T_b, so no bin straddles a threshold
+    sorted_b = np.sort(thresholds_b)
+    index_b = np.searchsorted(sorted_b, bf, side='right')
+    bins_b = candidates.size + 1
+
+    # joint histogram of moments, one flat bincount per moment
+    cell = index_a * bins_b + index_b
+    size = bins_a * bins_b
+    moments = [np.bincount(cell, weights=w, minlength=size).reshape(bins_a, bins_b)
+               for w in (None, af, bf, af * af, bf * bf, af * bf)]
+    # prefix sums: moments of pixels with a-bin <= i and b-bin <= j
+    moments = [m.cumsum(axis=0).cumsum(axis=1) for m in moments]
+    i, j = candidates - 1, np.searchsorted(sorted_b, thresholds_b, side='left')
+
+    count, sa, sb, saa, sbb, sab = (m[i, j] for m in moments)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = sab - sa * sb / count
+        denominator = np.sqrt((saa - sa * sa / count) * (sbb - sb * sb / count))
+        r = covariance / denominator
+    r = np.where(count >= 3, r, np.nan)
+
+    # walking down from the highest threshold, stop at the first one where r <= 0
+    hits = np.nonzero(r <= 0)[0]
+    if hits.size == 0:
+        return float(edges_a[0]), float(slope * edges_a[0] + intercept), slope, intercept
+    threshold_a = thresholds_a[hits[-1]]
+    return float(threshold_a), float(slope * threshold_a + intercept), slope, intercept
+
+
+def measure_pair(a, b, metrics=METRICS, thresholds=(0, 0), bins=256):
+    """
+    Colocalization metrics of two channels of one ROI.
+    INPUTS:
+        a, b: 1D pixel values of the two channels
+        metrics: any of 'pearson', 'spearman', 'm1', 'm2', 'costes'
+        thresholds: (threshold_a, threshold_b) for Manders M1/M2
+        bins: histogram bins per channel for the Costes threshold
+    RETURNS: dict of results. 'costes' adds the Costes thresholds and Manders coefficients above them
+    """
+    results = {'n_pixels': len(a)}
+    if 'pearson' in metrics:
+        results['pearson'] = pearson(a, b)
+    if 'spearman' in metrics:
+        results['spearman'] = spearman(a, b) if len(a) > 1 else np.nan
+    if 'm1' in metrics or 'm2' in metrics:
+        m1, m2 = manders(a, b, *thresholds)
+        if 'm1' in metrics:
+            results['m1'] = m1
+        if 'm2' in metrics:
+            results['m2'] = m2
+    if 'costes' in metrics:
+        threshold_a, threshold_b, slope, intercept = costes_threshold(a, b, bins)
+        results.update(costes_threshold_a=threshold_a, costes_threshold_b=threshold_b,
+                       costes_slope=slope, costes_intercept=intercept)
+        if np.isnan(threshold_a):
+            results.update(costes_m1=np.nan, costes_m2=np.nan)
+        else:
+            results['costes_m1'], results['costes_m2'] = manders(a, b, threshold_a, threshold_b)
+    return results
+
+
+def _segment_pairs(a, b, offsets, metrics=METRICS, thresholds=(0, 0), bins=256):
+    """
+    measure_pair() for every ROI of a frame at once. a and b hold the pixels of all ROIs as segments
+    delimited by offsets (see ROITools._roi_index). Pearson and Manders are computed for all ROIs with
+    labeled (reduceat) sums, like ROITools._summarize_segments(); Spearman and the Costes threshold need
+    the pixels of each ROI and are computed ROI by ROI.
+    RETURNS: dict of result name -> array with one value per ROI
+    """
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    counts = np.diff(offsets)
+    filled = np.nonzero(counts)[0] # reduceat cannot express empty segments
+    starts, n = offsets[:-1][filled], counts[filled]
+
+    def per_roi(reduced):
+        out = np.full(len(counts), np.nan)
+        out[filled] = reduced
+        return out
+
+    def sums(values):
+        return np.add.reduceat(values, starts) if filled.size else np.zeros(0)
+
+    def manders_all(threshold_a, threshold_b):
+        # thresholds: scalars or one value per ROI
+        above_a = a > np.repeat(np.broadcast_to(threshold_a, counts.shape)[filled], n)
+        above_b = b > np.repeat(np.broadcast_to(threshold_b, counts.shape)[filled], n)
+        total_a, total_b = sums(a * above_a), sums(b * above_b)
+        both = above_a & above_b
+        with np.errstate(invalid='ignore', divide='ignore'):
+            m1 = np.where(total_a > 0, sums(a * both) / total_a, np.nan)
+            m2 = np.where(total_b > 0, sums(b * both) / total_b, np.nan)
+        return per_roi(m1), per_roi(m2)
+
+    results = {'n_pixels': counts}
+    if 'pearson' in metrics: # two-pass, deviations from each ROI's own means
+        da = a - np.repeat(sums(a) / n, n)
+        db = b - np.repeat(sums(b) / n, n)
+        denominator = np.sqrt(sums(da * da) * sums(db * db))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = np.where((denominator > 0) & (n >= 2), sums(da * db) / denominator, np.nan)
+        results['pearson'] = per_roi(r)
+    if 'spearman' in metrics:
+        results['spearman'] = np.array([spearman(a[s:e], b[s:e]) if e - s > 1 else np.nan
+                                        for s, e in zip(offsets[:-1], offsets[1:])])
+    if 'm1' in metrics or 'm2' in metrics:
+        m1, m2 = manders_all(*thresholds)
+        if 'm1' in metrics:
+            results['m1'] = m1
+        if 'm2' in metrics:
+            results['m2'] = m2
+    if 'costes' in metrics:
+        costes = np.array([costes_threshold(a[s:e], b[s:e], bins) for s, e in zip(offsets[:-1], offsets[1:])])
+        costes = costes.reshape(len(counts), 4)
+        results.update(zip(('costes_threshold_a', 'costes_threshold_b', 'costes_slope', 'costes_intercept'),
+                           costes.T))
+        results['costes_m1'], results['costes_m2'] = manders_all(costes[:, 0], costes[:, 1])
+    return results
+
+
+def colocalize(rois, image=None, channels=(0, 1), axis=0, bundle_axes='cyx', metrics=METRICS,
+               thresholds=(0, 0), bins=256, progress=None):
+    """
+    Colocalize a channel pair in every ROI and every frame, streaming the image one frame at a time.
+    INPUTS:
+        rois: ROI object, list of ROI objects or ROI_Reader
+        image: ndarray, memmap or PIMS object. Defaults to the image attached to the ROI_Reader/first ROI
+        channels: indices of the two channels to compare
+        axis: axis to iterate over (z or t), as in ROI.measure_stack()
+        bundle_axes: PIMS axes of each frame. Each frame must have the channels first ('cyx');
+            for ndarrays, the channel axis must follow the iterated axis once that is moved to the front
+        metrics, thresholds, bins: see measure_pair()
+        progress: optional callable, called as progress(frames_done, n_frames) after every frame.
+            An exception raised by it stops the run
+    RETURNS: DataFrame with 'name', 'frame' and one column per result, one row per ROI and frame
+    """
+    import pandas
+    from pandas import DataFrame
+
+    if isinstance(rois, ROITools.ROI):
+        rois = [rois]
+    if image is None:
+        image = rois.image if isinstance(rois, ROITools.ROI_Reader) else rois[0].image
+    if image is None:
+        raise ValueError("No image provided or attached")
+
+    stack, n_frames, plane_shape = ROITools._open_frames(image, axis, bundle_axes)
+    if isinstance(rois, ROITools.ROI_Reader):
+        rois.decode() # in parallel for large, lazily opened ROI sets
+        rois = [ROITools.ROI(rois.rois[k], cache=rois.cache, frame_shape=plane_shape) for k in rois.keys]
+    flat_index, offsets = ROITools._roi_index(rois, plane_shape)
+    names = np.array([roi.name for roi in rois], dtype=object)
+
+    pieces = []
+    for frame_number, frame in enumerate(stack): # one frame in memory at a time
+        frame = np.asarray(frame)
+        first = frame[channels[0]].reshape(-1)[flat_index]
+        second = frame[channels[1]].reshape(-1)[flat_index]
+        results = _segment_pairs(first, second, offsets, metrics, thresholds, bins)
+        results.update(name=names, frame=np.full(len(rois), frame_number))
+        pieces.append(DataFrame(results))
+        if progress is not None:
+            progress(frame_number + 1, n_frames)
+
+    table = pandas.concat(pieces, ignore_index=True) if pieces else DataFrame(columns=['name', 'frame'])
+    return table[['name', 'frame'] + [column for column in table.columns if column not in ('name', 'frame')]]
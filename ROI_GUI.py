@@ -24,12 +24,23 @@ CURRENT WORK:
     - Make useable GUI
     - Integrate 
     
+Analyses never run on the Tk thread. Jobs (measure, colocalize, previews) are submitted to a JobRunner,
+which runs them on background threads and reports progress through a thread-safe queue that the UI polls
+with after(). Several images can be queued while one is processing, queued or running jobs can be
+cancelled, and ROI overlays are rendered downsampled off the UI thread (full resolution on demand).
+
+Run with:
+    python ROI_GUI.py
 
 @author: ChrisP
 """
 
 import os
 import sys
+import queue
+import logging
+import itertools
+import threading
 """
 if sys.version_info[0] < 3:
     import Tkinter as tk
@@ -42,61 +53,430 @@ else:
 """    
 import tkinter as tk
 from tkinter import StringVar, Label, Frame, Button
-from tkinter.filedialog import askopenfilename, asksaveasfilename 
+from tkinter.filedialog import askopenfilename, askopenfilenames, askdirectory
+
+import numpy as np
+
+logger = logging.getLogger('ROITools.gui')
+
+PREVIEW_SIZE = 400 # longest side of the downsampled previews, in pixels
+POLL_MS = 100 # interval at which the UI thread drains the event queue
+ROI_COLOR = (255, 60, 60) # overlay color of the ROI outlines
+
+#%%
+#### BACKGROUND JOBS
+# Nothing in this section touches Tk: it runs on worker threads and only talks to the UI through the queue.
+
+class JobCancelled(Exception):
+    """Raised inside a job (by its progress callback) once the job has been cancelled"""
+
+
+class Job:
+    """One submitted job. kind is 'measure', 'colocalize', 'preview' or 'full' (full resolution preview)"""
+    _ids = itertools.count(1)
+
+    def __init__(self, kind, label, function, args, kwargs):
+        self.id = next(Job._ids)
+        self.kind = kind
+        self.label = label
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.state = 'queued'
+        self.cancel_event = threading.Event()
+        self.future = None
+
+
+class JobRunner:
+    """
+    Run jobs on background threads and report on a thread-safe queue.
+    Analyses run one after the other in submission order (workers=1), so images can be queued while one is
+    processing; previews have their own thread so they are not stuck behind a long measurement.
+
+    Job functions are called as function(*args, progress=progress, **kwargs). progress(fraction, message)
+    posts a progress event and raises JobCancelled once the job is cancelled, so a running job stops at
+    its next progress report (ROITools reports after every chunk of frames).
+
+    Events are tuples (kind, job_id, payload):
+        ('state', id, state)             state: 'queued', 'running', 'done', 'cancelled', 'failed'
+        ('progress', id, (fraction, message))
+        ('done', id, result)
+        ('error', id, message)
+    """
+
+    def __init__(self, workers=1):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.events = queue.Queue()
+        self.jobs = {}
+        self.linked = {} # job id -> ids of the jobs cancelled with it
+        self._analysis = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='roitools-job')
+        self._previews = ThreadPoolExecutor(max_workers=1, thread_name_prefix='roitools-preview')
+        return
+
+    def submit(self, kind, label, function, *args, **kwargs):
+        """Queue function(*args, **kwargs) as a job. RETURNS: Job"""
+        job = Job(kind, label, function, args, kwargs)
+        self.jobs[job.id] = job
+        self.events.put(('state', job.id, 'queued'))
+        pool = self._previews if kind in ('preview', 'full') else self._analysis
+        job.future = pool.submit(self._run, job)
+        return job
+
+    def link(self, job_id, *others):
+        """Cancel the other jobs whenever job_id is cancelled (e.g. the preview of a measured image)"""
+        self.linked.setdefault(job_id, []).extend(others)
+
+    def cancel(self, job_id):
+        """Cancel a job and its linked jobs: queued jobs never start, running jobs stop at their next progress report"""
+        for cancelled in [job_id] + self.linked.get(job_id, []):
+            job = self.jobs[cancelled]
+            job.cancel_event.set()
+            if job.future is not None and job.future.cancel(): # had not started yet
+                self._set_state(job, 'cancelled')
+
+    def shutdown(self):
+        """Cancel everything and stop the worker threads (does not wait for running jobs)"""
+        for job in self.jobs.values():
+            job.cancel_event.set()
+        self._analysis.shutdown(wait=False, cancel_futures=True)
+        self._previews.shutdown(wait=False, cancel_futures=True)
+
+    def _set_state(self, job, state):
+        job.state = state
+        self.events.put(('state', job.id, state))
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            self._set_state(job, 'cancelled')
+            return
+        self._set_state(job, 'running')
+
+        def progress(fraction, message=''):
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            self.events.put(('progress', job.id, (fraction, message)))
+
+        try:
+            result = job.function(*job.args, progress=progress, **job.kwargs)
+        except JobCancelled:
+            self._set_state(job, 'cancelled')
+            return
+        except Exception as error: # report to the UI, the worker keeps going with the next job
+            logger.exception("job %d (%s) failed", job.id, job.label)
+            self.events.put(('error', job.id, "{}: {}".format(type(error).__name__, error)))
+            self._set_state(job, 'failed')
+            return
+        self.events.put(('done', job.id, result))
+        self._set_state(job, 'done')
+
+
+def parse_axis(text):
+    """Axis typed in the GUI: a number for ndarrays ('0'), a letter for named axes ('z', 't')"""
+    text = text.strip()
+    return int(text) if text.lstrip('-').isdigit() else text
+
+
+def _no_progress(fraction, message=''):
+    """Progress callback of jobs called directly, outside a JobRunner"""
+    return
+
+
+def _frame_progress(progress, verb):
+    """Adapt a job progress callback to the progress(frames_done, n_frames) hook of ROITools"""
+    return lambda done, total: progress(done / max(total, 1), "{} frame {}/{}".format(verb, done, total))
+
+
+def measure_job(image_path, roi_path, output_dir, axis=0, bundle_axes='yx', measurements=('mean', 'median', 'std'),
+                level=0, progress=None):
+    """
+    Measure all ROIs of roi_path on image_path. level > 0 measures that level of the image pyramid
+    (a quick approximate pass, see ROITools.ImagePyramid). RETURNS: path of the written .csv
+    """
+    import ROITools
+
+    progress = progress or _no_progress
+    progress(0.0, "loading ROIs")
+    reader = ROITools.ROI_Reader(roi_path, image=image_path)
+    if level:
+        progress(0.0, "building pyramid level {}".format(level))
+    table = reader.measure_ROIs(axis=axis, bundle_axes=bundle_axes, measurements=measurements, level=level,
+                                progress=_frame_progress(progress, "measuring"))
+    suffix = '_measurements_level{}.csv'.format(level) if level else '_measurements.csv'
+    path = os.path.join(output_dir, os.path.splitext(os.path.basename(image_path))[0] + suffix)
+    table.to_csv(path, index=False)
+    return path
+
 
-import matplotlib # for eventually creating a graphical display
+def colocalize_job(image_path, roi_path, output_dir, channels=(0, 1), axis=0, bundle_axes='cyx', progress=None):
+    """Colocalize two channels in all ROIs of roi_path. RETURNS: path of the written .csv"""
+    import ROITools
+    import ROI_Coloc
+
+    progress = progress or _no_progress
+    progress(0.0, "loading ROIs")
+    reader = ROITools.ROI_Reader(roi_path, image=image_path)
+    table = ROI_Coloc.colocalize(reader, channels=channels, axis=axis, bundle_axes=bundle_axes,
+                                 progress=_frame_progress(progress, "colocalizing"))
+    path = os.path.join(output_dir, os.path.splitext(os.path.basename(image_path))[0] + '_coloc.csv')
+    table.to_csv(path, index=False)
+    return path
+
+
+def render_preview(image_path, roi_path=None, max_size=PREVIEW_SIZE, axis=0, progress=None):
+    """
+    Render the middle frame of an image with the ROI outlines drawn on it, as a binary PPM (Tk can show it).
+    max_size: longest side of the preview. The frame is subsampled by an integer step to fit, so only
+        every step-th row/column is scaled and drawn. None renders at full resolution
+    RETURNS: dict with 'ppm' (bytes), 'shape' (height, width of the preview) and 'step'
+    """
+    import ROITools
+
+    progress = progress or _no_progress
+    image = ROITools.open_image(image_path)
+    stack, n_frames, plane_shape = ROITools._open_frames(image, axis, 'yx')
+    step = 1 if max_size is None else max(1, -(-max(plane_shape) // max_size)) # ceil division
+    frame = np.asarray(stack[n_frames // 2])
+    if frame.ndim > 2: # several channels: show their maximum
+        frame = frame.reshape((-1,) + frame.shape[-2:]).max(axis=0)
+    plane = frame[::step, ::step].astype(np.float32)
+    progress(0.3, "scaling")
+
+    low, high = np.percentile(plane, (1, 99.5))
+    gray = np.clip((plane - low) * (255.0 / max(high - low, 1e-12)), 0, 255).astype(np.uint8)
+    rgb = np.repeat(gray[..., None], 3, axis=-1)
+
+    if roi_path:
+        rasters = ROITools.ROI_Reader(roi_path).get_ROISet().rasterize(plane_shape)
+        progress(0.6, "drawing ROIs")
+        for (top, left, _, _), mask in rasters:
+            if mask.size == 0:
+                continue
+            padded = np.pad(mask, 1)
+            inside = padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:]
+            rr, cc = np.nonzero(mask & ~inside) # outline pixels
+            rgb[(rr + top) // step, (cc + left) // step] = ROI_COLOR
+
+    header = 'P6 {} {} 255\n'.format(rgb.shape[1], rgb.shape[0]).encode('ascii')
+    progress(1.0, "preview ready")
+    return {'ppm': header + rgb.tobytes(), 'shape': rgb.shape[:2], 'step': step}
+
+
+#%%
+#### USER INTERFACE
 
 class Colocalizer:
     """
     Application for running Colocalization analyses
         - Pearson
         - Thresholded binaries (akin to Par3/CASPR2 paper)
+
+    Every analysis is a job on a JobRunner. The Tk thread only submits jobs and, every POLL_MS, drains the
+    runner's event queue to update the job list, the status line and the preview.
     """
     
-    def __init__(self, master):
+    def __init__(self, master, runner=None):
         # master= root
-        
-        # add import statements here for all dependencies if this module is to be co-opted
-        # this is where the GUI is designed. Other functions then are made
+        self.master = master
+        self.runner = JobRunner() if runner is None else runner
         
         # Initialize string variables (labels)
-        #self.file_path = StringVar()
-        #self.roi_path = StringVar()  
-        #self.output_path = StringVar() # where to save the resulting analysis
+        self.roi_path = StringVar()
+        self.output_path = StringVar() # where to save the resulting analysis
+        self.analysis = StringVar(value='measure')
+        self.axis = StringVar(value='0')
+        self.channels = StringVar(value='0,1')
+        self.level = StringVar(value='0') # pyramid level for quick measurements, 0 = full resolution
+        self.status = StringVar(value="Select an ROI set and add images")
         
-        #self.file_path.set("Image file path")
-        #self.roi_path.set("ROI path (.zip or .roi)")
-        #self.output_path.set("Where to save results")
+        self.roi_path.set("ROI path (.zip or .roi)")
+        self.output_path.set(os.getcwd())
 
+        self.rows = [] # job ids in the order of the job list
+        self.images = {} # job id -> image path
+        self.previews = {} # image path -> preview of that image
+        self.progress = {} # job id -> (fraction, message)
+        self.errors = {}
+        self._photo = None # keep a reference, Tk does not
+        self._windows = [] # full resolution windows
         
         frame = Frame(master)
-        frame.pack()
-
-        self.helloLabel = Label(frame, "Hello World!").grid(row=1, column=1)
-        
-        # Set Buttons
-        #self.exitButton = Button(frame, text="QUIT", fg='red', command=frame.quit).grid(row=10, column=0, sticky=W)
-        #self.oldRecordButton = Button(frame, text='Select File to be Updated (Drive)', command = lambda: self.set_path('Old')).grid(row=1, column=0, sticky=tk.W)
-        #self.newRecordButton = Button(frame, text='Select File Containing New Data (mLims)', command = lambda: self.set_path('New')).grid(row=2, column=0, sticky=tk.W)
-        #self.outputButton = Button(frame, text='Select Output Path', command = lambda: self.set_path('Output')).grid(row=3, column=0, sticky=tk.W)
-        #self.processButton = Button(frame, text = 'Process and Output Data', fg='green', command = lambda: self.process_data()).grid(row=4, column=0, sticky=tk.W)
-        
-        
-        
-        # set labels
-        #self.oldRecordLabel = Label(frame, textvariable=self.old_path).grid(row=1, column=1)
-        #self.newRcordLabel = Label(frame, textvariable=self.new_path).grid(row=2, column=1)
-        #self.outputLabel = Label(frame, fg='green', textvariable=self.output_path).grid(row=3, column=1) # update this with a new textvar
+        frame.pack(padx=8, pady=8)
 
         # add informational label describing module status
         INFO = "Colocalize using ImageJ ROIs! or Define a Masking Channel"
+        Label(frame, text=INFO, font=('Helvetica', 14, 'italic'), wraplength=500, justify='left').grid(row=0, column=0, columnspan=4, sticky=tk.W)
 
-        #self.projectInfoLabel = Label(frame, text=INFO, font=('Helvetica', 14, 'italic'), wraplength=400, justify='left').grid(row=0, column=0,sticky=tk.W)
+        # Set Buttons
+        Button(frame, text="ROI set...", command=self.select_rois).grid(row=1, column=0, sticky=tk.W)
+        Label(frame, textvariable=self.roi_path).grid(row=1, column=1, columnspan=3, sticky=tk.W)
+        Button(frame, text="Output folder...", command=self.select_output).grid(row=2, column=0, sticky=tk.W)
+        Label(frame, fg='green', textvariable=self.output_path).grid(row=2, column=1, columnspan=3, sticky=tk.W)
+
+        tk.Radiobutton(frame, text="Measure", variable=self.analysis, value='measure').grid(row=3, column=0, sticky=tk.W)
+        tk.Radiobutton(frame, text="Colocalize", variable=self.analysis, value='colocalize').grid(row=3, column=1, sticky=tk.W)
+        Label(frame, text="Quick level").grid(row=3, column=2, sticky=tk.W)
+        tk.Entry(frame, textvariable=self.level, width=6).grid(row=3, column=3, sticky=tk.W)
+        Label(frame, text="Axis").grid(row=4, column=0, sticky=tk.W)
+        tk.Entry(frame, textvariable=self.axis, width=6).grid(row=4, column=1, sticky=tk.W)
+        Label(frame, text="Channels").grid(row=4, column=2, sticky=tk.W)
+        tk.Entry(frame, textvariable=self.channels, width=6).grid(row=4, column=3, sticky=tk.W)
+
+        Button(frame, text="Add images...", fg='green', command=self.add_images).grid(row=5, column=0, sticky=tk.W)
+        self.job_list = tk.Listbox(frame, width=80, height=8, exportselection=False)
+        self.job_list.grid(row=6, column=0, columnspan=4, sticky=tk.W + tk.E)
+        self.job_list.bind('<<ListboxSelect>>', lambda event: self.show_preview())
+        Button(frame, text="Cancel selected", fg='red', command=self.cancel_selected).grid(row=7, column=0, sticky=tk.W)
+        Button(frame, text="Full resolution", command=self.full_resolution).grid(row=7, column=1, sticky=tk.W)
 
+        self.preview = Label(frame, text="(no preview)")
+        self.preview.grid(row=8, column=0, columnspan=4)
+        Label(frame, textvariable=self.status, anchor=tk.W).grid(row=9, column=0, columnspan=4, sticky=tk.W)
+
+        master.protocol('WM_DELETE_WINDOW', self.close)
+        master.after(POLL_MS, self.poll)
         return
         
+    def select_rois(self):
+        path = askopenfilename(title="ROI set", filetypes=[("ImageJ ROIs", "*.zip *.roi"), ("All files", "*")])
+        if path:
+            self.roi_path.set(path)
         
-root = tk.Tk()
-app = Colocalizer(root)
+    def select_output(self):
+        path = askdirectory(title="Output folder")
+        if path:
+            self.output_path.set(path)
+
+    def add_images(self):
+        """Queue one analysis job (and a preview) per selected image. Returns immediately"""
+        roi_path = self.roi_path.get()
+        if not os.path.isfile(roi_path):
+            self.status.set("Select an ROI set first")
+            return
+        paths = askopenfilenames(title="Images", filetypes=[("Images", "*.tif *.tiff *.nd2 *.czi *.png"), ("All files", "*")])
+        for path in paths:
+            self.queue_image(path, roi_path)
+
+    def queue_image(self, image_path, roi_path):
+        axis = parse_axis(self.axis.get())
+        name = os.path.basename(image_path)
+        if self.analysis.get() == 'colocalize':
+            channels = tuple(int(c) for c in self.channels.get().split(','))
+            job = self.runner.submit('colocalize', name, colocalize_job, image_path, roi_path, self.output_path.get(),
+                                     channels=channels, axis=axis)
+        else:
+            job = self.runner.submit('measure', name, measure_job, image_path, roi_path, self.output_path.get(), axis=axis,
+                                     level=int(self.level.get() or 0))
+        self.images[job.id] = image_path
+        self.rows.append(job.id)
+        self.job_list.insert(tk.END, self._describe(job.id))
+        preview = self.runner.submit('preview', name, render_preview, image_path, roi_path, axis=axis)
+        self.images[preview.id] = image_path
+        self.runner.link(job.id, preview.id) # cancelling the image cancels its preview too
+
+    def selected_job(self):
+        selection = self.job_list.curselection()
+        return self.rows[selection[0]] if selection else None
+
+    def cancel_selected(self):
+        job_id = self.selected_job()
+        if job_id is not None:
+            self.runner.cancel(job_id)
+
+    def show_preview(self):
+        job_id = self.selected_job()
+        preview = self.previews.get(self.images.get(job_id))
+        if preview is None:
+            self.preview.configure(image='', text="(preview not ready)")
+            return
+        self._photo = tk.PhotoImage(data=preview['ppm'], format='PPM')
+        self.preview.configure(image=self._photo, text='')
+
+    def full_resolution(self):
+        """Render the selected image at full resolution (in the background) and open it in a new window"""
+        job_id = self.selected_job()
+        if job_id is None:
+            return
+        image_path = self.images[job_id]
+        job = self.runner.submit('full', os.path.basename(image_path), render_preview, image_path, self.roi_path.get(),
+                                 max_size=None, axis=parse_axis(self.axis.get()))
+        self.images[job.id] = image_path
+        self.status.set("Rendering {} at full resolution...".format(os.path.basename(image_path)))
+
+    def _open_window(self, title, preview):
+        window = tk.Toplevel(self.master)
+        window.title(title)
+        canvas = tk.Canvas(window, width=min(preview['shape'][1], 1200), height=min(preview['shape'][0], 900),
+                           scrollregion=(0, 0, preview['shape'][1], preview['shape'][0]))
+        x_scroll = tk.Scrollbar(window, orient=tk.HORIZONTAL, command=canvas.xview)
+        y_scroll = tk.Scrollbar(window, orient=tk.VERTICAL, command=canvas.yview)
+        canvas.configure(xscrollcommand=x_scroll.set, yscrollcommand=y_scroll.set)
+        canvas.grid(row=0, column=0)
+        x_scroll.grid(row=1, column=0, sticky=tk.W + tk.E)
+        y_scroll.grid(row=0, column=1, sticky=tk.N + tk.S)
+        canvas.photo = tk.PhotoImage(data=preview['ppm'], format='PPM')
+        canvas.create_image(0, 0, image=canvas.photo, anchor=tk.NW)
+        self._windows.append(window)
+
+    def _describe(self, job_id):
+        job = self.runner.jobs[job_id]
+        text = "#{} {:<10} {:<30} {}".format(job.id, job.kind, job.label, job.state)
+        if job.state == 'running' and job_id in self.progress:
+            fraction, message = self.progress[job_id]
+            text += " {:3.0f}% {}".format(100 * fraction, message)
+        elif job.state == 'failed':
+            text += " " + self.errors.get(job_id, '')
+        return text
+
+    def _refresh_row(self, job_id):
+        if job_id in self.rows:
+            row = self.rows.index(job_id)
+            selected = self.job_list.curselection()
+            self.job_list.delete(row)
+            self.job_list.insert(row, self._describe(job_id))
+            if row in selected:
+                self.job_list.selection_set(row)
+
+    def poll(self, max_events=200):
+        """Drain the job events (UI thread only) and schedule the next poll"""
+        changed = set()
+        for _ in range(max_events):
+            try:
+                kind, job_id, payload = self.runner.events.get_nowait()
+            except queue.Empty:
+                break
+            job = self.runner.jobs[job_id]
+            if kind == 'progress':
+                self.progress[job_id] = payload
+            elif kind == 'error':
+                self.errors[job_id] = payload
+                self.status.set("{} failed: {}".format(job.label, payload))
+            elif kind == 'done' and job.kind == 'preview':
+                self.previews[self.images[job_id]] = payload
+                if self.images.get(self.selected_job()) == self.images[job_id]:
+                    self.show_preview()
+            elif kind == 'done' and job.kind == 'full':
+                self._open_window(job.label, payload)
+                self.status.set("{} shown at full resolution".format(job.label))
+            elif kind == 'done':
+                self.status.set("{} done: {}".format(job.label, payload))
+            changed.add(job_id)
+        for job_id in changed:
+            self._refresh_row(job_id)
+        self.master.after(POLL_MS, self.poll)
+
+    def close(self):
+        self.runner.shutdown()
+        self.master.destroy()
+
+
+def main():
+    root = tk.Tk()
+    root.title("ROITools Colocalizer")
+    app = Colocalizer(root)
+    root.mainloop()
+    return app
+
 
-root.mainloop()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Shared fixtures for the ROITools tests. The modules live at the top of the repository, not in a package"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ROI_Benchmark # noqa: E402
+
+
+@pytest.fixture
+def stack_and_rois(tmp_path):
+    """Small synthetic (frames, y, x) stack saved as .tif and an ImageJ ROI set of rectangles, ovals and polygons"""
+    stack = ROI_Benchmark.synthetic_stack((6, 128, 160), seed=1, path=str(tmp_path / 'stack.tif'))
+    rois = ROI_Benchmark.synthetic_rois(24, shape=(128, 160), n_vertices=40, seed=2)
+    zip_path = ROI_Benchmark.write_roi_zip(str(tmp_path / 'RoiSet.zip'), rois)
+    return stack, str(tmp_path / 'stack.tif'), rois, zip_path
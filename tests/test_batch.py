@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""ROI_Batch: file matching, batch measurement and resuming an interrupted run"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import ROI_Batch
+import ROITools
+
+
+def make_pairs(stack_and_rois, directory, keys=('cell1', 'cell2')):
+    _, image_path, _, zip_path = stack_and_rois
+    os.makedirs(directory)
+    for key in keys:
+        shutil.copy(image_path, os.path.join(directory, key + '.tif'))
+        shutil.copy(zip_path, os.path.join(directory, key + '_RoiSet.zip'))
+    return ROI_Batch.match_pairs(str(directory))
+
+
+def test_pair_keys_and_matching(stack_and_rois, tmp_path):
+    assert ROI_Batch.pair_key('a/cell 3_RoiSet.zip') == ROI_Batch.pair_key('cell 3.tif') == 'cell 3'
+    assert ROI_Batch.pair_key('exp1_well4_rois.zip', r'(?P<key>well\d+)') == 'well4'
+    assert ROI_Batch.pair_key('notes.zip', r'well\d+') is None
+    
+    pairs = make_pairs(stack_and_rois, tmp_path / 'data')
+    (tmp_path / 'data' / 'orphan.tif').write_bytes(b'')
+    assert [key for key, _, _ in pairs] == ['cell1', 'cell2']
+    assert all(roi.endswith('_RoiSet.zip') and image.endswith(key + '.tif') for key, image, roi in pairs)
+
+
+def test_run_and_resume(stack_and_rois, tmp_path):
+    pairs = make_pairs(stack_and_rois, tmp_path / 'data')
+    pairs.append(('broken', str(tmp_path / 'missing.tif'), pairs[0][2]))
+    output = str(tmp_path / 'out')
+    
+    summary = ROI_Batch.run_batch(pairs, output, workers=1, measurements=('mean', 'max'), position=False)
+    assert sorted(summary['completed']) == ['cell1', 'cell2'] and summary['failed'] == ['broken']
+    table = pd.read_csv(os.path.join(output, 'cell1.csv'))
+    expected = ROITools.ROI_Reader(pairs[0][2], image=pairs[0][1]).measure_ROIs(measurements=('mean', 'max'),
+                                                                                  position=False)
+    assert (table['image'] == 'cell1').all()
+    np.testing.assert_allclose(table['mean'], expected['mean'])
+    
+    # a resumed run only measures what is not done: failed pairs and pairs whose output went missing
+    os.remove(os.path.join(output, 'cell2.csv'))
+    finished = os.path.getmtime(os.path.join(output, 'cell1.csv'))
+    summary = ROI_Batch.run_batch(pairs, output, workers=1, roi_names='^rect', measurements=('mean',),
+                                  position=False)
+    assert summary['skipped'] == ['cell1'] and summary['completed'] == ['cell2'] and summary['failed'] == ['broken']
+    assert os.path.getmtime(os.path.join(output, 'cell1.csv')) == finished
+    assert set(pd.read_csv(os.path.join(output, 'cell2.csv'))['name'].str[:4]) == {'rect'}
+    with open(os.path.join(output, ROI_Batch.MANIFEST)) as f:
+        assert sorted(json.loads(line)['key'] for line in f) == ['cell1', 'cell2', 'cell2']
+    assert sorted(ROI_Batch.completed_pairs(output)) == ['cell1', 'cell2']
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""ROI_Benchmark result comparison"""
+
+import ROI_Benchmark
+
+
+def test_compare_ratios_and_missing_baseline():
+    old = {'results': [{'benchmark': 'measure', 'params': {'n': 1}, 'seconds': 2.0, 'peak_mb': 0.0},
+                       {'benchmark': 'gone', 'params': {}, 'seconds': 1.0, 'peak_mb': 1.0}]}
+    new = {'results': [{'benchmark': 'measure', 'params': {'n': 1}, 'seconds': 1.0, 'peak_mb': 3.0},
+                       {'benchmark': 'added', 'params': {}, 'seconds': 1.0, 'peak_mb': 1.0}]}
+    rows = ROI_Benchmark.compare(old, new)
+    assert len(rows) == 1
+    assert rows[0]['time_ratio'] == 0.5 and rows[0]['memory_ratio'] is None
+    line = ROI_Benchmark.format_comparison(rows[0])
+    assert 'time x0.50' in line and 'memory n/a' in line
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""The roitools command line: measure output against ROI_Reader.measure_ROIs(), errors and --timing"""
+
+import io
+
+import numpy as np
+import pandas as pd
+
+import ROI_CLI
+import ROITools
+
+
+def test_measure_csv_matches_measure_ROIs(stack_and_rois, tmp_path):
+    _, image_path, _, zip_path = stack_and_rois
+    output = str(tmp_path / 'out.csv')
+    assert ROI_CLI.main(['measure', image_path, zip_path, '-o', output, '-m', 'mean,max', '--position', 'none']) == 0
+    rows = pd.read_csv(output).sort_values(['name', 'z']).reset_index(drop=True)
+    
+    reader = ROITools.ROI_Reader(zip_path, image=image_path)
+    expected = reader.measure_ROIs(measurements=('mean', 'max'), position=False)
+    expected = expected.sort_values(['name', 'frame']).reset_index(drop=True)
+    assert len(rows) == len(expected) == 24 * 6
+    assert (rows['name'] == expected['name']).all() and (rows['z'] == expected['frame']).all()
+    np.testing.assert_allclose(rows['mean'], expected['mean'])
+    np.testing.assert_allclose(rows['max'], expected['max'])
+
+
+def test_stdout_names_and_timing(stack_and_rois, capsys):
+    _, image_path, rois, zip_path = stack_and_rois
+    name = rois[0]['name']
+    assert ROI_CLI.main(['measure', image_path, zip_path, '--roi', name, '--position', 'none', '--timing']) == 0
+    out, err = capsys.readouterr()
+    rows = pd.read_csv(io.StringIO(out))
+    assert set(rows['name']) == {name} and len(rows) == 6
+    assert '6 rows written to stdout' in err and 'calls' in err
+
+
+def test_no_matching_names_is_an_error(stack_and_rois, capsys):
+    _, image_path, _, zip_path = stack_and_rois
+    assert ROI_CLI.main(['measure', image_path, zip_path, '--names', '^no such roi$']) == 1
+    assert 'no ROI' in capsys.readouterr().err
+    assert ROI_CLI.main(['measure', image_path, zip_path, '--per-roi']) == 0
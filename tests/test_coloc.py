@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Colocalization: Costes threshold against a brute-force search, colocalize() against measure_pair()"""
+
+import numpy as np
+import pytest
+
+import ROI_Benchmark
+import ROI_Coloc
+import ROITools
+
+
+def brute_force_costes(a, b, bins=256):
+    """Costes threshold by testing every candidate threshold on the pixels, highest first"""
+    _, _, slope, intercept = ROI_Coloc.costes_threshold(a, b, bins)
+    edges = ROI_Coloc._bin(np.asarray(a), bins)[1]
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    for threshold in edges[:0:-1]:
+        below = (a < threshold) & (b < slope * threshold + intercept)
+        if below.sum() >= 3 and ROI_Coloc.pearson(a[below], b[below]) <= 0:
+            return threshold, slope * threshold + intercept
+    return edges[0], slope * edges[0] + intercept
+
+
+def correlated(n, seed, dtype=np.uint16, scale=300):
+    rng = np.random.default_rng(seed)
+    signal = rng.gamma(2.0, scale, n)
+    a = signal + rng.normal(0, scale / 2, n) + 100
+    b = 0.7 * signal + rng.normal(0, scale / 2, n) + 150
+    if dtype == np.float64:
+        return a, b
+    return np.clip(a, 0, None).astype(dtype), np.clip(b, 0, None).astype(dtype)
+
+
+@pytest.mark.parametrize('dtype, scale, bins', [(np.uint8, 20, 256), (np.uint16, 300, 256), (np.uint16, 300, 64),
+                                                 (np.float64, 300, 128)])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_costes_matches_brute_force(dtype, scale, bins, seed):
+    a, b = correlated(3000, seed, dtype, scale)
+    threshold_a, threshold_b, _, _ = ROI_Coloc.costes_threshold(a, b, bins)
+    expected_a, expected_b = brute_force_costes(a, b, bins)
+    assert threshold_a == pytest.approx(expected_a) and threshold_b == pytest.approx(expected_b)
+
+
+def test_costes_undefined():
+    assert np.isnan(ROI_Coloc.costes_threshold([1, 2], [3, 4])[0])
+    assert np.isnan(ROI_Coloc.costes_threshold(np.ones(10), np.arange(10))[0])
+
+
+def test_colocalize_matches_measure_pair():
+    a, b = correlated(4 * 2 * 96 * 112, 4)
+    stack = np.stack([a.reshape(4, 2, 96, 112)[:, 0], b.reshape(4, 2, 96, 112)[:, 1]], axis=1) # (t, c, y, x)
+    rois = [ROITools.ROI(roi) for roi in ROI_Benchmark.synthetic_rois(12, shape=(96, 112), n_vertices=30, seed=5)]
+    rois.append(ROITools.ROI({'type': 'rectangle', 'name': 'outside', 'position': 0, 'left': 500, 'top': 500, 'width': 5,
+                              'height': 5}))
+    table = ROI_Coloc.colocalize(rois, stack, channels=(0, 1), thresholds=(200, 250))
+    assert len(table) == 4 * len(rois) and list(table.columns[:3]) == ['name', 'frame', 'n_pixels']
+    
+    for row in table.itertuples(index=False):
+        roi = rois[[r.name for r in rois].index(row.name)]
+        rr, cc, keep = roi._measured_region((96, 112))
+        frame = stack[row.frame]
+        expected = ROI_Coloc.measure_pair(frame[0][rr, cc][keep], frame[1][rr, cc][keep], thresholds=(200, 250))
+        for key, value in expected.items():
+            np.testing.assert_allclose(getattr(row, key), value, rtol=1e-9, err_msg=key)
+    assert table.loc[table['name'] == 'outside', 'n_pixels'].eq(0).all()
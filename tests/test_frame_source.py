@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Prefetching FrameSource: frame order, read-ahead bound, subsets and measurements through it"""
+
+import threading
+import time
+
+import numpy as np
+
+import ROITools
+
+
+class SlowReader:
+    """Minimal PIMS-like reader recording which frames were read"""
+    
+    def __init__(self, stack, delay=0.002):
+        self.stack = stack
+        self.delay = delay
+        self.read = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.frame_shape = stack.shape[1:]
+    
+    def __len__(self):
+        return len(self.stack)
+    
+    def __getitem__(self, i):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.read.append(i)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return self.stack[i]
+
+
+def test_order_and_read_ahead(stack_and_rois):
+    stack = stack_and_rois[0]
+    reader = SlowReader(np.concatenate([stack] * 4))
+    source = ROITools.FrameSource(reader, workers=3, depth=2)
+    for i, frame in enumerate(source):
+        np.testing.assert_array_equal(frame, reader.stack[i])
+        assert max(reader.read) <= i + 2 # never more than depth frames ahead
+    assert sorted(reader.read) == list(range(len(reader)))
+    assert reader.max_active == 1 # reads are serialized unless thread_safe
+    
+    reader = SlowReader(stack)
+    frames = list(ROITools.FrameSource(reader, workers=2, depth=4, thread_safe=True,
+                                       transform=lambda f: f[:10, :10]).iter_frames([5, 1, 3]))
+    assert sorted(reader.read) == [1, 3, 5]
+    np.testing.assert_array_equal(np.stack(frames), stack[[5, 1, 3], :10, :10])
+
+
+def test_early_stop_reads_no_further(stack_and_rois):
+    reader = SlowReader(np.concatenate([stack_and_rois[0]] * 10), delay=0.005)
+    for i, _ in enumerate(ROITools.FrameSource(reader, depth=3)):
+        if i == 2:
+            break
+    assert max(reader.read) <= 2 + 3
+
+
+def test_measurements_through_a_frame_source(stack_and_rois):
+    stack, _, rois, zip_path = stack_and_rois
+    source = ROITools.FrameSource(SlowReader(stack, delay=0), workers=2, depth=2)
+    roi = ROITools.ROI(rois[1])
+    np.testing.assert_allclose(roi.measure_stack(source, position=False).to_numpy(),
+                               roi.measure_stack(stack, position=False).to_numpy())
+    reader = ROITools.ROI_Reader(zip_path)
+    np.testing.assert_allclose(reader.measure_ROIs(source, position=False, chunk_size=4)['mean'],
+                               reader.measure_ROIs(stack, position=False)['mean'])
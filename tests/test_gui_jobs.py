@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""GUI job functions and the JobRunner (no Tk window is opened)"""
+
+import os
+import threading
+
+import pytest
+
+tk = pytest.importorskip('tkinter')
+
+import ROI_GUI # noqa: E402
+from ROI_Benchmark import synthetic_stack # noqa: E402
+
+
+def _events(runner, job_id):
+    events = []
+    while not runner.events.empty():
+        event = runner.events.get_nowait()
+        if event[1] == job_id:
+            events.append(event)
+    return events
+
+
+def test_job_functions_without_runner(tmp_path, stack_and_rois):
+    stack, image_path, rois, zip_path = stack_and_rois
+    path = ROI_GUI.measure_job(image_path, zip_path, str(tmp_path))
+    from pandas import read_csv
+    assert len(read_csv(path)) == len(rois) * len(stack)
+    preview = ROI_GUI.render_preview(image_path, zip_path, max_size=64)
+    assert preview['step'] == 3 and preview['ppm'].startswith(b'P6')
+    
+    two_channels = str(tmp_path / 'two.tif')
+    synthetic_stack((3, 2, 128, 160), path=two_channels)
+    path = ROI_GUI.colocalize_job(two_channels, zip_path, str(tmp_path))
+    assert os.path.exists(path)
+
+
+def test_cancelling_a_job_cancels_its_preview(tmp_path, stack_and_rois):
+    _, image_path, _, zip_path = stack_and_rois
+    runner = ROI_GUI.JobRunner()
+    gate = threading.Event()
+    blocker = runner.submit('preview', 'blocker', lambda progress: gate.wait(5)) # keeps the preview thread busy
+    measure = runner.submit('measure', 'stack', ROI_GUI.measure_job, image_path, zip_path, str(tmp_path))
+    preview = runner.submit('preview', 'stack', ROI_GUI.render_preview, image_path, zip_path)
+    runner.link(measure.id, preview.id)
+    runner.cancel(measure.id)
+    gate.set()
+    blocker.future.result(5)
+    runner.shutdown()
+    assert preview.state == 'cancelled'
+    assert measure.state in ('cancelled', 'running', 'done') # it may have started already
+    assert ('state', preview.id, 'cancelled') in _events(runner, preview.id)
+
+
+def test_running_job_stops_at_next_progress():
+    runner = ROI_GUI.JobRunner()
+    started, cancelled = threading.Event(), threading.Event()
+    reports = []
+    
+    def job(progress):
+        progress(0.1)
+        started.set()
+        cancelled.wait(5)
+        progress(0.2) # raises JobCancelled
+        reports.append('not stopped')
+    submitted = runner.submit('measure', 'long', job)
+    started.wait(5)
+    runner.cancel(submitted.id)
+    cancelled.set()
+    submitted.future.result(5)
+    runner.shutdown()
+    assert submitted.state == 'cancelled' and not reports
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Instrumentation stages and run reports"""
+
+import os
+import re
+
+import ROITools
+
+
+def test_every_timed_stage_is_listed():
+    with open(os.path.join(os.path.dirname(ROITools.__file__), 'ROITools.py')) as f:
+        used = set(re.findall(r"\.stage\('(\w+)'", f.read()))
+    assert used <= set(ROITools.Instrumentation.STAGES)
+
+
+def test_run_reports_hash_and_pyramid(stack_and_rois, tmp_path):
+    _, image_path, _, zip_path = stack_and_rois
+    reader = ROITools.ROI_Reader(zip_path, image=image_path)
+    cache = ROITools.ResultCache(str(tmp_path / 'cache'))
+    with ROITools.INSTRUMENTATION.run() as run:
+        reader.measure_ROIs(measurements=('mean',), level=1, result_cache=cache)
+    stages = run.report['stages']
+    assert {'hash', 'pyramid', 'read_frame'} <= set(stages)
+    assert set(stages) <= set(ROITools.Instrumentation.STAGES)
+    assert not ROITools.INSTRUMENTATION.enabled
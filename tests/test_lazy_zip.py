@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""LazyROIZip against read_roi_zip, decoding on demand and in worker processes"""
+
+import pickle
+
+import numpy as np
+from read_roi import read_roi_zip
+
+import ROI_Benchmark
+import ROITools
+
+
+def test_same_rois_as_read_roi_zip(stack_and_rois):
+    zip_path = stack_and_rois[3]
+    expected = read_roi_zip(zip_path)
+    rois = ROITools.LazyROIZip(zip_path)
+    assert list(rois) == list(expected) and len(rois) == len(expected)
+    assert not any(rois.decoded(name) for name in rois)
+    name = list(expected)[5]
+    assert rois[name] == expected[name] and rois.decoded(name) and rois[name] is rois[name]
+    assert sum(rois.decoded(n) for n in rois) == 1
+    assert dict(rois) == dict(expected)
+
+
+def test_headers_without_decoding(stack_and_rois):
+    zip_path = stack_and_rois[3]
+    expected = read_roi_zip(zip_path)
+    rois = ROITools.LazyROIZip(zip_path)
+    assert rois.types() == {name: roi['type'] for name, roi in expected.items()}
+    for name, (top, left, bottom, right) in rois.bboxes().items():
+        (rr_top, rr_left, rr_bottom, rr_right), _ = ROITools.rasterize(expected[name])
+        assert top <= rr_top and left <= rr_left and bottom >= rr_bottom - 1 and right >= rr_right - 1
+    assert not any(rois.decoded(name) for name in rois)
+
+
+def test_parallel_decode_and_pickling(tmp_path):
+    rois = ROI_Benchmark.synthetic_rois(300, shape=(256, 256), n_vertices=20, seed=4)
+    zip_path = ROI_Benchmark.write_roi_zip(str(tmp_path / 'many.zip'), rois)
+    expected = read_roi_zip(zip_path)
+    lazy = ROITools.LazyROIZip(zip_path)
+    lazy.PARALLEL = 50
+    names = list(lazy)[:200]
+    lazy.decode(names, workers=2)
+    assert all(lazy.decoded(n) for n in names) and not lazy.decoded(list(lazy)[-1])
+    assert {n: lazy[n] for n in names} == {n: expected[n] for n in names}
+    
+    copy = pickle.loads(pickle.dumps(lazy)) # e.g. sent to batch workers
+    assert copy[list(lazy)[-1]] == expected[list(lazy)[-1]]
+    
+    reader = ROITools.ROI_Reader(zip_path)
+    eager = ROITools.ROI_Reader(zip_path, lazy=False)
+    assert isinstance(reader.rois, ROITools.LazyROIZip) and reader.keys == eager.keys
+    image = np.random.default_rng(0).integers(0, 1000, (2, 256, 256), dtype=np.uint16)
+    np.testing.assert_allclose(reader.measure_ROIs(image, position=False)['mean'],
+                               eager.measure_ROIs(image, position=False)['mean'])
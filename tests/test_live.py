@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Live measurement of growing acquisitions (GrowingStack, LiveMeasurement) against measure_ROIs() on the finished stack"""
+
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import ROITools
+from ROI_Benchmark import simulate_acquisition, synthetic_rois, synthetic_stack, write_roi_zip
+
+N_FRAMES = 8
+FRAME = (64, 80)
+
+
+def _reader(tmp_path):
+    rois = synthetic_rois(9, shape=FRAME, n_vertices=30, seed=4)
+    rois[0]['position'] = {'channel': 0, 'slice': 0, 'frame': 3} # only measured on frame index 2
+    return ROITools.ROI_Reader(write_roi_zip(str(tmp_path / 'RoiSet.zip'), rois))
+
+
+def _expected(reader):
+    stack = synthetic_stack((N_FRAMES,) + FRAME) # what simulate_acquisition() writes
+    return reader.measure_ROIs(stack, position='t').sort_values(['name', 'frame']).reset_index(drop=True)
+
+
+def _acquire(path, interval=0.01):
+    thread = threading.Thread(target=simulate_acquisition, args=(path,),
+                              kwargs=dict(n_frames=N_FRAMES, frame_shape=FRAME, interval=interval))
+    thread.start()
+    return thread
+
+
+def _follow_until_done(live, thread):
+    while thread.is_alive():
+        live.update()
+        time.sleep(0.005)
+    for _ in range(3): # files in a directory count once their size is stable between two refreshes
+        live.update()
+    return live.results.sort_values(['name', 'frame']).reset_index(drop=True)
+
+
+def _check(results, expected):
+    assert list(results['name']) == list(expected['name'])
+    assert list(results['frame']) == list(expected['frame'])
+    for column in ('mean', 'median', 'std'):
+        np.testing.assert_allclose(results[column].to_numpy(float), expected[column].to_numpy(float))
+
+
+@pytest.mark.parametrize('target', ['live.tif', 'frames'])
+def test_live_matches_finished_stack(tmp_path, target):
+    reader = _reader(tmp_path)
+    path = str(tmp_path / target)
+    live = reader.follow(path)
+    results = _follow_until_done(live, _acquire(path))
+    _check(results, _expected(reader))
+    bound = results[results['name'] == reader.keys[0]]
+    assert bound['frame'].tolist() == [2]
+
+
+def test_directory_created_after_watch_starts(tmp_path):
+    reader = _reader(tmp_path)
+    path = str(tmp_path / 'later')
+    live = reader.follow(path)
+    assert live.update() is None # nothing there yet: no error, no rows
+    assert live.source.is_directory is None
+    results = _follow_until_done(live, _acquire(path))
+    assert live.source.is_directory
+    _check(results, _expected(reader))
+
+
+def test_csv_output_resumes(tmp_path):
+    import tifffile
+    from pandas import read_csv
+    
+    reader = _reader(tmp_path)
+    path, output = str(tmp_path / 'live.tif'), str(tmp_path / 'live.csv')
+    stack = synthetic_stack((N_FRAMES,) + FRAME)
+    for frame in stack[:4]:
+        tifffile.imwrite(path, frame, append=True)
+    reader.follow(path, output=output).update()
+    for frame in stack[4:]:
+        tifffile.imwrite(path, frame, append=True)
+    resumed = reader.follow(path, output=output)
+    assert resumed.n_measured == 4
+    assert set(resumed.update()['frame']) == set(range(4, N_FRAMES))
+    _check(read_csv(output).sort_values(['name', 'frame']).reset_index(drop=True), _expected(reader))
+
+
+def test_bound_rois_are_not_measured_on_other_frames(tmp_path, monkeypatch):
+    reader = _reader(tmp_path)
+    path = str(tmp_path / 'live.tif')
+    simulate_acquisition(path, n_frames=N_FRAMES, frame_shape=FRAME, interval=0)
+    live = reader.follow(path)
+    segments = []
+    summarize = ROITools._summarize_segments
+    monkeypatch.setattr(ROITools, '_summarize_segments',
+                        lambda values, offsets, measurements: segments.append(len(offsets) - 1) or
+                        summarize(values, offsets, measurements))
+    live.update()
+    # one call per chunk for the 8 unbound ROIs, one for the bound ROI on its frame only
+    assert sorted(segments) == [1, 8]
+
+
+def test_growing_stack_explicit_kind(tmp_path):
+    path = str(tmp_path / 'frames')
+    os.makedirs(path)
+    stack = ROITools.GrowingStack(path, directory=True)
+    assert stack.refresh() == 0
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""mask_and_flatten(): chunked projections against numpy on the whole masked stack"""
+
+import warnings
+
+import numpy as np
+import pytest
+
+import ROITools
+
+PROJECTIONS = ('max', 'mean', 'sum', 'std', 'count')
+
+
+def reference(stack, mask_channel, threshold):
+    """(projections, c, y, x) computed on the whole (planes, c, y, x) stack at once"""
+    stack = stack.astype(np.float64)
+    keep = stack[:, mask_channel] > threshold
+    values = np.where(keep[:, None], stack, np.nan)
+    with warnings.catch_warnings(): # all-nan pixels
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.stack([np.nanmax(values, axis=0), np.nanmean(values, axis=0), np.nansum(values, axis=0),
+                         np.nanstd(values, axis=0), np.broadcast_to(keep.sum(axis=0), values.shape[1:])])
+
+
+@pytest.mark.parametrize('chunk_size, workers', [(1, 1), (3, 2), (16, 1)])
+def test_projections_match_numpy(chunk_size, workers):
+    rng = np.random.default_rng(0)
+    stack = rng.integers(0, 1000, (11, 3, 20, 24)).astype(np.uint16) # (z, c, y, x)
+    stack[:, 1, :2] = 0 # masked in every plane
+    result = ROITools.mask_and_flatten(stack, mask_channel=1, threshold=400, projections=PROJECTIONS,
+                                       chunk_size=chunk_size, workers=workers, dtype=np.float64)
+    expected = reference(stack, 1, 400)
+    assert result.shape == (5, 3, 20, 24)
+    np.testing.assert_allclose(result, expected, rtol=1e-9, equal_nan=True)
+    assert np.isnan(result[0, :, :2]).all() and (result[2, :, :2] == 0).all()
+
+
+def test_other_axis_and_memmap_output(tmp_path):
+    stack = np.random.default_rng(1).random((2, 8, 16, 16)) # (c, t, y, x)
+    out = str(tmp_path / 'flat.npy')
+    result = ROITools.mask_and_flatten(stack, mask_channel=0, threshold=0.3, projections=('mean', 'max'), axis=1,
+                                       chunk_size=3, out=out)
+    assert isinstance(result, np.memmap) and result.dtype == np.float32
+    np.testing.assert_allclose(np.load(out), reference(np.moveaxis(stack, 1, 0), 0, 0.3)[[1, 0]], rtol=1e-5)
+    with pytest.raises(ValueError):
+        ROITools.mask_and_flatten(stack, projections=('median',))
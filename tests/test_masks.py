@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""ROI masks (whole plane and bounding-box local) and crop_image()"""
+
+import numpy as np
+import pims
+
+import ROITools
+
+
+def test_bbox_mask_matches_rasterized_pixels(stack_and_rois):
+    _, _, rois, _ = stack_and_rois
+    for roi_dict in rois:
+        roi = ROITools.ROI(roi_dict)
+        rr, cc = roi.pixels
+        top, left, bottom, right = roi.bbox
+        assert roi.bbox_mask.shape == (bottom - top, right - left)
+        full = np.zeros((bottom, right), dtype=bool)
+        full[rr, cc] = True
+        np.testing.assert_array_equal(full[top:, left:], roi.bbox_mask)
+
+
+def test_cropped_mask_is_the_bbox_of_the_full_mask(stack_and_rois):
+    stack, _, rois, _ = stack_and_rois
+    for masking in ('outside', 'inside'):
+        roi = ROITools.ROI(rois[2], masking=masking)
+        full = roi.create_mask(stack)
+        rows, cols, _ = roi._measured_region(stack.shape[-2:])
+        cropped = roi.create_mask(stack, crop=True)
+        np.testing.assert_array_equal(cropped.mask, full.mask[..., rows, cols])
+        np.testing.assert_array_equal(cropped.filled(0), full.filled(0)[..., rows, cols])
+        assert full.mask.shape == stack.shape and (full.data == stack).all()
+
+
+def test_crop_image_keeps_measurements(stack_and_rois):
+    stack, image_path, rois, _ = stack_and_rois
+    for image in (stack, pims.open(image_path)):
+        roi = ROITools.ROI(rois[7], image=image)
+        before = roi.measure_stack(measurements=('mean', 'count'), position=False)
+        cropped = roi.crop_image()
+        top, left, bottom, right = roi.bbox
+        assert roi.crop_origin == (top, left)
+        if isinstance(image, np.ndarray): # a view
+            assert np.shares_memory(cropped, stack) and cropped.shape == stack.shape[:1] + (bottom - top, right - left)
+        else:
+            assert tuple(cropped.frame_shape) == (bottom - top, right - left)
+        after = roi.measure_stack(measurements=('mean', 'count'), position=False)
+        np.testing.assert_allclose(after.to_numpy(), before.to_numpy())
+        roi.crop_image() # cropping again is a no-op
+        assert roi.crop_origin == (top, left)
+
+
+def test_lazy_masks_are_broadcast_views(stack_and_rois, tmp_path):
+    stack, image_path, rois, _ = stack_and_rois
+    roi = ROITools.ROI(rois[4])
+    eager = roi.create_mask(stack)
+    lazy = roi.create_mask(stack, lazy=True)
+    assert np.shares_memory(lazy.data, stack) # no copy of the image
+    assert lazy.mask.strides[0] == 0 and not lazy.mask.flags.writeable # the 2D mask, broadcast
+    np.testing.assert_array_equal(lazy.mask, eager.mask)
+    assert lazy.mean() == eager.mean()
+    
+    mapped = np.lib.format.open_memmap(str(tmp_path / 'stack.npy'), mode='w+', dtype=stack.dtype, shape=stack.shape)
+    mapped[:] = stack
+    masked = roi.create_mask(mapped, lazy=True, crop=True)
+    np.testing.assert_array_equal(masked.filled(0), roi.create_mask(stack, crop=True).filled(0))
+    
+    frames = roi.create_mask(pims.open(image_path), lazy=True) # masked as each frame is read
+    assert len(frames) == len(stack)
+    np.testing.assert_array_equal(frames[3].filled(0), eager[3].filled(0))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""ROI_Reader.measure_ROIs() (one pass for all ROIs) against ROI.measure_stack() ROI by ROI"""
+
+import numpy as np
+import pims
+import pytest
+
+import ROI_Benchmark
+import ROITools
+
+MEASUREMENTS = ('mean', 'median', 'std', 'min', 'max', 'sum', 'count', '10-percentile')
+
+
+def per_roi(reader, image, names=None, **kwargs):
+    return {name: ROITools.ROI(reader.rois[name]).measure_stack(image, measurements=MEASUREMENTS, position=False,
+                                                                **kwargs)
+            for name in (names or reader.keys)}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 32])
+def test_matches_measure_stack(stack_and_rois, chunk_size):
+    stack, _, _, zip_path = stack_and_rois
+    reader = ROITools.ROI_Reader(zip_path)
+    table = reader.measure_ROIs(stack, measurements=MEASUREMENTS, chunk_size=chunk_size, position=False)
+    assert len(table) == len(reader.keys) * len(stack)
+    expected = per_roi(reader, stack)
+    for name, rows in table.groupby('name'):
+        assert list(rows['frame']) == list(range(len(stack)))
+        for m in MEASUREMENTS:
+            np.testing.assert_allclose(rows[m].to_numpy(), expected[name][m].to_numpy(), rtol=1e-9, err_msg=m)
+
+
+def test_pims_names_and_progress(stack_and_rois):
+    stack, image_path, _, zip_path = stack_and_rois
+    reader = ROITools.ROI_Reader(zip_path, image=pims.open(image_path))
+    names = reader.keys[::5]
+    calls = []
+    table = reader.measure_ROIs(measurements=MEASUREMENTS, names=names, chunk_size=4, position=False,
+                                progress=lambda done, total: calls.append((done, total)))
+    assert set(table['name']) == set(names) and calls == [(4, 6), (6, 6)]
+    expected = per_roi(reader, stack, names)
+    for name, rows in table.groupby('name'):
+        np.testing.assert_allclose(rows['median'].to_numpy(), expected[name]['median'].to_numpy())
+    
+    def cancel(done, total):
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        reader.measure_ROIs(names=names, chunk_size=2, position=False, progress=cancel)
+
+
+def test_overlapping_rois_keep_their_shared_pixels(tmp_path):
+    image = np.arange(3 * 40 * 50, dtype=np.uint16).reshape(3, 40, 50)
+    rois = [{'name': 'a', 'type': 'rectangle', 'position': 0, 'top': 5, 'left': 5, 'width': 20, 'height': 20},
+            {'name': 'b', 'type': 'rectangle', 'position': 0, 'top': 10, 'left': 10, 'width': 20, 'height': 20}]
+    reader = ROITools.ROI_Reader(ROI_Benchmark.write_roi_zip(str(tmp_path / 'RoiSet.zip'), rois), image=image)
+    table = reader.measure_ROIs(measurements=('sum',), position=False)
+    assert list(table['sum'][table['name'] == 'a']) == [image[t, 5:25, 5:25].sum() for t in range(3)]
+    assert list(table['sum'][table['name'] == 'b']) == [image[t, 10:30, 10:30].sum() for t in range(3)]
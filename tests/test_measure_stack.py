@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""ROI.measure_stack() against masks applied plane by plane with numpy"""
+
+import numpy as np
+import pims
+import pytest
+
+import ROITools
+
+MEASUREMENTS = ('mean', 'median', 'std', 'min', 'max', 'sum', 'count', '95-percentile')
+REFERENCE = {'mean': np.mean, 'median': np.median, 'std': np.std, 'min': np.min, 'max': np.max, 'sum': np.sum,
+             'count': np.size, '95-percentile': lambda v: np.percentile(v, 95)}
+
+
+def plane_mask(roi, shape):
+    """Whole-plane boolean mask of the pixels measured for roi"""
+    mask = np.zeros(shape, dtype=bool)
+    top, left, bottom, right = roi.bbox
+    r0, c0 = max(top, 0), max(left, 0)
+    r1, c1 = min(bottom, shape[0]), min(right, shape[1])
+    if r1 > r0 and c1 > c0:
+        mask[r0:r1, c0:c1] = roi.bbox_mask[r0 - top:r1 - top, c0 - left:c1 - left]
+    return ~mask if roi.mask_type == 'inside' else mask
+
+
+def expected_rows(roi, stack):
+    mask = plane_mask(roi, stack.shape[-2:])
+    return {m: np.array([REFERENCE[m](plane[mask].astype(np.float64)) for plane in stack]) for m in MEASUREMENTS}
+
+
+@pytest.mark.parametrize('masking', ['outside', 'inside'])
+def test_ndarray_stack(stack_and_rois, masking):
+    stack, _, rois, _ = stack_and_rois
+    for roi_dict in rois[:8]:
+        roi = ROITools.ROI(roi_dict, masking=masking)
+        table = roi.measure_stack(stack, measurements=MEASUREMENTS, position=False)
+        assert list(table.index) == list(range(len(stack)))
+        for m, values in expected_rows(roi, stack).items():
+            np.testing.assert_allclose(table[m], values, rtol=1e-9, err_msg=m)
+
+
+def test_pims_stack_and_other_axis(stack_and_rois):
+    stack, image_path, rois, _ = stack_and_rois
+    roi = ROITools.ROI(rois[3], image=pims.open(image_path))
+    table = roi.measure_stack(measurements=MEASUREMENTS, position=False)
+    for m, values in expected_rows(roi, stack).items():
+        np.testing.assert_allclose(table[m], values, rtol=1e-9, err_msg=m)
+    
+    moved = np.moveaxis(stack, 0, 2) # frames on the last axis
+    np.testing.assert_allclose(roi.measure_stack(moved, axis=2, measurements=('mean',), position=False)['mean'],
+                               table['mean'])
+
+
+def test_channels_and_roi_outside_the_image(stack_and_rois):
+    stack, _, rois, _ = stack_and_rois
+    two_channels = np.stack([stack, stack[:, ::-1]], axis=1) # (z, c, y, x)
+    roi = ROITools.ROI(rois[5])
+    table = roi.measure_stack(two_channels, bundle_axes='cyx', measurements=('mean', 'max'), position=False)
+    assert list(table.columns) == ['mean_c0', 'mean_c1', 'max_c0', 'max_c1']
+    np.testing.assert_allclose(table['mean_c1'], expected_rows(roi, stack[:, ::-1])['mean'])
+    
+    outside = ROITools.ROI({'name': 'outside', 'type': 'rectangle', 'position': 0, 'top': 500, 'left': 500,
+                            'width': 4, 'height': 4})
+    table = outside.measure_stack(stack, measurements=('mean', 'count'), position=False)
+    assert table['mean'].isna().all() and (table['count'] == 0).all()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped TIFF/raw stacks and measurements over their named axes"""
+
+import numpy as np
+import pims
+import pytest
+import tifffile
+
+import ROITools
+
+
+def test_tiff_is_mapped_without_reading(stack_and_rois):
+    stack, image_path, _, _ = stack_and_rois
+    mapped = ROITools.open_image(image_path)
+    assert isinstance(mapped, np.memmap) and len(mapped.axes) == 3 and mapped.axes.endswith('yx')
+    np.testing.assert_array_equal(mapped, stack)
+    with pytest.raises(ValueError): # read-only
+        mapped[0, 0, 0] = 1
+
+
+def test_hyperstack_axes(tmp_path):
+    image = np.random.default_rng(0).integers(0, 4000, (3, 4, 2, 64, 80), dtype=np.uint16) # tzcyx
+    path = str(tmp_path / 'hyper.tif')
+    tifffile.imwrite(path, image, imagej=True, metadata={'axes': 'TZCYX'})
+    mapped = ROITools.open_memmap(path)
+    assert mapped.axes == 'tzcyx'
+    
+    roi = ROITools.ROI({'name': 'r', 'type': 'rectangle', 'position': 0, 'top': 10, 'left': 12, 'width': 30,
+                        'height': 20})
+    by_t = roi.measure_stack(mapped, axis='t', bundle_axes='cyx', measurements=('mean',))
+    np.testing.assert_allclose(by_t[['mean_c0', 'mean_c1']].to_numpy(),
+                               image[:, 0, :, 10:30, 12:42].mean(axis=(-2, -1)))
+    by_z = roi.measure_stack(mapped, axis='z', measurements=('max',))
+    np.testing.assert_allclose(by_z['max'], image[0, :, 0, 10:30, 12:42].max(axis=(-2, -1)))
+    
+    reader = pims.open(path) # PIMS sees the pages as one flat stack
+    np.testing.assert_allclose(roi.measure_stack(reader, measurements=('max',), position=False)['max'],
+                               roi.measure_stack(mapped.reshape(-1, 64, 80), measurements=('max',))['max'])
+
+
+def test_raw_and_compressed(tmp_path):
+    image = np.arange(4 * 30 * 40, dtype='>u2').reshape(4, 30, 40)
+    raw = str(tmp_path / 'stack.raw')
+    with open(raw, 'wb') as f:
+        f.write(b'\0' * 16)
+        image.tofile(f)
+    mapped = ROITools.open_memmap(raw, shape=image.shape, dtype='>u2', offset=16)
+    assert mapped.axes == 'zyx'
+    np.testing.assert_array_equal(mapped, image)
+    with pytest.raises(ValueError):
+        ROITools.open_memmap(raw)
+    with pytest.raises(ValueError):
+        ROITools.open_memmap(raw, shape=image.shape, dtype='>u2', offset=16, axes='tyxc')
+    
+    compressed = str(tmp_path / 'compressed.tif')
+    tifffile.imwrite(compressed, image.astype(np.uint16), compression='zlib', photometric='minisblack')
+    with pytest.raises(ValueError):
+        ROITools.open_memmap(compressed)
+    assert not isinstance(ROITools.open_image(compressed), np.memmap) # falls back to PIMS
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Percentile and quantile measurements against np.percentile, on both the histogram and partition paths"""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import ROITools
+
+PERCENTILES = [0, 2.5, 10, 25, 50, 75, 90, 99.9, 100]
+
+
+@pytest.mark.parametrize('dtype, high', [(np.uint8, 256), (np.uint16, 300), (np.uint16, 65535), (np.int16, 2000),
+                                         (np.float32, 1)])
+def test_segments_match_np_percentile(dtype, high):
+    rng = np.random.default_rng(int(high))
+    values = (rng.random((3, 2, 500)) * high).astype(dtype) # (frames, channels, pixels)
+    if dtype == np.int16:
+        values -= 1000
+    offsets = np.array([0, 1, 1, 40, 200, 500]) # includes an empty and a single-pixel segment
+    result = ROITools._order_statistics(values, offsets, PERCENTILES)
+    assert result.shape == (3, 2, 5, len(PERCENTILES))
+    assert np.isnan(result[:, :, 1]).all()
+    for i in (0, 2, 3, 4):
+        segment = values[..., offsets[i]:offsets[i + 1]].astype(np.float64)
+        np.testing.assert_allclose(result[:, :, i], np.moveaxis(np.percentile(segment, PERCENTILES, axis=-1), 0, -1),
+                                   rtol=1e-12, atol=1e-9)
+
+
+def test_uint8_histograms_are_blocked():
+    # 12,000 (frame, segment) groups of 50 px: one histogram for all of them would be 12,000 x 256 int64 bins twice
+    rng = np.random.default_rng(5)
+    values = rng.integers(0, 256, (4, 3000 * 50), dtype=np.uint8)
+    offsets = np.arange(0, values.shape[-1] + 1, 50)
+    tracemalloc.start()
+    try:
+        result = ROITools._order_statistics(values, offsets, [50, 90])
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 * 3000 * 256 * 8 // 4
+    expected = np.percentile(values.reshape(4, 3000, 50).astype(np.float64), [50, 90], axis=-1)
+    np.testing.assert_allclose(result, np.moveaxis(expected, 0, -1))
+
+
+def test_measurement_names(stack_and_rois):
+    stack, _, rois, _ = stack_and_rois
+    assert ROITools._expand_measurements(('quantiles', 'median', '50-percentile')) == \
+        ('25-percentile', '50-percentile', '75-percentile', 'median')
+    assert ROITools._expand_measurements('10-quantiles')[0] == '10-percentile'
+    with pytest.raises(ValueError):
+        ROITools._expand_measurements(('101-percentile',))
+    
+    roi = ROITools.ROI(rois[0])
+    table = roi.measure_stack(stack, measurements=('median', '5-quantiles', '99-percentile'), position=False)
+    assert list(table.columns) == ['median', '20-percentile', '40-percentile', '60-percentile', '80-percentile',
+                                   '99-percentile']
+    rows, cols, keep = roi._measured_region(stack.shape[-2:])
+    pixels = stack[:, rows, cols][:, keep]
+    np.testing.assert_allclose(table['99-percentile'], np.percentile(pixels, 99, axis=-1))
+    np.testing.assert_allclose(table['median'], np.median(pixels, axis=-1))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Position-aware measurement: ROIs bound to slices/frames are measured, and frames read, only there"""
+
+import numpy as np
+
+import ROI_Benchmark
+import ROITools
+
+
+class CountingReader:
+    """PIMS-like reader recording the frames read"""
+    
+    def __init__(self, stack):
+        self.stack = stack
+        self.frame_shape = stack.shape[1:]
+        self.read = set()
+    
+    def __len__(self):
+        return len(self.stack)
+    
+    def __getitem__(self, i):
+        self.read.add(i)
+        return self.stack[i]
+
+
+def bound_rois(rois):
+    """First ROI on every slice, then one ROI each on slices 2, 4 and 9 (past the end of a 6 slice stack)"""
+    return [dict(rois[0], position=0)] + [dict(roi, position={'channel': 0, 'slice': z, 'frame': 0})
+                                          for roi, z in zip(rois[1:4], (2, 4, 9))]
+
+
+def test_bound_rois_are_measured_on_their_slices(stack_and_rois, tmp_path):
+    stack, _, rois, _ = stack_and_rois
+    rois = bound_rois(rois)
+    reader = ROITools.ROI_Reader(ROI_Benchmark.write_roi_zip(str(tmp_path / 'bound.zip'), rois))
+    table = reader.measure_ROIs(stack, measurements=('mean',))
+    frames = {name: list(rows['frame']) for name, rows in table.groupby('name')}
+    assert frames == {rois[0]['name']: list(range(6)), rois[1]['name']: [1], rois[2]['name']: [3]}
+    for name, rows in table.groupby('name'):
+        everywhere = ROITools.ROI(reader.rois[name]).measure_stack(stack, measurements=('mean',), position=False)
+        np.testing.assert_allclose(rows['mean'].to_numpy(), everywhere['mean'].to_numpy()[rows['frame']])
+    
+    roi = ROITools.ROI(reader.rois[rois[2]['name']])
+    assert list(roi.measure_stack(stack).index) == [3]
+    assert len(ROITools.ROI(reader.rois[rois[3]['name']]).measure_stack(stack)) == 0
+    assert len(reader.measure_ROIs(stack, position=False)) == 4 * 6
+
+
+def test_unbound_frames_are_not_read(stack_and_rois, tmp_path):
+    stack, _, rois, _ = stack_and_rois
+    reader = ROITools.ROI_Reader(ROI_Benchmark.write_roi_zip(str(tmp_path / 'bound.zip'), bound_rois(rois)[1:]))
+    source = CountingReader(stack)
+    reader.measure_ROIs(ROITools.FrameSource(source), chunk_size=2)
+    assert source.read == {1, 3}
+    
+    source = CountingReader(stack)
+    roi = ROITools.ROI(reader.rois[reader.keys[1]])
+    roi.measure_stack(ROITools.FrameSource(source))
+    assert source.read == {3}
+
+
+def test_hyperstack_positions():
+    image = np.random.default_rng(0).integers(0, 100, (4, 3, 32, 32), dtype=np.uint16) # (t, z, y, x)
+    roi = ROITools.ROI({'name': 'r', 'type': 'rectangle', 'top': 2, 'left': 3, 'width': 10, 'height': 8,
+                        'position': {'channel': 0, 'slice': 2, 'frame': 3}})
+    assert roi.planes('z').tolist() == [1] and roi.planes('t').tolist() == [2] and roi.planes('c') is None
+    by_t = roi.measure_stack(image[:, 1], position='t', measurements=('sum',))
+    assert list(by_t.index) == [2] and by_t['sum'].iloc[0] == image[2, 1, 2:10, 3:13].sum()
+    roi.set_pos('t', range(1, 5))
+    assert len(roi.measure_stack(image[:, 1], position='t')) == 4
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""ImagePyramid levels, where they are stored, and measurements at a level"""
+
+import os
+
+import numpy as np
+import pytest
+
+import ROITools
+
+
+def test_levels_are_block_means(tmp_path):
+    image = np.random.default_rng(0).integers(0, 4000, (3, 256, 192), dtype=np.uint16)
+    pyramid = ROITools.ImagePyramid(image, min_size=32)
+    assert len(pyramid) == 3 and pyramid.scale(2) == 0.25
+    expected = image.astype(np.float64).reshape(3, 64, 4, 48, 4).mean(axis=(2, 4))
+    np.testing.assert_allclose(pyramid[2], expected, rtol=1e-5)
+    odd = ROITools.ImagePyramid(np.arange(35, dtype=np.uint8).reshape(7, 5), min_size=2)
+    assert odd[1].shape == odd.plane_shape(1) == (4, 3)
+    with pytest.raises(IndexError):
+        pyramid[3]
+
+
+def test_default_store_is_temporary(stack_and_rois):
+    _, image_path, _, _ = stack_and_rois
+    pyramid = ROITools.ImagePyramid(image_path, min_size=16)
+    pyramid[1]
+    store = pyramid.store
+    assert not os.path.exists(image_path + '.pyramid')
+    assert os.path.dirname(store) != os.path.dirname(image_path)
+    del pyramid
+    assert not os.path.exists(store)
+
+
+def test_store_next_to_image_is_reused(stack_and_rois):
+    _, image_path, _, _ = stack_and_rois
+    first = ROITools.ImagePyramid(image_path, store=True, min_size=16)
+    first[2]
+    level = os.path.join(image_path + '.pyramid', 'level2.npy')
+    built = os.path.getmtime(level)
+    second = ROITools.ImagePyramid(image_path, store=True, min_size=16)
+    np.testing.assert_array_equal(second[2], first[2])
+    assert os.path.getmtime(level) == built
+    with pytest.raises(ValueError):
+        ROITools.ImagePyramid(np.zeros((64, 64)), store=True)
+
+
+def test_level_measurements(stack_and_rois, monkeypatch):
+    stack, image_path, _, zip_path = stack_and_rois
+    reader = ROITools.ROI_Reader(zip_path, image=image_path)
+    full = reader.measure_ROIs(measurements=('mean', 'count'), position=False)
+    level = reader.measure_ROIs(measurements=('mean', 'count'), position=False, level=1)
+    assert list(level['name']) == list(full['name'])
+    error = np.abs(level['mean'] - full['mean']) / full['mean']
+    assert error.median() < 0.02
+    assert np.abs(level['count'] / full['count'] - 1).median() < 0.25 # counts in full resolution pixels
+    
+    built = []
+    monkeypatch.setattr(ROITools.ImagePyramid, '_build', lambda self, k, path, build=ROITools.ImagePyramid._build:
+                        built.append(k) or build(self, k, path))
+    ROITools._PYRAMIDS.clear()
+    image = ROITools.open_image(image_path)
+    tables = [ROITools.ROI(reader.rois[name]).measure_stack(image, measurements=('mean',), level=1, position=False)
+              for name in reader.keys]
+    assert built == [1] # one pyramid for all ROIs of the image
+    per_roi = np.concatenate([table['mean'].to_numpy() for table in tables])
+    np.testing.assert_allclose(per_roi, level['mean'])
+
+
+def test_scale_roi():
+    rect = {'name': 'r', 'type': 'rectangle', 'position': 0, 'top': 10, 'left': 21, 'width': 40, 'height': 12}
+    half = ROITools.scale_roi(rect, 0.5)
+    assert (half['top'], half['left'], half['width'], half['height']) == (5, 11, 20, 6)
+    channel = {'type': 'channel', 'name': 'c', 'position': 0, 'bbox': (10, 20, 14, 28), 'mask': np.ones((4, 8), bool)}
+    scaled = ROITools.scale_roi(channel, 0.5)
+    assert scaled['bbox'] == (5, 10, 7, 14) and scaled['mask'].shape == (2, 4) and scaled['mask'].all()
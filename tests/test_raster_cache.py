@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""RasterCache: keys follow geometry, LRU bound, on-disk store and its invalidation"""
+
+import os
+
+import numpy as np
+
+import ROI_Benchmark
+import ROITools
+
+
+def test_keys_follow_geometry_only(stack_and_rois):
+    rois = stack_and_rois[2]
+    cache = ROITools.RasterCache()
+    roi = dict(rois[0])
+    renamed = dict(roi, name='other', position=3)
+    moved = dict(roi, left=roi['left'] + 1)
+    assert cache.key(roi) == cache.key(renamed) != cache.key(moved)
+    assert cache.key(roi) != cache.key(roi, frame_shape=(128, 160))
+
+
+def test_hits_and_lru(stack_and_rois):
+    rois = stack_and_rois[2]
+    cache = ROITools.RasterCache(max_entries=5)
+    first = [ROITools.ROI(roi, cache=cache) for roi in rois[:5]]
+    assert (cache.hits, cache.misses) == (0, 5)
+    again = ROITools.ROI(rois[0], cache=cache)
+    assert cache.hits == 1 and again.bbox == first[0].bbox
+    np.testing.assert_array_equal(again.bbox_mask, first[0].bbox_mask)
+    for roi in rois[5:]:
+        ROITools.ROI(roi, cache=cache)
+    assert len(cache) == 5
+    uncached = ROITools.ROI(rois[0], cache=False)
+    assert uncached.bbox == first[0].bbox
+
+
+def test_disk_store_is_reused_and_invalidated(stack_and_rois, tmp_path):
+    rois = stack_and_rois[2]
+    zip_path = ROI_Benchmark.write_roi_zip(str(tmp_path / 'RoiSet.zip'), rois)
+    reader = ROITools.ROI_Reader(zip_path, disk_cache=True)
+    expected = {k: ROITools.ROI(reader.rois[k], cache=False) for k in reader.keys}
+    for k in reader.keys:
+        ROITools.ROI(reader.rois[k], cache=reader.cache)
+    store = zip_path + '.rastercache'
+    assert len([f for f in os.listdir(store) if f.endswith('.npz')]) == len(reader.keys)
+    
+    reopened = ROITools.ROI_Reader(zip_path, disk_cache=True) # a new run: nothing in memory
+    for k in reopened.keys:
+        roi = ROITools.ROI(reopened.rois[k], cache=reopened.cache)
+        assert roi.bbox == expected[k].bbox
+        np.testing.assert_array_equal(roi.bbox_mask, expected[k].bbox_mask)
+    assert reopened.cache.hits == len(reopened.keys) and reopened.cache.misses == 0
+    
+    ROI_Benchmark.write_roi_zip(zip_path, rois[:3]) # the ROI set changed: the store is dropped
+    os.utime(zip_path, ns=(0, 0))
+    changed = ROITools.ROI_Reader(zip_path, disk_cache=True)
+    assert not [f for f in os.listdir(store) if f.endswith('.npz')]
+    ROITools.ROI(changed.rois[changed.keys[0]], cache=changed.cache)
+    assert changed.cache.misses == 1
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""rasterize_rois() against skimage.draw and pixel-center inclusion tests"""
+
+import numpy as np
+import pytest
+
+import ROI_Benchmark
+import ROITools
+
+skimage_draw = pytest.importorskip('skimage.draw')
+from skimage.measure import points_in_poly # noqa: E402
+
+
+def pixels(raster):
+    (top, left, _, _), mask = raster
+    rows, cols = np.nonzero(mask)
+    return set(zip((rows + top).tolist(), (cols + left).tolist()))
+
+
+def test_synthetic_sets_match_skimage():
+    report = ROI_Benchmark.compare_rasterizers(n_rois=200, n_vertices=60, shape=(256, 256), seed=3)
+    assert report['mismatched_rois'] == 0
+    assert {'rectangle', 'oval', 'polygon'} <= set(report['kinds'])
+
+
+def test_polygons_fill_pixel_centers():
+    rng = np.random.default_rng(7)
+    for _ in range(20):
+        angles = np.sort(rng.uniform(0, 2 * np.pi, 25))
+        radius = rng.uniform(5, 30, 25)
+        x, y = 40 + radius * np.cos(angles) + 0.013, 40 + radius * np.sin(angles) + 0.029 # centers off the outline
+        roi = {'type': 'polygon', 'name': 'p', 'x': x.tolist(), 'y': y.tolist()}
+        rr, cc = np.mgrid[0:80, 0:80]
+        inside = points_in_poly(np.column_stack([cc.ravel() + 0.5, rr.ravel() + 0.5]), np.column_stack([x, y]))
+        assert pixels(ROITools.rasterize(roi)) == set(zip(rr.ravel()[inside].tolist(), cc.ravel()[inside].tolist()))
+
+
+def test_other_roi_types():
+    rectangle = {'type': 'rectangle', 'top': 3, 'left': 4, 'width': 6, 'height': 5}
+    as_polygon = {'type': 'polygon', 'x': [4, 10, 10, 4], 'y': [3, 3, 8, 8]}
+    assert pixels(ROITools.rasterize(rectangle)) == pixels(ROITools.rasterize(as_polygon))
+    
+    oval = {'type': 'oval', 'top': 2.0, 'left': 5.0, 'width': 17.0, 'height': 10.0}
+    assert pixels(ROITools.rasterize(oval)) == set(zip(*(a.tolist() for a in skimage_draw.ellipse(7, 13.5, 5, 8.5))))
+    
+    line = {'type': 'line', 'x1': 2, 'y1': 3, 'x2': 20, 'y2': 11, 'width': 0}
+    assert pixels(ROITools.rasterize(line)) == set(zip(*(a.tolist() for a in skimage_draw.line(3, 2, 11, 20))))
+    polyline = {'type': 'polyline', 'x': [0, 10, 10], 'y': [0, 0, 5]}
+    assert pixels(ROITools.rasterize(polyline)) == {(0, c) for c in range(11)} | {(r, 10) for r in range(6)}
+    point = {'type': 'point', 'x': [3.2, 7.7], 'y': [1.0, 4.4]}
+    assert pixels(ROITools.rasterize(point)) == {(1, 3), (4, 8)}
+    
+    # composite with a hole: outer square minus inner square (even-odd)
+    def square(a, b):
+        return [('MOVETO', a, a), ('LINETO', b, a), ('LINETO', b, b), ('LINETO', a, b)]
+    composite = {'type': 'composite', 'paths': [square(0, 10), square(3, 6)]}
+    expected = {(r, c) for r in range(10) for c in range(10)} - {(r, c) for r in range(3, 6) for c in range(3, 6)}
+    assert pixels(ROITools.rasterize(composite)) == expected
+    
+    thick = {'type': 'line', 'x1': 0, 'y1': 5, 'x2': 10, 'y2': 5, 'width': 4}
+    assert pixels(ROITools.rasterize(thick)) == {(r, c) for r in range(3, 7) for c in range(10)}
+    assert ROITools.rasterize({'type': 'rectangle', 'top': 0, 'left': 0, 'width': 0, 'height': 3})[0] == (0, 0, 0, 0)
+    with pytest.raises(ValueError):
+        ROITools.rasterize({'type': 'spline', 'name': 'x'})
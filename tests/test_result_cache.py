@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""ResultCache: reuse of stored rows, and invalidation when ROIs, images or settings change"""
+
+import numpy as np
+import pandas as pd
+import tifffile
+
+import ROI_Benchmark
+import ROITools
+
+
+def measure(zip_path, image_path, store, **kwargs):
+    cache = ROITools.ResultCache(store) # a new cache object per run: rows come from the store
+    reader = ROITools.ROI_Reader(zip_path, image=image_path)
+    table = reader.measure_ROIs(measurements=('mean', 'max'), position=False, result_cache=cache, **kwargs)
+    return table, cache
+
+
+def assert_same(table, zip_path, image_path):
+    expected = ROITools.ROI_Reader(zip_path, image=image_path).measure_ROIs(measurements=('mean', 'max'),
+                                                                           position=False)
+    pd.testing.assert_frame_equal(table.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+
+
+def test_edited_rois_are_measured_again(stack_and_rois, tmp_path):
+    _, image_path, rois, zip_path = stack_and_rois
+    store = str(tmp_path / 'cache')
+    table, cache = measure(zip_path, image_path, store)
+    assert (cache.hits, cache.misses) == (0, 24)
+    assert_same(table, zip_path, image_path)
+    
+    table, cache = measure(zip_path, image_path, store)
+    assert (cache.hits, cache.misses) == (24, 0)
+    assert_same(table, zip_path, image_path)
+    
+    edited = [dict(roi) for roi in rois]
+    edited[0] = dict(edited[0], left=edited[0]['left'] + 3) # moved
+    edited[1] = dict(edited[1], name='renamed') # same geometry, new name
+    edited_zip = ROI_Benchmark.write_roi_zip(str(tmp_path / 'edited.zip'), edited)
+    table, cache = measure(edited_zip, image_path, store)
+    assert (cache.hits, cache.misses) == (23, 1)
+    assert set(table['name']) == {roi['name'] for roi in edited}
+    assert_same(table, edited_zip, image_path)
+
+
+def test_image_and_settings_changes(stack_and_rois, tmp_path):
+    stack, image_path, _, zip_path = stack_and_rois
+    store = str(tmp_path / 'cache')
+    measure(zip_path, image_path, store)
+    
+    _, cache = measure(zip_path, image_path, store, names=ROITools.ROI_Reader(zip_path).keys[:5], chunk_size=2)
+    assert cache.misses == 0 # chunk size does not change results
+    reader = ROITools.ROI_Reader(zip_path, image=image_path)
+    cache = ROITools.ResultCache(store)
+    reader.measure_ROIs(measurements=('mean',), position=False, result_cache=cache)
+    assert cache.misses == 24 # other measurements
+    
+    tifffile.imwrite(image_path, stack[::-1]) # new image content under the same name
+    table, cache = measure(zip_path, image_path, store)
+    assert cache.misses == 24
+    assert_same(table, zip_path, image_path)
+    
+    in_memory = ROITools.ResultCache()
+    roi = ROITools.ROI(reader.rois[reader.keys[2]])
+    first = roi.measure_stack(stack, position=False, result_cache=in_memory)
+    changed = stack.copy()
+    changed[0, 0, 0] += 1
+    roi.measure_stack(changed, position=False, result_cache=in_memory)
+    again = roi.measure_stack(stack, position=False, result_cache=in_memory)
+    assert (in_memory.hits, in_memory.misses) == (1, 2)
+    pd.testing.assert_frame_equal(first, again)
+    np.testing.assert_allclose(first.to_numpy(), roi.measure_stack(stack, position=False).to_numpy())
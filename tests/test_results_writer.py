@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""ResultsWriter: streamed rows against the measurement tables, for every backend that is installed"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ROITools
+
+
+def read_back(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.h5'):
+        return pd.read_hdf(path, 'measurements')
+    return pd.read_csv(path)
+
+
+@pytest.mark.parametrize('extension, module', [('.csv', None), ('.parquet', 'pyarrow'), ('.h5', 'tables')])
+def test_streamed_rows_match_the_table(stack_and_rois, tmp_path, extension, module):
+    if module is not None:
+        pytest.importorskip(module)
+    stack, _, _, zip_path = stack_and_rois
+    reader = ROITools.ROI_Reader(zip_path)
+    path = str(tmp_path / ('results' + extension))
+    with ROITools.ResultsWriter(path, image='stack', buffer_rows=50) as sink:
+        assert reader.measure_ROIs(stack, measurements=('mean', 'max'), chunk_size=2, sink=sink,
+                                   position=False) is None
+        ROITools.ROI(reader.rois[reader.keys[0]]).measure_stack(stack, measurements=('mean', 'max'), sink=sink,
+                                                                position=False)
+    assert len(sink) == 25 * 6
+    rows = read_back(path)
+    assert list(rows.columns) == ['image', 'name', 'c', 'z', 't', 'mean', 'max']
+    assert (rows['image'] == 'stack').all() and (rows['c'] == -1).all() and (rows['t'] == -1).all()
+    
+    expected = reader.measure_ROIs(stack, measurements=('mean', 'max'), position=False)
+    measured = rows.iloc[:24 * 6].sort_values(['name', 'z']).reset_index(drop=True)
+    expected = expected.sort_values(['name', 'frame']).reset_index(drop=True)
+    assert (measured['name'] == expected['name']).all() and (measured['z'] == expected['frame']).all()
+    np.testing.assert_allclose(measured['mean'], expected['mean'])
+    
+    with ROITools.ResultsWriter(path, image='again') as sink: # appends
+        sink.write(expected.iloc[:3])
+    assert len(read_back(path)) == 25 * 6 + 3 and (read_back(path)['image'] == 'again').sum() == 3
+    with ROITools.ResultsWriter(path, append=False) as sink: # replaces
+        sink.write(expected.iloc[:3])
+    assert len(read_back(path)) == 3
+
+
+def test_writers_on_one_dataset_keep_their_parts(stack_and_rois, tmp_path):
+    stack, _, _, zip_path = stack_and_rois
+    path = str(tmp_path / 'results.parquet')
+    table = ROITools.ROI_Reader(zip_path).measure_ROIs(stack, measurements=('mean',), position=False)
+    writers = [ROITools.ResultsWriter(path, image=image) for image in ('first', 'second', 'third')]
+    assert len({writer.part for writer in writers}) == 3 # same process, same second
+    pytest.importorskip('pyarrow') # the part names are checked above without it
+    for writer in writers: # one writer per image, back to back
+        writer.write(table)
+        writer.close()
+    rows = read_back(path)
+    assert len(rows) == 3 * len(table)
+    assert rows['image'].value_counts().to_dict() == {'first': len(table), 'second': len(table), 'third': len(table)}
+
+
+def test_channels_become_rows_and_columns_are_checked(tmp_path):
+    table = pd.DataFrame({'mean_c0': [1.0, 2.0], 'mean_c1': [3.0, 4.0]}, index=[4, 5])
+    rows = ROITools._results_rows(table, 'img', name='cell', axis='t')
+    assert rows[['c', 't', 'mean']].values.tolist() == [[0, 4, 1], [0, 5, 2], [1, 4, 3], [1, 5, 4]]
+    assert (rows['z'] == -1).all() and (rows['name'] == 'cell').all()
+    
+    sink = ROITools.ResultsWriter(str(tmp_path / 'out.csv'))
+    sink.write(table, name='cell')
+    with pytest.raises(ValueError):
+        sink.write(pd.DataFrame({'max': [1.0]}), name='cell')
+    sink.close()
+    with pytest.raises(ValueError):
+        ROITools.ResultsWriter(str(tmp_path / 'out.txt'))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""roi_from_mask(): connected components as ROIs, 2D and 3D"""
+
+import numpy as np
+import numpy.ma as ma
+
+import ROITools
+
+
+def _blobs():
+    mask = np.zeros((6, 40, 50), dtype=bool)
+    mask[1:4, 5:15, 5:20] = True # spans planes 1-3
+    mask[4, 25:30, 30:45] = True # single plane 4
+    mask[0, 35:37, 2:4] = True # 4 voxels
+    return mask
+
+
+def test_components_match_labels():
+    mask = _blobs()
+    rois, labels = ROITools.roi_from_mask(mask, return_labels=True)
+    assert len(rois) == labels.max() == 3
+    for roi in rois:
+        assert roi.attribs['area'] == int((labels == roi.attribs['label']).sum())
+    assert len(ROITools.roi_from_mask(mask, min_area=5)) == 2
+
+
+def test_planes_of_3d_components():
+    image = np.random.default_rng(0).random((6, 40, 50))
+    small, spanning, single = ROITools.roi_from_mask(_blobs(), image=image)
+    assert spanning.attribs['z_range'] == (1, 4)
+    assert spanning.planes('z').tolist() == [1, 2, 3]
+    assert single.position == {'slice': 5}
+    assert single.planes('z').tolist() == [4]
+    
+    table = spanning.measure_stack(image, measurements=('mean', 'count'))
+    assert table.index.tolist() == [1, 2, 3] # never measured on planes the object does not touch
+    np.testing.assert_allclose(table['mean'], image[1:4, 5:15, 5:20].mean(axis=(1, 2)))
+    assert (table['count'] == 150).all()
+    np.testing.assert_allclose(spanning.attribs['mean_intensity'], image[1:4, 5:15, 5:20].mean())
+
+
+def test_2d_masked_array():
+    data = np.zeros((30, 30))
+    data[2:6, 3:9] = 1
+    data[20:25, 20:22] = 1
+    rois = ROITools.roi_from_mask(ma.masked_equal(data, 0), connectivity=1)
+    assert [roi.attribs['bbox'] for roi in rois] == [(2, 3, 6, 9), (20, 20, 25, 22)]
+    assert all(roi.planes('z') is None for roi in rois)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""ROISet: array-backed ROIs against the read_roi dicts they were built from"""
+
+import re
+
+import numpy as np
+
+import ROITools
+
+
+def test_rasters_and_bboxes_match_the_dicts(stack_and_rois):
+    _, _, rois, zip_path = stack_and_rois
+    roiset = ROITools.ROI_Reader(zip_path).get_ROISet()
+    assert len(roiset) == len(rois) and list(roiset.names) == [roi['name'] for roi in rois]
+    for roi, view, (bbox, mask) in zip(rois, roiset, roiset.rasterize()):
+        expected_bbox, expected_mask = ROITools.rasterize(roi)
+        assert view.kind == roi['type'] and bbox == expected_bbox
+        np.testing.assert_array_equal(mask, expected_mask)
+        top, left, bottom, right = view.bbox # covers every pixel of the ROI
+        assert top <= bbox[0] and left <= bbox[1] and bottom >= bbox[2] and right >= bbox[3]
+
+
+def test_select_take_and_views(stack_and_rois):
+    _, _, rois, _ = stack_and_rois
+    rois = [dict(roi, position={'channel': 0, 'slice': i % 3, 'frame': 0}) for i, roi in enumerate(rois)]
+    roiset = ROITools.ROISet.from_dicts(rois)
+    
+    box = (20, 30, 70, 90)
+    selected = roiset.select(name='^(oval|poly)', z=[2], intersects=box)
+    expected = [bool(re.search('^(oval|poly)', roi['name'])) and roi['position']['slice'] in (0, 2)
+                and view.bbox[0] < 70 and view.bbox[2] > 20 and view.bbox[1] < 90 and view.bbox[3] > 30
+                for roi, view in zip(rois, roiset)]
+    assert selected.tolist() == expected and any(expected)
+    
+    subset = roiset.filter(kind='polygon')
+    assert set(subset.kinds) == {'polygon'}
+    names = list(subset.names)
+    reversed_set = subset[::-1]
+    assert list(reversed_set.names) == names[::-1]
+    for name in names:
+        np.testing.assert_array_equal(reversed_set[name].vertices, subset[name].vertices)
+        assert reversed_set[name].to_dict()['x'] == subset[name].to_dict()['x']
+    
+    view = roiset[rois[4]['name']]
+    assert view.position == {'channel': 0, 'slice': 1, 'frame': 0}
+    roi = view.to_roi()
+    assert roi.name == rois[4]['name'] and roi.z == 1
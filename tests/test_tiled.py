@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Tiled measurement (measure_tiled) against the one-pass measure_ROIs(), and the SpatialIndex it uses"""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import ROITools
+from ROI_Benchmark import synthetic_rois, synthetic_stack, write_roi_zip
+
+MEASUREMENTS = ('mean', 'std', 'min', 'max', 'sum', 'count', 'median', '90-percentile')
+
+
+def _compare(tiled, full):
+    assert list(tiled['name']) == list(full['name']) and list(tiled['frame']) == list(full['frame'])
+    for column in full.columns[2:]:
+        np.testing.assert_allclose(tiled[column].to_numpy(float), full[column].to_numpy(float), rtol=1e-9, err_msg=column)
+
+
+@pytest.fixture
+def reader(tmp_path):
+    rois = synthetic_rois(60, shape=(300, 340), n_vertices=50, seed=5)
+    rois.append({'name': 'big', 'type': 'rectangle', 'position': 0, 'top': 10, 'left': 10, 'width': 300, 'height': 250})
+    return ROITools.ROI_Reader(write_roi_zip(str(tmp_path / 'RoiSet.zip'), rois))
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.uint8, np.float32])
+@pytest.mark.parametrize('tile_size', [64, 100, 512])
+def test_matches_measure_rois(reader, dtype, tile_size):
+    image = synthetic_stack((3, 300, 340), dtype=dtype, seed=3)
+    full = reader.measure_ROIs(image, measurements=MEASUREMENTS)
+    _compare(reader.measure_tiled(image, tile_size=tile_size, measurements=MEASUREMENTS), full)
+
+
+def test_channels_and_no_kept_indexes(reader):
+    image = synthetic_stack((2, 2, 300, 340), seed=4)
+    full = reader.measure_ROIs(image, bundle_axes='cyx', measurements=('mean', 'median', 'std'))
+    tiled = reader.measure_tiled(image, tile_size=80, bundle_axes='cyx', measurements=('mean', 'median', 'std'),
+                                 index_bytes=0)
+    assert 'median_c1' in tiled.columns
+    _compare(tiled, full)
+
+
+def test_memmap_and_sink(reader, tmp_path):
+    synthetic_stack((5, 300, 340), path=str(tmp_path / 'stack.tif'), seed=6)
+    image = ROITools.open_image(str(tmp_path / 'stack.tif'))
+    full = reader.measure_ROIs(image).sort_values(['name', 'frame'])
+    with ROITools.ResultsWriter(str(tmp_path / 'tiled.csv'), image='stack') as sink:
+        assert reader.measure_tiled(image, tile_size=128, sink=sink) is None
+    from pandas import read_csv
+    rows = read_csv(str(tmp_path / 'tiled.csv')).sort_values(['name', 'z', 't']).reset_index(drop=True)
+    np.testing.assert_allclose(rows['mean'], full['mean'])
+
+
+def test_inside_masking_is_built_per_tile():
+    roi = ROITools.ROI({'name': 'r', 'type': 'oval', 'position': 0, 'top': 40, 'left': 30, 'width': 90, 'height': 70},
+                       masking='inside', frame_shape=(200, 220))
+    rows, cols, keep = roi._measured_region((200, 220))
+    expected = np.ravel_multi_index(np.nonzero(keep), (200, 220))
+    pixels = []
+    for tile in ROITools._tiles((200, 220), 64):
+        ids, flat_index, offsets = ROITools._tile_segments([roi], np.array([0]), tile)
+        top, left, bottom, right = tile
+        pixels.append((flat_index // (right - left) + top) * 220 + flat_index % (right - left) + left)
+    assert np.array_equal(np.sort(np.concatenate(pixels)), expected)
+
+
+def test_peak_memory_follows_the_tile(tmp_path):
+    shape = (2, 2048, 2048)
+    synthetic_stack(shape, path=str(tmp_path / 'large.tif'))
+    image = ROITools.open_image(str(tmp_path / 'large.tif'))
+    rois = [{'name': 'plane', 'type': 'rectangle', 'position': 0, 'top': 1, 'left': 1, 'width': 2046, 'height': 2046}]
+    reader = ROITools.ROI_Reader(write_roi_zip(str(tmp_path / 'one.zip'), rois))
+    reader.measure_tiled(image, tile_size=256, measurements=('mean', 'median'), index_bytes=0) # warm caches
+    tracemalloc.start()
+    try:
+        tiled = reader.measure_tiled(image, tile_size=256, measurements=('mean', 'median'), index_bytes=0)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 2048 * 2048 * 2 # well below one plane (its int32 pixel index alone would be twice that)
+    np.testing.assert_allclose(tiled['median'], reader.measure_ROIs(image, measurements=('median',))['median'])
+
+
+def test_spatial_index_queries():
+    rng = np.random.default_rng(0)
+    tops, lefts = rng.integers(0, 900, 500), rng.integers(0, 900, 500)
+    boxes = np.stack([tops, lefts, tops + rng.integers(1, 100, 500), lefts + rng.integers(1, 100, 500)], axis=1)
+    index = ROITools.SpatialIndex(boxes, cell_size=64)
+    top, left, bottom, right = 200, 300, 450, 520
+    brute = np.nonzero((boxes[:, 0] < bottom) & (boxes[:, 2] > top) & (boxes[:, 1] < right) & (boxes[:, 3] > left))[0]
+    assert sorted(index.query(top, left, bottom, right).tolist()) == brute.tolist()